@@ -31,6 +31,18 @@ def print_help(exit_status):
     print('Type "theano-cache cleanup" to delete keys in the old '
           'format/code version')
     print('Type "theano-cache purge" to force deletion of the cache directory')
+    print('Type "theano-cache export <archive>" to write all the compiled '
+          'modules of the cache directory to an archive')
+    print('Type "theano-cache import <archive>" to install in the cache '
+          'directory the modules of an archive made with "export" or '
+          'theano.compile.export_compiled. Add "--force" to install them '
+          'even if they were compiled in a different environment')
+    print('Type "theano-cache gc [--max-size MB] [--max-entries N] '
+          '[--min-age SECONDS]" to delete the least recently used modules '
+          'until the cache fits in the given budget (by default '
+          'cmodule.max_cache_size and cmodule.max_cache_entries). Modules '
+          'used in the last --min-age seconds (default 3600) are kept. '
+          'It can run while other processes compile')
     print('Type "theano-cache basecompiledir" '
           'to print the parent of the cache directory')
     print('Type "theano-cache basecompiledir list" '
@@ -84,6 +96,27 @@ def main():
             print(theano.config.base_compiledir)
         else:
             print_help(exit_status=1)
+    elif len(sys.argv) == 3 and sys.argv[1] == 'export':
+        n = theano.gof.compiledir.export_modules(None, sys.argv[2])
+        print('Exported %d modules to %s' % (n, sys.argv[2]))
+    elif (len(sys.argv) in (3, 4) and sys.argv[1] == 'import' and
+          sys.argv[3:] in ([], ['--force'])):
+        n = theano.gof.compiledir.import_modules(
+            sys.argv[2], force=(sys.argv[3:] == ['--force']))
+        print('Installed %d modules in %s' % (n, config.compiledir))
+    elif len(sys.argv) % 2 == 0 and sys.argv[1] == 'gc':
+        options = dict(zip(sys.argv[2::2], sys.argv[3::2]))
+        if not set(options) <= set(['--max-size', '--max-entries',
+                                    '--min-age']):
+            print_help(exit_status=1)
+        max_size = options.get('--max-size')
+        max_entries = options.get('--max-entries')
+        cache = get_module_cache(init_args=dict(do_refresh=False))
+        n = cache.evict(
+            max_size=None if max_size is None else float(max_size),
+            max_entries=None if max_entries is None else int(max_entries),
+            min_age=float(options.get('--min-age', 60 * 60)))
+        print('Deleted %d modules from %s' % (n, cache.dirname))
     elif len(sys.argv) == 3 and sys.argv[1] == 'basecompiledir':
         if sys.argv[2] == 'list':
             theano.gof.compiledir.basecompiledir_ls()
@@ -25,4 +25,5 @@ from theano.compile.pfunc import pfunc, Param, rebuild_collect_shared
 
 from theano.compile.builders import *
 
-from theano.compile.function import function, function_dump
+from theano.compile.function import (function, function_many, function_dump,
+                                     export_compiled, import_compiled)
@@ -5,17 +5,24 @@ Define the `function` function.
 from __future__ import absolute_import, print_function, division
 
 import logging
+import multiprocessing
+import os
+import pickle
+import threading
+import time
 
 import traceback as tb
 import re
 
-from six import string_types
+from six import BytesIO, string_types
 from theano.compile.io import In
-from theano.compile.function_module import orig_function
+from theano.compile.function_module import Function, orig_function
+from theano.compile.sharedvalue import SharedVariable
+from theano.gof.op import ops_with_inner_function
 from theano.compile.pfunc import pfunc
 import numpy as np
 import warnings
-from theano import compat
+from theano import compat, config, gof
 
 __docformat__ = "restructuredtext en"
 _logger = logging.getLogger('theano.compile.function')
@@ -73,6 +80,85 @@ def function_dump(filename, inputs, outputs=None, mode=None, updates=None,
         pickler.dump(d)
 
 
+def _compiled_module_files(fn, seen):
+    """
+    Return the paths of the C modules used by Function `fn`, including the
+    ones used by the functions inside its nodes (e.g. Scan).
+
+    """
+    if id(fn) in seen:
+        return []
+    seen.add(id(fn))
+    module_files = []
+    for thunk in getattr(fn.fn, 'thunks', []):
+        module = getattr(getattr(thunk, 'thunk', None), 'module', None)
+        if module is not None:
+            module_files.append(module.__file__)
+    for node in fn.maker.fgraph.apply_nodes:
+        if type(node.op) in ops_with_inner_function:
+            inner = getattr(node.op, ops_with_inner_function[type(node.op)],
+                            None)
+            if isinstance(inner, Function):
+                module_files.extend(_compiled_module_files(inner, seen))
+    return module_files
+
+
+def export_compiled(fn, path):
+    """
+    Write the compiled C modules used by `fn` to an archive.
+
+    The archive can be installed with `import_compiled` in the compiledir of
+    another machine with the same compiler, flags and library versions,
+    so that compiling the same function there does not run the C compiler.
+
+    Only the modules of functions compiled with a VM linker (the default)
+    are found, and modules of Ops without a `c_code_cache_version` are not
+    exported since they cannot be reused by another process.
+
+    Parameters
+    ----------
+    fn : Function
+        A compiled Theano function.
+    path : str
+        Path of the archive to create.
+
+    Returns
+    -------
+    int
+        The number of modules exported.
+
+    """
+    import theano.gof.compiledir
+    if not isinstance(fn, Function):
+        raise TypeError('export_compiled expects a compiled Theano function',
+                        fn)
+    return theano.gof.compiledir.export_modules(
+        _compiled_module_files(fn, set()), path)
+
+
+def import_compiled(path, force=False):
+    """
+    Install in the compiledir the C modules of an archive made by
+    `export_compiled`.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive.
+    force : bool
+        If True, do not check that the modules were compiled in the same
+        environment (compiler, flags, library versions) as the current one.
+
+    Returns
+    -------
+    int
+        The number of modules installed.
+
+    """
+    import theano.gof.compiledir
+    return theano.gof.compiledir.import_modules(path, force=force)
+
+
 def function(inputs, outputs=None, mode=None, updates=None, givens=None,
              no_default_updates=False, accept_inplace=False, name=None,
              rebuild_strict=True, allow_input_downcast=None, profile=None,
@@ -328,3 +414,187 @@ def function(inputs, outputs=None, mode=None, updates=None, givens=None,
     # borrowed used defined inputs
     fn._check_for_aliased_inputs = check_for_aliased_inputs
     return fn
+
+
+# State of `function_many` inherited by its forked worker processes.
+_function_many_state = None
+
+
+def _function_many_compile(index):
+    """
+    Compile the function `index` of `function_many` in a worker process.
+
+    Return the function pickled with the objects of the parent process
+    referenced by id, or None if it could not be compiled or pickled, in
+    which case it is compiled again in the parent to report the error.
+
+    """
+    specs, parent_objects = _function_many_state
+    try:
+        fn = function(**specs[index])
+        buf = BytesIO()
+        p = pickle.Pickler(buf, protocol=pickle.HIGHEST_PROTOCOL)
+        p.persistent_id = (
+            lambda obj: id(obj) if id(obj) in parent_objects else None)
+        p.dump((fn, fn.name, fn._check_for_aliased_inputs))
+        return buf.getvalue()
+    except Exception:
+        _logger.debug('function_many: compilation of function %i failed in '
+                      'a worker', index, exc_info=True)
+        return None
+
+
+def _function_many_parent_objects(spec):
+    """
+    Return the objects of a `function_many` spec to keep shared with the
+    parent process: the variables of the graphs, and the containers, storage
+    and values of the shared variables.
+
+    """
+    roots = []
+    for inp in spec.get('inputs', []):
+        if isinstance(inp, In):
+            roots.append(inp.variable)
+        else:
+            roots.append(inp)
+    outputs = spec.get('outputs')
+    if isinstance(outputs, dict):
+        outputs = list(outputs.values())
+    elif not isinstance(outputs, (list, tuple)):
+        outputs = [outputs]
+    roots.extend(getattr(o, 'variable', o) for o in outputs)
+    for pairs in (spec.get('updates'), spec.get('givens')):
+        if isinstance(pairs, dict):
+            pairs = list(pairs.items())
+        for pair in pairs or []:
+            roots.extend(pair)
+    objects = []
+    for var in gof.graph.ancestors([r for r in roots if r is not None]):
+        objects.append(var)
+        if isinstance(var, SharedVariable):
+            # The functions share the storage list of the container.
+            objects.append(var.container)
+            objects.append(var.container.storage)
+            objects.append(var.container.storage[0])
+    return objects
+
+
+def _theano_threads_running():
+    """
+    Return True if threads started by Theano (whose names start with
+    'theano-') run besides the current one.
+
+    """
+    current = threading.current_thread()
+    return any(thread is not current and thread.name.startswith('theano-')
+               for thread in threading.enumerate())
+
+
+def function_many(specs, workers=None, timeout=600):
+    """
+    Compile several Theano functions in parallel.
+
+    Each function is compiled by `function` in a forked worker process,
+    which runs the graph optimization and compiles the C code of its Ops.
+    The optimized function is sent back to this process, where it is linked
+    again, loading the C modules from the compiledir where the workers put
+    them.
+
+    The shared variables, their values and the variables of the graphs are
+    not copied: the functions returned use the ones of this process, as if
+    they had been compiled here.
+
+    Parameters
+    ----------
+    specs : list of dict
+        The keyword arguments of `function` for each function.
+    workers : int
+        Number of worker processes. None means one per CPU. The functions
+        are compiled one after the other in this process if `workers` is
+        1, if there is only one function, if the platform cannot fork, or
+        if threads started by Theano are running (see Notes).
+    timeout : float
+        Number of seconds to wait for the workers. The functions not
+        received by then, e.g. because a worker died, are compiled in this
+        process.
+
+    Returns
+    -------
+    list of Function
+        The compiled functions, in the order of `specs`.
+
+    Notes
+    -----
+    The functions that are profiled, and those that could not be compiled
+    or sent back by a worker, are compiled in this process. In the latter
+    case, this reports the error of the compilation, if any.
+
+    The workers compile C code in the same compiledir. Set
+    ``config.compile.lock_mode`` to ``'per_module'`` so that they only wait
+    for each other when they build the same module.
+
+    A forked process only has the thread that forked it, and the locks held
+    by the other threads stay locked in it. So this does not fork while the
+    threads of the 'vm_parallel' linker, of `Function.map` or of
+    `Function.async_call` are running. The other threads of the program
+    must not hold locks the compilation needs, like the ones of `logging`,
+    when this is called.
+
+    """
+    global _function_many_state
+    specs = [dict(spec) for spec in specs]
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    parallel = [i for i, spec in enumerate(specs)
+                if not (spec.get('profile') or config.profile)]
+    results = [None] * len(specs)
+    if (workers > 1 and len(parallel) > 1 and hasattr(os, 'fork') and
+            not _theano_threads_running()):
+        parent_objects = {}
+        for i in parallel:
+            for obj in _function_many_parent_objects(specs[i]):
+                parent_objects[id(obj)] = obj
+        try:
+            context = multiprocessing.get_context('fork')
+        except AttributeError:
+            # Python 2 always forks.
+            context = multiprocessing
+        _function_many_state = (specs, parent_objects)
+        pickled = []
+        try:
+            pool = context.Pool(min(workers, len(parallel)))
+            try:
+                async_results = [
+                    pool.apply_async(_function_many_compile, (i,))
+                    for i in parallel]
+                pool.close()
+                deadline = time.time() + timeout
+                for i, async_result in zip(parallel, async_results):
+                    try:
+                        pickled.append(async_result.get(
+                            max(deadline - time.time(), 0)))
+                    except Exception:
+                        _logger.warning('function_many: function %i was not '
+                                        'received from the workers, it is '
+                                        'compiled in this process', i)
+                        pickled.append(None)
+            finally:
+                pool.terminate()
+        finally:
+            _function_many_state = None
+        for i, data in zip(parallel, pickled):
+            if data is None:
+                continue
+            p = pickle.Unpickler(BytesIO(data))
+            p.persistent_load = parent_objects.__getitem__
+            fn, name, check_for_aliased_inputs = p.load()
+            if fn is None:
+                # config.unpickle_function is False.
+                continue
+            fn.name = name
+            fn._check_for_aliased_inputs = check_for_aliased_inputs
+            results[i] = fn
+    for i, spec in enumerate(specs):
+        if results[i] is None:
+            results[i] = function(**spec)
+    return results
@@ -5,10 +5,13 @@ Driver of graph construction, optimization, and linking.
 from __future__ import absolute_import, print_function, division
 
 import copy
+import multiprocessing
+import sys
+import threading
+import six
 from six import string_types, iteritems, iterkeys
 from six.moves import xrange
 import six.moves.copyreg as copyreg
-import six.moves.cPickle as pickle
 from itertools import chain
 import time
 import warnings
@@ -17,12 +20,12 @@ import numpy as np
 import theano
 from theano import config, gof
 from theano.compat import izip
-from theano.gof import graph
+from theano.gof import compiletime, graph
+import theano.compile.optcache
 import theano.compile.profiling
 from theano.compile.io import (
     In, SymbolicInput, SymbolicOutput)
 from theano.compile.ops import deep_copy_op, view_op
-from theano.gof.graph import is_same_graph
 from theano.gof.op import ops_with_inner_function
 
 import logging
@@ -140,6 +143,7 @@ class Supervisor:
                                              "Variable.", r)
 
 
+@compiletime.timed('fgraph')
 def std_fgraph(input_specs, output_specs, accept_inplace=False):
     """
     Makes an FunctionGraph corresponding to the input specs and the output
@@ -217,6 +221,14 @@ class AliasedMemoryError(Exception):
 DUPLICATE = ['DUPLICATE']
 
 
+class _CallPlanFallback(Exception):
+    """
+    Raised by the call plan of a Function when the arguments need the general
+    path of `Function.__call__`.
+
+    """
+
+
 class Function(object):
     """
     Type of the functions returned by theano.function or
@@ -250,6 +262,11 @@ class Function(object):
     numpy tensor.  C code should raise an error if you pass an object
     of the wrong type.
 
+    A Function instance also have a ``persistent_outputs`` field that
+    default to False. When True, the arrays returned by a call are given as
+    the ``out`` argument of the next call, which overwrites them instead of
+    allocating new arrays. The caller must not keep them across calls.
+
     Attributes
     ----------
     finder
@@ -501,6 +518,136 @@ class Function(object):
             if node.op in ops_with_inner_function:
                 self.nodes_with_inner_function.append(node.op)
 
+        # Set in FunctionMaker.create, see _make_call_plan.
+        self._call_plan = None
+        # Copies used by the threads of map.
+        self._map_copies = []
+        # If True, the arrays returned by a call are given as `out` to the
+        # next one, which overwrites them.
+        self.persistent_outputs = False
+        self._output_buffers = None
+        # Computes the shapes of the outputs, see _output_shapes.
+        self._output_shapes_fn = None
+        # Copy, thread and lock used by async_call.
+        self._async_copy = None
+        self._async_executor = None
+        self._async_lock = threading.Lock()
+
+    def _make_call_plan(self):
+        """
+        Return a callable doing the work of `__call__` for positional
+        arguments, or None if this function needs the general path.
+
+        The plan is used when the explicit inputs come first and are all
+        required, and when no explicit input can be destroyed: then there
+        are no defaults to restore, so the checks of `__call__` reduce to
+        filtering each argument. An argument that may share memory with an
+        implicit input that is destroyed (e.g. a shared variable updated
+        inplace) is copied, so that the function sees its value from before
+        the call. The plan falls back on the general path (by raising
+        `_CallPlanFallback`) when an argument cannot be filtered, to get the
+        same error.
+
+        With the C VM, which does the updates itself, a training step is
+        then a single call of the VM between the filtering of the arguments
+        and the clearing of the storage.
+
+        """
+        maker = self.maker
+        fgraph = maker.fgraph
+        explicit = [c for c in self.input_storage if not c.implicit]
+        if (self.input_storage[:len(explicit)] != explicit or
+                not all(c.required for c in explicit) or
+                any(refeed for _, refeed, _ in self.defaults)):
+            return None
+        destroyed = []
+        if hasattr(fgraph, 'destroyers'):
+            for c, var in zip(self.input_storage, fgraph.inputs):
+                if fgraph.destroyers(var):
+                    if not c.implicit:
+                        return None
+                    if not hasattr(c.type, 'may_share_memory'):
+                        return None
+                    destroyed.append((c.storage, c.type.may_share_memory))
+        elif any(getattr(node.op, 'destroy_map', None)
+                 for node in fgraph.apply_nodes):
+            return None
+
+        fn = self.fn
+        mode = maker.mode
+        arg_storage = [(c.storage, c.type.filter, c.strict, c.allow_downcast)
+                       for c in explicit]
+        input_cells = [c.storage for c in explicit]
+        output_storage = self.output_storage
+        computed_cells = [c.storage for c, var in zip(output_storage,
+                                                      fgraph.outputs)
+                          if var.owner is not None]
+        updated = [c for i, c in zip(maker.expanded_inputs,
+                                     self.input_storage)
+                   if i.update is not None]
+        n_returned = self.n_returned_outputs
+        return_none = self.return_none
+        unpack_single = self.unpack_single and n_returned == 1
+        output_keys = self.output_keys
+
+        def call_plan(args):
+            t0 = time.time()
+            for (cell, filter, strict, allow_downcast), arg in zip(
+                    arg_storage, args):
+                if arg is None:
+                    cell[0] = arg
+                else:
+                    try:
+                        cell[0] = filter(arg, strict=strict,
+                                         allow_downcast=allow_downcast)
+                    except Exception:
+                        raise _CallPlanFallback()
+            for cell, may_share_memory in destroyed:
+                for arg_cell in input_cells:
+                    if may_share_memory(cell[0], arg_cell[0]):
+                        arg_cell[0] = copy.copy(arg_cell[0])
+
+            t0_fn = time.time()
+            try:
+                outputs = fn()
+            except Exception:
+                self._reraise_fn_error()
+            dt_fn = time.time() - t0_fn
+            mode.fn_time += dt_fn
+
+            if outputs is None:
+                outputs = [c.storage[0] for c in output_storage]
+            for cell in input_cells:
+                cell[0] = None
+            if getattr(fn, 'allow_gc', False):
+                for cell in computed_cells:
+                    cell[0] = None
+            if updated:
+                if getattr(fn, 'need_update_inputs', True):
+                    for c, value in zip(updated, outputs[n_returned:]):
+                        c.data = value
+                outputs = outputs[:n_returned]
+
+            dt_call = time.time() - t0
+            theano.compile.profiling.total_fct_exec_time += dt_call
+            mode.call_time += dt_call
+            profile = self.profile
+            if profile:
+                # A call whose thunks are not timed.
+                profile.fct_callcount += 1
+                profile.fct_call_time += dt_call
+                profile.vm_call_time += dt_fn
+            if return_none:
+                return None
+            elif unpack_single:
+                return outputs[0]
+            elif output_keys is not None:
+                return dict(izip(output_keys, outputs))
+            return outputs
+
+        call_plan.n_args = len(explicit)
+        return call_plan
+
     def __contains__(self, item):
         return self.value.__contains__(item)
 
@@ -591,6 +738,9 @@ class Function(object):
         fg_cpy = gof.fg.FunctionGraph([memo[i] for i in maker.fgraph.inputs],
                                       [memo[o] for o in out_vars],
                                       clone=False)
+        # The inplace ops need the orderings of the DestroyHandler.
+        if hasattr(maker.fgraph, 'destroyers'):
+            fg_cpy.attach_feature(gof.DestroyHandler())
 
         # Re initialize Outs and swap update and variable in Ins
         # By doing this, we can pass FunctionMaker._check_unused_inputs()
@@ -721,6 +871,98 @@ class Function(object):
         f_cpy.maker.fgraph.name = name
         return f_cpy
 
+    def _output_shapes(self):
+        """
+        Return the shapes of the outputs returned by the function for the
+        values currently in its input storage (None for the outputs that
+        are not tensors), without computing the outputs when their shapes
+        can be inferred.
+
+        """
+        fgraph = self.maker.fgraph
+        outputs = fgraph.outputs[:self.n_returned_outputs]
+        indices = [i for i, var in enumerate(outputs)
+                   if getattr(var.type, 'ndim', None) is not None]
+        if self._output_shapes_fn is None:
+            inputs = [var.type() for var in fgraph.inputs]
+            shapes = theano.clone(
+                [outputs[i].shape for i in indices],
+                replace=dict(zip(fgraph.inputs, inputs)))
+            self._output_shapes_fn = theano.function(
+                inputs, shapes, mode=theano.compile.mode.get_mode('FAST_RUN'),
+                on_unused_input='ignore')
+        values = self._output_shapes_fn(
+            *[c.storage[0] for c in self.input_storage])
+        rval = [None] * len(outputs)
+        for i, shape in zip(indices, values):
+            rval[i] = tuple(int(dim) for dim in shape)
+        return rval
+
+    def _set_output_buffers(self, out, strict):
+        """
+        Put views of the arrays of `out` in the storage of the outputs and
+        return that storage.
+
+        An op finding a view of the wrong shape allocates a new array, as it
+        cannot resize it. If `strict` is False, the arrays that cannot hold
+        the outputs are ignored instead of raising an error. Otherwise, the
+        shape of the arrays is checked before the computation.
+
+        """
+        inputs_data = [c.storage[0] for c in self.input_storage]
+        shapes = None
+        cells = []
+        for i, buf in enumerate(out):
+            if buf is None:
+                continue
+            var = self.maker.fgraph.outputs[i]
+            error = None
+            if type(buf) is not np.ndarray:
+                error = "is not a numpy.ndarray"
+            elif (str(buf.dtype) != getattr(var.type, 'dtype', None) or
+                    buf.ndim != getattr(var.type, 'ndim', None)):
+                error = "does not have the type of the output (%s)" % var.type
+            elif not buf.flags.writeable:
+                error = "is not writeable"
+            elif any(isinstance(data, np.ndarray) and
+                     np.may_share_memory(buf, data) for data in inputs_data):
+                error = "may share memory with an input of the function"
+            if error is not None:
+                if strict:
+                    raise TypeError("The array given in out for output %d %s."
+                                    % (i, error))
+                out[i] = None
+                continue
+            if strict and shapes is None:
+                shapes = self._output_shapes()
+            if strict and buf.shape != shapes[i]:
+                raise ValueError("Output %d has shape %s, but the array given "
+                                 "in out has shape %s." % (i, shapes[i],
+                                                           buf.shape))
+            if var.owner is not None:
+                self.output_storage[i].storage[0] = buf.view()
+                cells.append(self.output_storage[i].storage)
+        return cells
+
+    def _reraise_fn_error(self):
+        # Called while handling an exception raised by self.fn.
+        if getattr(self.fn, 'position_of_error', -1) != -1:
+            # this is a new vm-provided function or c linker
+            # they need this because the exception manipulation
+            # done by raise_with_op is not implemented in C.
+            thunk = None
+            if hasattr(self.fn, 'thunks'):
+                thunk = self.fn.thunks[self.fn.position_of_error]
+            gof.link.raise_with_op(
+                node=self.fn.nodes[self.fn.position_of_error],
+                thunk=thunk,
+                storage_map=getattr(self.fn, 'storage_map', None))
+        else:
+            # old-style linkers raise their own exceptions, and the CVM
+            # leaves position_of_error to -1 for the errors that are not
+            # raised by a node, like a cancellation.
+            raise
+
     def __call__(self, *args, **kwargs):
         """
         Evaluates value of a function on given arguments.
@@ -743,12 +985,31 @@ class Function(object):
             and processed. To disable the updates, you should use the ``copy``
             method with ``delete_updates=True``.
 
+            Keyword argument ``out`` is a list of arrays, one for each output
+            (or an array if the function returns a single output), in which
+            the outputs are stored and that are returned. None entries get a
+            new array as usual. The ops computing the outputs write directly
+            into these arrays when they can; otherwise, the outputs are copied
+            into them. Their dtype, number of dimensions and shape are checked
+            before the computation. It is not available if an input of the
+            function is named ``out``.
+
         Returns
         -------
         list
             List of outputs on indices/keys from ``output_subset`` or all of them,
             if ``output_subset`` is not passed.
         """
+        call_plan = self._call_plan
+        if (call_plan is not None and not kwargs and
+                len(args) == call_plan.n_args and
+                not self.trust_input and not self.persistent_outputs and
+                (not self.profile or not self.profile.sample_call())):
+            try:
+                return call_plan(args)
+            except _CallPlanFallback:
+                pass
+
         def restore_defaults():
             for i, (required, refeed, value) in enumerate(self.defaults):
                 if refeed:
@@ -763,6 +1024,22 @@ class Function(object):
             output_subset =\
                 [self.output_keys.index(key) for key in output_subset]
 
+        out = None
+        if 'out' not in self.finder:
+            out = kwargs.pop('out', None)
+        check_out_shapes = out is not None
+        if out is not None:
+            if output_subset is not None:
+                raise TypeError("The out and output_subset arguments cannot "
+                                "be used together.")
+            if not isinstance(out, (list, tuple)):
+                out = [out]
+            if len(out) != self.n_returned_outputs:
+                raise TypeError("Expected %d arrays in out, got %d." % (
+                    self.n_returned_outputs, len(out)))
+        elif self.persistent_outputs and output_subset is None:
+            out = self._output_buffers
+
         # Reinitialize each container's 'provided' counter
         if self.trust_input:
             i = 0
@@ -876,28 +1153,45 @@ class Function(object):
                         % getattr(self.inv_finder[c], 'variable',
                                   self.inv_finder[c]))
 
+        if out is not None:
+            try:
+                out_cells = self._set_output_buffers(out, check_out_shapes)
+            except Exception:
+                for c, var in zip(self.output_storage,
+                                  self.maker.fgraph.outputs):
+                    if var.owner is not None:
+                        c.storage[0] = None
+                restore_defaults()
+                raise
+            out_views = [cell[0] for cell in out_cells]
+
+        sampled = profile and profile.sample_call()
+        call_trace = None
+        if profile:
+            self.fn.time_thunks = profile.flag_time_thunks and sampled
+            if sampled:
+                call_trace = profile.trace_call(self.fn)
+
         # Do the actual work
         t0_fn = time.time()
         try:
-            outputs =\
-                self.fn() if output_subset is None else\
-                self.fn(output_subset=output_subset)
+            if out is not None and hasattr(self.fn, 'kept_storage'):
+                with self.fn.kept_storage(out_cells):
+                    outputs = self.fn()
+            else:
+                outputs =\
+                    self.fn() if output_subset is None else\
+                    self.fn(output_subset=output_subset)
         except Exception:
             restore_defaults()
-            if hasattr(self.fn, 'position_of_error'):
-                # this is a new vm-provided function or c linker
-                # they need this because the exception manipulation
-                # done by raise_with_op is not implemented in C.
-                thunk = None
-                if hasattr(self.fn, 'thunks'):
-                    thunk = self.fn.thunks[self.fn.position_of_error]
-                gof.link.raise_with_op(
-                    node=self.fn.nodes[self.fn.position_of_error],
-                    thunk=thunk,
-                    storage_map=getattr(self.fn, 'storage_map', None))
-            else:
-                # old-style linkers raise their own exceptions
-                raise
+            self._reraise_fn_error()
+        finally:
+            if sampled and profile.sample_every > 1:
+                # The next calls may not go through here.
+                self.fn.time_thunks = False
+            if call_trace is not None:
+                self.fn.trace = None
+                call_trace.finish(t0_fn, time.time())
 
         dt_fn = time.time() - t0_fn
         self.maker.mode.fn_time += dt_fn
@@ -935,6 +1229,22 @@ class Function(object):
         else:
             outputs = outputs[:self.n_returned_outputs]
 
+        if out is not None:
+            outputs = list(outputs)
+            for i, buf in enumerate(out):
+                if buf is None:
+                    continue
+                if any(outputs[i] is view for view in out_views):
+                    outputs[i] = buf
+                elif outputs[i].shape == buf.shape:
+                    np.copyto(buf, outputs[i])
+                    outputs[i] = buf
+
+        if self.persistent_outputs:
+            self._output_buffers = [
+                o if type(o) is np.ndarray else None
+                for o in outputs]
+
         # Put default values back in the storage
         restore_defaults()
         #
@@ -949,11 +1259,14 @@ class Function(object):
         if profile:
             profile.fct_callcount += 1
             profile.fct_call_time += dt_call
-            if hasattr(self.fn, 'update_profile'):
-                self.fn.update_profile(profile)
+            if sampled:
+                profile.sampled_callcount += 1
+                if hasattr(self.fn, 'update_profile'):
+                    self.fn.update_profile(profile, profile.sample_every)
             if profile.ignore_first_call:
                 profile.reset()
                 profile.ignore_first_call = False
+            profile.maybe_snapshot()
         if self.return_none:
             return None
         elif self.unpack_single and len(outputs) == 1 and\
@@ -976,6 +1289,147 @@ class Function(object):
             else:
                 return [outputs[i] for i in output_subset]
 
+    def map(self, args_list, n_threads=1):
+        """
+        Call the function on each set of arguments of `args_list`.
+
+        The intermediate results of the graph are kept from one call to the
+        next, so that the ops can reuse their output storage, and they are
+        freed at the end as usual.
+
+        Parameters
+        ----------
+        args_list : iterable
+            Each element is a tuple of positional arguments or a dict of
+            keyword arguments for one call.
+        n_threads : int
+            If greater than 1, the calls are split between that many threads,
+            each one using its own copy of the function. This only helps when
+            the ops release the GIL. Functions with updates cannot be run in
+            threads, as the order of the calls matters.
+
+        Returns
+        -------
+        list
+            The outputs of each call, in the order of `args_list`.
+
+        """
+        args_list = list(args_list)
+        n_threads = min(n_threads, len(args_list))
+        if n_threads <= 1:
+            return self._map(args_list)
+        if self.n_returned_outputs != len(self.output_storage):
+            raise ValueError("Function.map cannot run a function with "
+                             "updates in parallel threads.")
+
+        while len(self._map_copies) < n_threads - 1:
+            self._map_copies.append(self.copy())
+        results = [None] * len(args_list)
+        errors = []
+
+        def run(f, start):
+            indices = xrange(start, len(args_list), n_threads)
+            try:
+                outputs = f._map([args_list[i] for i in indices])
+            except Exception:
+                errors.append(sys.exc_info())
+                return
+            for i, out in izip(indices, outputs):
+                results[i] = out
+
+        threads = [threading.Thread(target=run, args=(f, start),
+                                    name='theano-map-%i' % start)
+                   for start, f in enumerate(self._map_copies[:n_threads - 1],
+                                             1)]
+        for thread in threads:
+            thread.start()
+        run(self, 0)
+        for thread in threads:
+            thread.join()
+        if errors:
+            six.reraise(*errors[0])
+        return results
+
+    def async_call(self, *args, **kwargs):
+        """
+        Evaluate the function in another thread, for asyncio code.
+
+        ``await f.async_call(*args, **kwargs)`` returns the same thing as
+        ``f(*args, **kwargs)``, but the event loop keeps running while the
+        graph is evaluated. The calls are made one at a time, in a thread
+        dedicated to this function, by a copy of it with its own storage.
+        The shared variables, and their updates, are common to both.
+
+        If the returned future is cancelled, the call stops before the next
+        node is run and the updates are not applied (with the VM linkers).
+        This needs Python 3.
+
+        Returns
+        -------
+        asyncio.Future
+
+        """
+        import asyncio
+        from concurrent.futures import ThreadPoolExecutor
+
+        if self._async_executor is None:
+            self._async_copy = self.copy()
+            # The CVM does not let the event loop run otherwise.
+            self._async_copy.fn.release_gil = True
+            try:
+                self._async_executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix='theano-async')
+            except TypeError:
+                # Python < 3.6 cannot name the thread.
+                self._async_executor = ThreadPoolExecutor(max_workers=1)
+        f = self._async_copy
+        lock = self._async_lock
+        state = {'running': False, 'cancelled': False}
+
+        def run():
+            with lock:
+                if state['cancelled']:
+                    raise asyncio.CancelledError()
+                state['running'] = True
+            try:
+                return f(*args, **kwargs)
+            finally:
+                with lock:
+                    state['running'] = False
+                    f.fn.cancel = None
+
+        def cancel(future):
+            if future.cancelled():
+                with lock:
+                    state['cancelled'] = True
+                    if state['running']:
+                        f.fn.cancel = asyncio.CancelledError()
+
+        future = asyncio.get_event_loop().run_in_executor(
+            self._async_executor, run)
+        future.add_done_callback(cancel)
+        return future
+
+    def _map(self, args_list):
+        fn = self.fn
+        allow_gc = getattr(fn, 'allow_gc', False)
+        if allow_gc:
+            fn.allow_gc = False
+        try:
+            rval = []
+            for args in args_list:
+                if isinstance(args, dict):
+                    rval.append(self(**args))
+                else:
+                    rval.append(self(*args))
+        finally:
+            if allow_gc:
+                fn.allow_gc = True
+                for var, cell in iteritems(getattr(fn, 'storage_map', {})):
+                    if var.owner is not None:
+                        cell[0] = None
+        return rval
+
     value = property(
         lambda self: self._value,
         None,  # this property itself is not settable
@@ -1056,6 +1510,81 @@ def _constructor_Function(maker, input_storage, inputs_data):
 copyreg.pickle(Function, _pickle_Function)
 
 
+class FunctionPool(object):
+    """
+    Copies of a Function to call it from several threads at once.
+
+    A Function is not reentrant, as a call uses the storage of its inputs,
+    of its intermediate results and of its outputs. The pool hands out
+    copies of the function, made with `Function.copy` when needed, to one
+    thread at a time. The copies share the storage of the shared variables
+    and the constants, and each one has its own storage for the rest.
+
+    Parameters
+    ----------
+    function : Function
+        The function to copy. It is not called by the pool itself. It cannot
+        have updates, as concurrent calls would not apply them in order.
+    size : int
+        Maximum number of copies. 0 means one per CPU.
+
+    Notes
+    -----
+    The calls only run in parallel while the ops release the GIL, as numpy
+    and most BLAS calls do. Outputs returned with ``borrow=True`` are
+    overwritten by the next call of the same copy, from any thread.
+
+    """
+
+    def __init__(self, function, size=0):
+        if function.n_returned_outputs != len(function.output_storage):
+            raise ValueError("FunctionPool cannot run a function with "
+                             "updates in parallel threads.")
+        self.function = function
+        self.size = size or multiprocessing.cpu_count()
+        self.n_copies = 0
+        self._free = []
+        self._cond = threading.Condition()
+        self._copy_lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Return a copy of the function that no other thread uses, waiting
+        for one to be released if the pool is full.
+
+        """
+        with self._cond:
+            while not self._free and self.n_copies >= self.size:
+                self._cond.wait()
+            if self._free:
+                return self._free.pop()
+            self.n_copies += 1
+        try:
+            with self._copy_lock:
+                return self.function.copy()
+        except Exception:
+            with self._cond:
+                self.n_copies -= 1
+                self._cond.notify()
+            raise
+
+    def release(self, f):
+        """
+        Give back a copy obtained with `acquire`.
+
+        """
+        with self._cond:
+            self._free.append(f)
+            self._cond.notify()
+
+    def __call__(self, *args, **kwargs):
+        f = self.acquire()
+        try:
+            return f(*args, **kwargs)
+        finally:
+            self.release(f)
+
+
 ###
 # FunctionMaker
 ###
@@ -1222,169 +1751,30 @@ class FunctionMaker(object):
                             output)
 
     def optimize_graph_with_cache(self, optimizer, inputs, outputs):
-        # This function is not finished
-        from theano.gof.compilelock import get_lock, release_lock
-        import os.path
-
-        graph_db_file = os.path.join(theano.config.compiledir,
-                                     'optimized_graphs.pkl')
-
-        # the inputs, outputs, and size of the graph to be optimized
-        inputs_new = [inp.variable for inp in inputs]
-        outputs_new = [out.variable for out in outputs]
-        size_new = len(self.fgraph.apply_nodes)
-        get_lock()
-        # Beginning of cache optimizations.
-        # Could be refactored in different functions.
-
-        def load_graph_db():
-            if os.path.isfile(graph_db_file):
-                print('graph_db already exists')
-            else:
-                # create graph_db
-                with open(graph_db_file, 'wb') as f:
-                    print('create new graph_db in %s' % graph_db_file)
-            # load the graph_db dictionary
-            try:
-                with open(graph_db_file, 'rb') as f:
-                    # Temporary hack to allow
-                    # theano.scan_module.tests.test_scan.T_Scan to
-                    # finish. Should be changed in definitive version.
-                    tmp = theano.config.unpickle_function
-                    theano.config.unpickle_function = False
-                    graph_db = pickle.load(f)
-                print('graph_db loaded and it is not empty')
-            except EOFError as e:
-                # the file has nothing in it
-                print(e)
-                print('graph_db loaded and it is empty')
-                graph_db = {}
-            finally:
-                theano.config.unpickle_function = tmp
-
-            return graph_db
-
-        def find_same_graph_in_db(graph_db):
-            # If found_graph_in_db is None, then need to optimize.
-            # Otherwise, return the graph found.
-            found_graph_in_db = None
-            # The sole purpose of this loop is to set 'need_optimize' by
-            # going through graph_db, looking for graph that has the same
-            # computation performed.
-            for graph_old, graph_optimized in iteritems(graph_db):
-                inputs_old = graph_old.inputs
-                outputs_old = graph_old.outputs
-                size_old = len(graph_old.apply_nodes)
-                # Some heuristics to check is the same graphs have
-                # already been optimized before.
-                if len(inputs_new) != len(inputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because input size is different')
-                    continue
-                elif len(outputs_new) != len(outputs_old):
-                    # If the inputs are of different size,
-                    # two graphs are for sure different
-                    print('need to optimize, because output size is different')
-                    continue
-                elif not all(input_new.type == input_old.type
-                             for input_new, input_old in
-                             zip(inputs_new, inputs_old)):
-                    print('need to optimize, because inputs are of different '
-                          'types')
-                    continue
-                elif not all(output_new.type == output_old.type
-                             for output_new, output_old in
-                             zip(outputs_new, outputs_old)):
-                    print('need to optimize, because outputs are of different '
-                          'types')
-                    continue
-                elif not size_old == size_new:
-                    print('need to optimize, because numbers of nodes in graph'
-                          ' are different')
-                    continue
-                else:
-                    flags = []
-                    for i, (output_new, output_old) in enumerate(
-                            zip(outputs_new, outputs_old)):
-                        print('loop through outputs node for both graphs')
-                        graph_old.variables = set(gof.graph.variables(
-                            graph_old.inputs, graph_old.outputs))
-
-                        # using clone allowed to avoid a lot of errors
-                        # deep copy seemed to had.
-                        f2 = graph_old.clone(check_integrity=False)
-                        t1 = output_new
-                        t2 = f2.outputs[i]
-
-                        # Used to remove "already used by another graph error
-                        def removeAllFgraph(remove):
-                            if hasattr(remove, 'fgraph'):
-                                del remove.fgraph
-                            if hasattr(remove, 'owner'):
-                                if remove.owner is None:
-                                    pass
-                                else:
-                                    if hasattr(remove.owner, 'fgraph'):
-                                        del remove.owner.fgraph
-                                    if hasattr(remove.owner, 'inputs'):
-                                        remove.owner.inputs = [removeAllFgraph(
-                                            i) for i in remove.owner.inputs]
-                                        for o in remove.owner.outputs:
-                                            if hasattr(o, 'fgraph'):
-                                                del o.fgraph
-                            return remove
-
-                        t2 = removeAllFgraph(t2)
-
-                        givens = dict(izip(gof.graph.inputs([t1]),
-                                           gof.graph.inputs([t2])))
-
-                        temp = dict(izip(gof.graph.inputs([t1]),
-                                         gof.graph.inputs([t2])))
-
-                        # hack to remove inconstent entry in givens
-                        # seems to work that but source of inconsistency
-                        # could be worth investigating.
-                        for key, value in iteritems(temp):
-                            if key.type != value.type:
-                                del givens[key]
-
-                        flag = is_same_graph(t1, t2, givens=givens)
-
-                        flags.append(flag)
-
-                    is_same = all(flags)
-                    if is_same:
-                        # found the match
-                        print('found a match, no need to optimize')
-                        found_graph_in_db = graph_optimized
-                        break
-            return found_graph_in_db
-
-        graph_db = load_graph_db()
-        print('loaded graph_db from %s, size=%d' % (graph_db_file,
-                                                    len(graph_db)))
-        found_graph = find_same_graph_in_db(graph_db)
-        if found_graph:
-            self.fgraph = found_graph
-            optimizer_profile = None
-        else:
-            # this is a brand new graph, optimize it, save it to graph_db
-            print('graph not found in graph_db, optimizing the graph')
-            self.fgraph.variables = set(gof.graph.variables(
-                self.fgraph.inputs, self.fgraph.outputs))
-            # check_integrity parameters was added to ignore
-            # "excess cached variables" errors. Works that way
-            # but once again the error couldbe worth
-            # investigating.
-            before_opt = self.fgraph.clone(check_integrity=False)
-            optimizer_profile = optimizer(self.fgraph)
-            graph_db.update({before_opt: self.fgraph})
-            with open(graph_db_file, 'wb') as f:
-                pickle.dump(graph_db, f, -1)
-            print('new graph saved into graph_db')
-        release_lock()
+        """
+        Optimize self.fgraph, reusing the result of a previous optimization
+        of the same graph if it is in the optimized graph cache.
+
+        On a cache hit, self.fgraph is replaced by the cached graph and None
+        is returned. Otherwise, this returns the optimizer profile.
+
+        """
+        cache = theano.compile.optcache.get_optimized_graph_cache()
+        key = cache.key(self.fgraph, inputs, self.mode._optimizer)
+        if key is None:
+            return optimizer(self.fgraph)
+
+        fgraph = cache.get(key)
+        if (fgraph is not None and
+                len(fgraph.inputs) == len(self.fgraph.inputs) and
+                len(fgraph.outputs) == len(self.fgraph.outputs)):
+            _logger.debug('Optimized graph found in cache')
+            fgraph.profile = self.fgraph.profile
+            self.fgraph = fgraph
+            return None
+
+        optimizer_profile = optimizer(self.fgraph)
+        cache.put(key, self.fgraph)
         return optimizer_profile
 
     def __init__(self, inputs, outputs,
@@ -1397,6 +1787,7 @@ class FunctionMaker(object):
         if getattr(mode, 'profile', None):
             raise TypeError(
                 "profile passed via 'mode'. This isn't supported anymore")
+        self.mode = mode
         self.profile = profile
         if profile:
             # This is very important:
@@ -1470,11 +1861,13 @@ class FunctionMaker(object):
                 opt_time = None
 
                 # now optimize the graph
-                if theano.config.cache_optimizations:
-                    optimizer_profile = self.optimize_graph_with_cache(
-                        optimizer, inputs, outputs)
-                else:
-                    optimizer_profile = optimizer(fgraph)
+                with compiletime.phase('optimizer'):
+                    if theano.config.cache_optimizations:
+                        optimizer_profile = self.optimize_graph_with_cache(
+                            optimizer, inputs, outputs)
+                        fgraph = self.fgraph
+                    else:
+                        optimizer_profile = optimizer(fgraph)
 
                 end_optimizer = time.time()
                 opt_time = end_optimizer - start_optimizer
@@ -1536,7 +1929,6 @@ class FunctionMaker(object):
         self.outputs = outputs
         self.unpack_single = unpack_single
         self.return_none = return_none
-        self.mode = mode
         self.accept_inplace = accept_inplace
         self.function_builder = function_builder
         self.on_unused_input = on_unused_input  # Used for the pickling/copy
@@ -1669,8 +2061,9 @@ class FunctionMaker(object):
         limit_orig = theano.config.traceback.limit
         try:
             theano.config.traceback.limit = theano.config.traceback.compile_limit
-            _fn, _i, _o = self.linker.make_thunk(
-                input_storage=input_storage_lists, storage_map=storage_map)
+            with compiletime.phase('linker'):
+                _fn, _i, _o = self.linker.make_thunk(
+                    input_storage=input_storage_lists, storage_map=storage_map)
         finally:
             theano.config.traceback.limit = limit_orig
 
@@ -1689,6 +2082,7 @@ class FunctionMaker(object):
                                    defaults, self.unpack_single,
                                    self.return_none, self.output_keys, self)
         fn.profile = self.profile
+        fn._call_plan = fn._make_call_plan()
         return fn
 
 
@@ -1797,16 +2191,17 @@ def orig_function(inputs, outputs, mode=None, accept_inplace=False,
         raise Exception("We do not support the passing of multiple modes")
     fn = None
     try:
-        Maker = getattr(mode, 'function_maker', FunctionMaker)
-        m = Maker(inputs,
-                  outputs,
-                  mode,
-                  accept_inplace=accept_inplace,
-                  profile=profile,
-                  on_unused_input=on_unused_input,
-                  output_keys=output_keys)
-        with theano.configparser.change_flags(compute_test_value="off"):
-            fn = m.create(defaults)
+        with compiletime.collect(profile.compile_phases if profile else None):
+            Maker = getattr(mode, 'function_maker', FunctionMaker)
+            m = Maker(inputs,
+                      outputs,
+                      mode,
+                      accept_inplace=accept_inplace,
+                      profile=profile,
+                      on_unused_input=on_unused_input,
+                      output_keys=output_keys)
+            with theano.configparser.change_flags(compute_test_value="off"):
+                fn = m.create(defaults)
     finally:
         t2 = time.time()
         if fn and profile:
@@ -28,6 +28,7 @@ predefined_linkers = {
     'vm': gof.vm.VM_Linker(use_cloop=False),  # Use allow_gc Theano flag
     'cvm': gof.vm.VM_Linker(use_cloop=True),  # Use allow_gc Theano flag
     'vm_nogc': gof.vm.VM_Linker(allow_gc=False, use_cloop=False),
+    'vm_parallel': gof.vm.VM_Linker(use_cloop=False, parallel=True),
     'cvm_nogc': gof.vm.VM_Linker(allow_gc=False, use_cloop=True)}
 
 
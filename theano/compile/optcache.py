@@ -0,0 +1,279 @@
+"""
+Persistent cache of optimized graphs.
+
+The optimizer output of a FunctionGraph is stored on disk in
+`config.compiledir`/optimized_graphs, one pickled file per graph. The file
+name is a hash of the graph computation before optimization together with a
+fingerprint of the optimizer and of the Theano configuration, so a process
+compiling the same function again finds the optimized graph without running
+the optimizer.
+
+Writes are atomic (a temporary file is renamed), so no lock is needed to
+share the cache between processes. When the cache grows over
+`config.cache_optimizations_max_size` megabytes, the least recently used
+entries are deleted.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import logging
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+import numpy as np
+import six.moves.cPickle as pickle
+
+import theano
+from theano import config, gof
+from theano.gof.utils import hash_from_code
+
+_logger = logging.getLogger('theano.compile.optcache')
+
+# Pickling a graph recurses along its longest path.
+min_recursion = 10000
+
+
+@contextmanager
+def _recursion_limit():
+    old_limit = sys.getrecursionlimit()
+    if old_limit < min_recursion:
+        sys.setrecursionlimit(min_recursion)
+    try:
+        yield
+    finally:
+        sys.setrecursionlimit(old_limit)
+
+
+def hash_fgraph(fgraph, input_specs=None):
+    """
+    Return a hash of the computation done by `fgraph`.
+
+    Two graphs get the same hash if they have the same inputs types, the same
+    ops (compared through their pickle) applied in the same topological order
+    to the same inputs, and the same constants. Variable names are ignored.
+
+    Parameters
+    ----------
+    fgraph : FunctionGraph
+    input_specs : list of SymbolicInput
+        If provided, the properties of the inputs that change how the graph
+        is optimized are included in the hash.
+
+    Raises
+    ------
+    Exception
+        Any exception raised while pickling an op, a type or a constant.
+
+    """
+    obj_hash = {}
+
+    def hash_obj(obj):
+        if id(obj) not in obj_hash:
+            obj_hash[id(obj)] = (
+                hash_from_code(pickle.dumps(obj, protocol=2)), obj)
+        return obj_hash[id(obj)][0]
+
+    var_sig = {}
+    lines = []
+    for pos, var in enumerate(fgraph.inputs):
+        var_sig[var] = 'i%i' % pos
+        lines.append('i%i:%s' % (pos, hash_obj(var.type)))
+    if input_specs is not None:
+        lines.append(str([(bool(spec.mutable), spec.update is not None)
+                          for spec in input_specs]))
+    lines.append(str(sorted((fgraph.update_mapping or {}).items())))
+    for node_pos, node in enumerate(fgraph.toposort()):
+        inputs = []
+        for var in node.inputs:
+            if var not in var_sig:
+                assert isinstance(var, gof.Constant), var
+                data = var.data
+                if isinstance(data, np.ndarray):
+                    data_hash = '%s%s%s' % (data.dtype, data.shape,
+                                            hash_from_code(
+                                                np.ascontiguousarray(data)))
+                else:
+                    data_hash = hash_obj(data)
+                var_sig[var] = 'c:%s:%s' % (hash_obj(var.type), data_hash)
+            inputs.append(var_sig[var])
+        lines.append('%s(%s)' % (hash_obj(node.op), ','.join(inputs)))
+        for out_pos, var in enumerate(node.outputs):
+            var_sig[var] = 'n%i.%i' % (node_pos, out_pos)
+    lines.append('outputs:' + ','.join(var_sig[var]
+                                       for var in fgraph.outputs))
+    return hash_from_code('\n'.join(lines))
+
+
+def _db_names(db):
+    names = []
+    for name in sorted(db._names):
+        names.append(name)
+        obj, = db.__db__[name]
+        if isinstance(obj, gof.DB):
+            names.append(_db_names(obj))
+    return names
+
+
+def optimizer_fingerprint(optimizer):
+    """
+    Return a string identifying `optimizer` and everything it depends on, or
+    None if it cannot be identified reliably.
+
+    Parameters
+    ----------
+    optimizer
+        The `_optimizer` of a Mode, either a Query or an Optimizer.
+
+    """
+    if not isinstance(optimizer, gof.Query) or optimizer.extra_optimizations:
+        # Other optimizers do not have a string identifying them.
+        return None
+    config_values = []
+    for cv in theano.configparser._config_var_list:
+        config_values.append('%s=%s' % (cv.fullname, cv.__get__(True, None)))
+    return '\n'.join([theano.__version__,
+                      sys.version,
+                      str(optimizer),
+                      str(_db_names(theano.compile.mode.optdb))] +
+                     config_values)
+
+
+class OptimizedGraphCache(object):
+    """
+    Interface to the directory holding the optimized graphs.
+
+    Parameters
+    ----------
+    dirname : str
+        The directory containing the cache entries.
+    max_size : float
+        Maximum size of the cache in bytes.
+
+    """
+
+    def __init__(self, dirname, max_size):
+        self.dirname = dirname
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, fgraph, input_specs, optimizer):
+        """
+        Return the cache key of `fgraph`, or None if it cannot be cached.
+
+        """
+        fingerprint = optimizer_fingerprint(optimizer)
+        if fingerprint is None:
+            return None
+        try:
+            graph_hash = hash_fgraph(fgraph, input_specs)
+        except Exception as e:
+            _logger.debug('Cannot hash graph: %s', e)
+            return None
+        return hash_from_code(graph_hash + fingerprint)
+
+    def _path(self, key):
+        return os.path.join(self.dirname, key + '.pkl')
+
+    def get(self, key):
+        """
+        Return the optimized FunctionGraph stored for `key`, or None.
+
+        """
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f, _recursion_limit():
+                fgraph = pickle.load(f)
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception as e:
+            # Corrupted entry, or it contains things that cannot be loaded
+            # in this process anymore.
+            _logger.warning('Deleting unreadable optimized graph %s: %s',
+                            path, e)
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            self.misses += 1
+            return None
+        try:
+            # Used to find the least recently used entries.
+            os.utime(path, None)
+        except OSError:
+            pass
+        self.hits += 1
+        return fgraph
+
+    def put(self, key, fgraph):
+        """
+        Store the optimized `fgraph` under `key`.
+
+        Graphs that cannot be pickled are not stored.
+
+        """
+        if not os.path.isdir(self.dirname):
+            try:
+                os.makedirs(self.dirname)
+            except OSError:
+                # Someone else probably created it at the same time.
+                assert os.path.isdir(self.dirname)
+        fd, tmp_path = tempfile.mkstemp(dir=self.dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f, _recursion_limit():
+                pickle.dump(fgraph, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, self._path(key))
+        except Exception as e:
+            _logger.debug('Cannot store optimized graph: %s', e)
+            os.remove(tmp_path)
+            return
+        self.evict()
+
+    def evict(self):
+        """
+        Delete the least recently used entries until the cache is smaller
+        than `max_size`.
+
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.dirname):
+            if not name.endswith('.pkl'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.dirname, name))
+            except OSError:
+                # Deleted by another process.
+                continue
+            entries.append((st.st_mtime, st.st_size, name))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, name in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.dirname, name))
+            except OSError:
+                pass
+            total -= size
+
+
+_optimized_graph_cache = None
+
+
+def get_optimized_graph_cache():
+    """
+    Return the OptimizedGraphCache of the current compiledir.
+
+    """
+    global _optimized_graph_cache
+    dirname = os.path.join(config.compiledir, 'optimized_graphs')
+    if (_optimized_graph_cache is None or
+            _optimized_graph_cache.dirname != dirname):
+        _optimized_graph_cache = OptimizedGraphCache(dirname, 0)
+    _optimized_graph_cache.max_size = (
+        config.cache_optimizations_max_size * 2 ** 20)
+    return _optimized_graph_cache
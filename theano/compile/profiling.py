@@ -11,12 +11,14 @@ from __future__ import absolute_import, print_function, division
 
 import atexit
 import copy
+import json
 import logging
 import operator
 import os
 import sys
+import threading
 import time
-from collections import defaultdict
+from collections import defaultdict, deque
 from six import iteritems
 import warnings
 
@@ -24,6 +26,7 @@ import numpy as np
 
 import theano
 from theano.gof import graph
+from theano.gof.compiletime import CompilePhaseStats
 
 __authors__ = "James Bergstra"
 __reviewer__ = "Razvan Pascanu"
@@ -81,7 +84,7 @@ def _atexit_print_fn():
             cum.message = msg
             for ps in to_sum[1:]:
                 for attr in ["compile_time", "fct_call_time", "fct_callcount",
-                             "vm_call_time", "optimizer_time", "linker_time",
+                             "sampled_callcount", "vm_call_time", "optimizer_time", "linker_time",
                              "validate_time", "import_time",
                              "linker_node_make_thunks"]:
                     setattr(cum, attr, getattr(cum, attr) + getattr(ps, attr))
@@ -96,6 +99,11 @@ def _atexit_print_fn():
                         assert key not in cum_attr, (key, cum_attr)
                         cum_attr[key] = val
 
+                if (cum.compile_phases is not None and
+                        ps.compile_phases is not None):
+                    cum.compile_phases = cum.compile_phases.merge(
+                        ps.compile_phases)
+
                 if cum.optimizer_profile and ps.optimizer_profile:
                     try:
                         merge = cum.optimizer_profile[0].merge_profile(
@@ -156,6 +164,55 @@ def register_profiler_printer(fct):
     return fct
 
 
+class CallTrace(object):
+    """
+    Timeline of the thunks run by a VM during one call of a Function.
+
+    An instance is set as the `trace` attribute of the VM during the call.
+
+    Attributes
+    ----------
+    start, end : float
+        Time of the beginning and of the end of the call of the VM.
+    thread : int
+        Identifier of the thread that called the function.
+    events : list of tuples
+        ``(node, i, t0, t1, thread, shapes, nbytes)`` for each thunk run,
+        where `i` is the position of the node in the VM, `shapes` the
+        shapes of its outputs (or None) and `nbytes` the number of bytes of
+        the outputs that are not views or inplace.
+
+    """
+
+    def __init__(self, vm):
+        self.nodes = vm.nodes
+        self.thunks = vm.thunks
+        self.thread = threading.current_thread().ident
+        self.start = self.end = None
+        self.events = []
+
+    def __call__(self, i, t0, t1):
+        node = self.nodes[i]
+        aliased = set(getattr(node.op, 'view_map', {}))
+        aliased.update(getattr(node.op, 'destroy_map', {}))
+        shapes = []
+        nbytes = 0
+        for o, cell in enumerate(getattr(self.thunks[i], 'outputs', [])):
+            shape = getattr(cell[0], 'shape', None)
+            shapes.append(None if shape is None else list(shape))
+            if o not in aliased:
+                nbytes += getattr(cell[0], 'nbytes', 0)
+        self.events.append((node, i, t0, t1,
+                            threading.current_thread().ident, shapes,
+                            nbytes))
+
+    def finish(self, start, end):
+        self.start = start
+        self.end = end
+        # Do not keep the thunks alive.
+        self.nodes = self.thunks = None
+
+
 class ProfileStats(object):
 
     """
@@ -177,7 +234,9 @@ class ProfileStats(object):
         # self.compile_time = 0.
         self.fct_call_time = 0.
         self.fct_callcount = 0
+        self.sampled_callcount = 0
         self.vm_call_time = 0.
+        self.traces = None
         self.apply_time = {}
         self.apply_callcount = {}
         # self.apply_cimpl = None
@@ -202,6 +261,33 @@ class ProfileStats(object):
     # Number of calls to Function.__call__
     #
 
+    sample_every = 1
+    # Only the thunks of one call in sample_every are timed (see
+    # profiling.sample_every). The times and call counts of the Apply nodes
+    # are scaled accordingly.
+    #
+
+    sampled_callcount = 0
+    # Number of calls to Function.__call__ whose thunks were timed
+    #
+
+    snapshot_interval = 0
+    # If > 0, snapshot_callback is called with the result of snapshot()
+    # after a call, at most once every snapshot_interval seconds.
+    #
+
+    snapshot_callback = None
+    #
+
+    max_traces = 0
+    # Number of timed calls whose timeline is kept in traces (the last
+    # ones).
+    #
+
+    traces = None
+    # deque of CallTrace
+    #
+
     vm_call_time = 0.0
     # Total time spent in Function.fn.__call__
     #
@@ -262,10 +348,14 @@ class ProfileStats(object):
     optimizer_profile = None
     # None or tuple (the optimizer, the profile it returned)
 
+    compile_phases = None
+    # CompilePhaseStats: time spent in each phase of the compilation
+    # (graph cloning, optimizers, C code generation, C compiler, ...)
+
     # param is called flag_time_thunks because most other attributes with time
     # in the name are times *of* something, rather than configuration flags.
     def __init__(self, atexit_print=True, flag_time_thunks=None,
-                 gpu_checks=True, **kwargs):
+                 gpu_checks=True, sample_every=None, **kwargs):
         if (gpu_checks and
             (hasattr(theano, 'gpuarray') and
              theano.gpuarray.pygpu_activated) and
@@ -298,10 +388,16 @@ class ProfileStats(object):
         self.variable_shape = {}
         self.variable_strides = {}
         self.variable_offset = {}
+        self.compile_phases = CompilePhaseStats()
         if flag_time_thunks is None:
             self.flag_time_thunks = config.profiling.time_thunks
         else:
             self.flag_time_thunks = flag_time_thunks
+        if sample_every is None:
+            self.sample_every = config.profiling.sample_every
+        else:
+            self.sample_every = sample_every
+        self._last_snapshot = time.time()
         self.__dict__.update(kwargs)
         if atexit_print:
             global _atexit_print_list
@@ -312,6 +408,124 @@ class ProfileStats(object):
                 _atexit_registered = True
         self.ignore_first_call = theano.config.profiling.ignore_first_call
 
+    def sample_call(self):
+        """
+        Return True if the thunks of the next call should be timed.
+
+        """
+        return self.fct_callcount % self.sample_every == 0
+
+    def snapshot(self):
+        """
+        Return the statistics gathered so far, as a dict that can be
+        serialized with json.
+
+        The Ops and Apply nodes are sorted by decreasing time.
+
+        """
+        op_callcount = self.op_callcount()
+        op_nodes = self.op_nodes()
+        ops = [{'op': str(op), 'time': t,
+                'callcount': op_callcount.get(op, 0),
+                'nodes': op_nodes.get(op, 0)}
+               for op, t in iteritems(self.op_time())]
+        ops.sort(key=lambda d: d['time'], reverse=True)
+        applies = [{'apply': str(node), 'op': str(node.op), 'time': t,
+                    'callcount': self.apply_callcount.get(node, 0)}
+                   for node, t in iteritems(self.apply_time)]
+        applies.sort(key=lambda d: d['time'], reverse=True)
+        return {'message': self.message,
+                'time': time.time(),
+                'fct_callcount': self.fct_callcount,
+                'sampled_callcount': self.sampled_callcount,
+                'sample_every': self.sample_every,
+                'fct_call_time': self.fct_call_time,
+                'vm_call_time': self.vm_call_time,
+                'ops': ops,
+                'applies': applies}
+
+    def trace_call(self, fn):
+        """
+        If timelines are kept, set the `trace` attribute of the VM `fn` to
+        record the thunks it runs during the next call and return the
+        CallTrace. Otherwise return None.
+
+        """
+        if not self.max_traces or not hasattr(fn, 'nodes'):
+            return None
+        if self.traces is None or self.traces.maxlen != self.max_traces:
+            self.traces = deque(self.traces or (), maxlen=self.max_traces)
+        trace = CallTrace(fn)
+        fn.trace = trace
+        self.traces.append(trace)
+        return trace
+
+    def to_chrome_trace(self, file):
+        """
+        Write the timelines kept in `traces` in the trace event format of
+        Chrome (chrome://tracing, Perfetto).
+
+        Each call is an event on the thread that made it, and each thunk an
+        event on the thread that ran it, named after its Op. The arguments
+        of a thunk event are the node, its position in the VM, the shapes
+        of its outputs and the bytes allocated for them.
+
+        """
+        traces = [trace for trace in self.traces or ()
+                  if trace.start is not None]
+        pid = os.getpid()
+        events = []
+        if traces:
+            origin = min(trace.start for trace in traces)
+        for trace in traces:
+            events.append({'name': str(self.message or 'call'),
+                           'cat': 'call', 'ph': 'X', 'pid': pid,
+                           'tid': trace.thread,
+                           'ts': (trace.start - origin) * 1e6,
+                           'dur': (trace.end - trace.start) * 1e6})
+            for node, i, t0, t1, thread, shapes, nbytes in trace.events:
+                events.append({'name': str(node.op), 'cat': 'thunk',
+                               'ph': 'X', 'pid': pid, 'tid': thread,
+                               'ts': (t0 - origin) * 1e6,
+                               'dur': (t1 - t0) * 1e6,
+                               'args': {'node': str(node), 'id': i,
+                                        'shapes': shapes, 'bytes': nbytes}})
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+    def to_collapsed_stacks(self, file):
+        """
+        Write the time of the Apply nodes in the collapsed stack format of
+        the flamegraph tools (flamegraph.pl, speedscope): one line
+        ``function;Op class;node count`` per node, with the time in
+        microseconds as count.
+
+        """
+        def frame(name):
+            return str(name).replace(';', ':').replace('\n', ' ')
+
+        function = frame(self.message or 'function')
+        lines = []
+        for node, t in iteritems(self.apply_time):
+            count = int(round(t * 1e6))
+            if count > 0:
+                lines.append('%s;%s;%s %d' % (
+                    function, frame(type(node.op).__name__), frame(node),
+                    count))
+        for line in sorted(lines):
+            print(line, file=file)
+
+    def maybe_snapshot(self):
+        """
+        Call snapshot_callback with a snapshot if snapshot_interval seconds
+        have passed since the last one.
+
+        """
+        if self.snapshot_interval > 0 and self.snapshot_callback is not None:
+            now = time.time()
+            if now - self._last_snapshot >= self.snapshot_interval:
+                self._last_snapshot = now
+                self.snapshot_callback(self.snapshot())
+
     def class_time(self):
         """
         dict op -> total time on thunks
@@ -739,6 +953,11 @@ class ProfileStats(object):
                 print('  Time in thunks: %es (%.3f%%)' %
                       (local_time, 100 * local_time / self.fct_call_time),
                       file=file)
+            if self.sample_every > 1:
+                print('    Thunks timed in %i calls (1 in %i), times and '
+                      'calls of the Apply nodes scaled by %i' % (
+                          self.sampled_callcount, self.sample_every,
+                          self.sample_every), file=file)
         print('  Total compile time: %es' % self.compile_time, file=file)
         print('    Number of Apply nodes: %d' % self.nb_nodes, file=file)
         print('    Theano Optimizer time: %es' % self.optimizer_time,
@@ -1311,6 +1530,8 @@ class ProfileStats(object):
     def summary(self, file=sys.stderr, n_ops_to_print=20,
                 n_apply_to_print=20):
         self.summary_function(file)
+        if self.compile_phases is not None and self.compile_phases.phase_count:
+            self.compile_phases.summary(file)
         self.summary_globals(file)
         local_time = sum(self.apply_time.values())
         if local_time > 0:
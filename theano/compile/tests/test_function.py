@@ -2,7 +2,9 @@ from __future__ import absolute_import, print_function, division
 import six.moves.cPickle as pickle
 import os
 import shutil
+import sys
 import tempfile
+import threading
 import unittest
 
 import numpy as np
@@ -30,6 +32,64 @@ def test_function_dump():
     assert np.allclose(fct1(x), fct2(x))
 
 
+def test_function_many():
+    x = theano.tensor.vector('x')
+    w = theano.shared(np.ones(3, dtype=theano.config.floatX), 'w')
+    specs = [dict(inputs=[x], outputs=(x * w).sum(), name='dot'),
+             dict(inputs=[x], outputs=[], updates=[(w, w + x)]),
+             dict(inputs=[x], outputs=theano.tensor.tanh(x) * w)]
+    for workers in [1, 2]:
+        w.set_value(np.ones(3, dtype=theano.config.floatX))
+        f_dot, f_update, f_tanh = theano.compile.function_many(
+            specs, workers=workers)
+        assert f_dot.name == 'dot'
+        val = np.arange(3).astype(theano.config.floatX)
+        assert np.allclose(f_dot(val), val.sum())
+        # The functions use the shared variable itself, not a copy.
+        f_update(val)
+        assert np.allclose(w.get_value(), val + 1)
+        assert np.allclose(f_dot(val), (val * (val + 1)).sum())
+        w.set_value(np.zeros(3, dtype=theano.config.floatX))
+        assert np.allclose(f_tanh(val), 0)
+        assert f_tanh.maker.inputs[0].variable is x
+
+    # The errors are raised in this process.
+    bad_specs = specs + [dict(inputs=[x], outputs=x, updates=[(x, x)])]
+    try:
+        theano.compile.function_many(bad_specs, workers=2)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('function_many did not raise')
+
+    # The functions of a worker that dies are compiled in this process.
+    # (theano.compile.function is the function, not the module.)
+    module = sys.modules['theano.compile.function']
+    orig = module._function_many_compile
+    module._function_many_compile = _die_in_worker
+    try:
+        w.set_value(np.ones(3, dtype=theano.config.floatX))
+        f_dot, f_update, f_tanh = theano.compile.function_many(
+            specs, workers=2, timeout=5)
+    finally:
+        module._function_many_compile = orig
+    assert np.allclose(f_dot(val), val.sum())
+
+    # Nothing is forked while threads of Theano are running.
+    event = threading.Event()
+    thread = threading.Thread(target=event.wait, name='theano-test')
+    thread.start()
+    try:
+        assert module._theano_threads_running()
+    finally:
+        event.set()
+        thread.join()
+
+
+def _die_in_worker(index):
+    os._exit(1)
+
+
 class TestFunctionIn(unittest.TestCase):
 
     def test_in_strict(self):
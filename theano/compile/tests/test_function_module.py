@@ -1,5 +1,7 @@
 from __future__ import absolute_import, print_function, division
 import copy
+import threading
+import six
 import six.moves.cPickle as pickle
 import numpy as np
 import unittest
@@ -10,6 +12,7 @@ from six import iteritems
 from theano.compile.io import In, Out
 from theano.compile import function
 from theano.compile import UnusedInputError
+from theano.compile.ops import as_op
 from theano.gof import MissingInputError
 from theano.compat import exc_message
 from theano.tests.unittest_tools import SkipTest
@@ -591,6 +594,266 @@ class T_function(unittest.TestCase):
         except TypeError:
             assert(func(first=1) == x)
 
+    def test_call_plan(self):
+        x, y = T.dvectors('x', 'y')
+        s = theano.shared(np.zeros(2))
+        f = function([x, y], [x + y, x * y], updates=[(s, x - y)])
+        assert f._call_plan is not None
+        a, b = np.array([1., 2.]), np.array([3., 5.])
+        out = f(a, b)
+        assert isinstance(out, list)
+        utt_out = f(x=a, y=b)
+        for o, e in zip(out, utt_out):
+            assert np.allclose(o, e)
+        assert np.allclose(out[0], [4, 7])
+        assert np.allclose(s.get_value(), [-2, -3])
+        # Arguments that must be converted or rejected go through the
+        # general path.
+        assert np.allclose(f([1, 2], [3, 4])[1], [3, 8])
+        self.assertRaises(TypeError, f, a, np.ones((2, 2)))
+        try:
+            f(a, 'foo')
+        except Exception as e:
+            assert 'Bad input argument' in str(e)
+        else:
+            assert False
+        self.assertRaises(TypeError, f, a)
+
+        # Single outputs are unpacked and output keys are kept.
+        g = function([x], {'a': x + 1, 'b': x * 2})
+        assert g._call_plan is not None
+        out = g(a)
+        assert np.allclose(out['a'], [2, 3]) and np.allclose(out['b'], [2, 4])
+        h = function([x], x.sum())
+        assert np.allclose(h(a), 3)
+
+        # Functions with defaults or inputs that can be destroyed use the
+        # general path.
+        assert function([x, In(y, value=[1., 1.])], x + y)._call_plan is None
+        assert function([In(x, mutable=True)], x + 1)._call_plan is None
+
+    def test_call_plan_inplace_update(self):
+        x = T.dvector('x')
+        w = theano.shared(np.ones(3), 'w')
+        f = function([x], (x * w).sum(), updates=[(w, w - 0.5 * x)],
+                     mode=theano.compile.get_default_mode().including(
+                         'inplace'))
+        fgraph = f.maker.fgraph
+        if not (hasattr(fgraph, 'destroyers') and
+                fgraph.destroyers(fgraph.inputs[1])):
+            raise SkipTest("The update is not done inplace.")
+        assert f._call_plan is not None
+        a = np.array([1., 2., 3.])
+        assert np.allclose(f(a), 6)
+        assert np.allclose(w.get_value(), [.5, 0, -.5])
+        assert f.input_storage[0].storage[0] is None
+
+        # An argument sharing memory with w is copied before w is updated
+        # inplace.
+        w.set_value(np.array([1., 2., 3.]))
+        assert np.allclose(f(w.get_value(borrow=True)), 14)
+        assert np.allclose(w.get_value(), [.5, 1, 1.5])
+
+        # The update reads the argument in the reverse order, so it would
+        # read the values it already wrote without the copy.
+        g = function([x], [], updates=[(w, w - x[::-1])],
+                     mode=theano.compile.get_default_mode().including(
+                         'inplace'))
+        fgraph = g.maker.fgraph
+        if not fgraph.destroyers(fgraph.inputs[1]):
+            raise SkipTest("The update is not done inplace.")
+        assert g._call_plan is not None
+        w.set_value(np.array([1., 2., 3.]))
+        g(w.get_value(borrow=True))
+        assert np.allclose(w.get_value(), [-2, 0, 2])
+
+    def test_map(self):
+        x, y = T.dvectors('x', 'y')
+        f = function([x, y], [T.exp(x + y), (x * y).sum()])
+        args_list = [(np.arange(3.) + i, np.ones(3) * i) for i in range(10)]
+        expected = [f(*args) for args in args_list]
+        for n_threads in [1, 3]:
+            outputs = f.map(args_list, n_threads=n_threads)
+            assert len(outputs) == len(expected)
+            for out, exp in zip(outputs, expected):
+                assert np.allclose(out[0], exp[0])
+                assert np.allclose(out[1], exp[1])
+        outputs = f.map([{'x': args[0], 'y': args[1]} for args in args_list])
+        assert np.allclose(outputs[-1][0], expected[-1][0])
+        assert f.map([]) == []
+        self.assertRaises(TypeError, f.map, [args_list[0], (1.,)])
+        self.assertRaises(TypeError, f.map, [args_list[0], (1.,)], 2)
+        # The intermediate results are freed as after a call.
+        if getattr(f.fn, 'allow_gc', False):
+            assert f.fn.allow_gc
+            for var, cell in iteritems(f.fn.storage_map):
+                if var.owner is not None:
+                    assert cell[0] is None
+
+        # The updates are done in order.
+        s = theano.shared(0.)
+        z = T.dscalar('z')
+        g = function([z], s, updates=[(s, s * 2 + z)])
+        assert g.map([(1,), (2,), (3,)]) == [0, 1, 4]
+        assert s.get_value() == 11
+        self.assertRaises(ValueError, g.map, [(1,), (2,)], 2)
+
+    def test_out(self):
+        x = T.dmatrix('x')
+        s = theano.shared(0.)
+        f = function([x], [T.exp(x) + 1, x, x.sum()],
+                     updates=[(s, s + 1)])
+        a = np.random.rand(3, 4)
+        o1, o2 = np.empty_like(a), np.empty_like(a)
+        r = f(a, out=[o1, o2, None])
+        assert r[0] is o1 and r[1] is o2
+        assert np.allclose(o1, np.exp(a) + 1)
+        assert np.allclose(o2, a)
+        assert np.allclose(r[2], a.sum())
+        assert s.get_value() == 1
+        r = f(a * 2, out=[o1, None, None])
+        assert r[0] is o1 and r[1] is not o2
+        assert np.allclose(o1, np.exp(a * 2) + 1)
+
+        self.assertRaises(TypeError, f, a, out=[o1, o2])
+        self.assertRaises(TypeError, f, a, out=[o1.astype('float32'),
+                                                None, None])
+        self.assertRaises(TypeError, f, a, out=[a, None, None])
+        self.assertRaises(ValueError, f, a, out=[np.empty((4, 3)),
+                                                 None, None])
+        # The shapes are checked before the call, so the updates are not
+        # done.
+        assert s.get_value() == 2
+
+        g = function([x], T.exp(x))
+        o = np.empty_like(a)
+        assert g(a, out=o) is o
+        assert np.allclose(o, np.exp(a))
+
+        # An array of a different size is left untouched.
+        v = T.dvector('v')
+        h = function([v], v * 2, updates=[(s, s + 1)])
+        o = np.full(4, 7.)
+        try:
+            h(np.ones(3), out=o)
+        except ValueError as e:
+            assert 'Output 0 has shape (3,)' in str(e)
+        else:
+            assert False
+        assert o.shape == (4,) and np.all(o == 7)
+        assert s.get_value() == 2
+        assert np.allclose(h(np.ones(4), out=o), 2) and o[0] == 2
+
+        # An input named out is still given by keyword.
+        out = T.dvector('out')
+        k = function([out], out * 2)
+        assert np.allclose(k(out=np.ones(3)), [2, 2, 2])
+
+    def test_persistent_outputs(self):
+        x = T.dvector('x')
+        f = function([x], [x * 2, x.sum()])
+        f.persistent_outputs = True
+        r1 = f(np.ones(3))
+        first = r1[0]
+        r2 = f(np.arange(3.))
+        assert r2[0] is first
+        assert np.allclose(first, [0, 2, 4])
+        # The output of the previous call can be given as input.
+        r3 = f(r2[0])
+        assert r3[0] is not first
+        assert np.allclose(r3[0], [0, 4, 8])
+        # A different shape gets a new array.
+        assert np.allclose(f(np.ones(2))[0], [2, 2])
+
+    def test_async_call(self):
+        if six.PY2:
+            raise SkipTest("async_call needs asyncio")
+        import asyncio
+        started = threading.Event()
+        release = threading.Event()
+        calls = []
+
+        @as_op([T.dvector], [T.dvector])
+        def wait(a):
+            started.set()
+            release.wait(10)
+            return a + 1
+
+        @as_op([T.dvector], [T.dvector])
+        def record(a):
+            calls.append(a)
+            return a * 2
+
+        x = T.dvector('x')
+        s = theano.shared(0.)
+        f = function([x], record(wait(x)), updates=[(s, s + 1)])
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            release.set()
+            assert np.allclose(loop.run_until_complete(f.async_call(np.ones(2))),
+                               [4, 4])
+            assert s.get_value() == 1
+            if not isinstance(f.fn, gof.vm.VM):
+                return
+
+            # Cancelling the future stops the call before the next node.
+            release.clear()
+            started.clear()
+            future = f.async_call(np.ones(2))
+            assert started.wait(10)
+            future.cancel()
+            loop.run_until_complete(asyncio.sleep(0))
+            release.set()
+            f._async_executor.submit(lambda: None).result()
+            assert future.cancelled()
+            assert len(calls) == 1
+            assert s.get_value() == 1
+
+            assert np.allclose(
+                loop.run_until_complete(f.async_call(x=np.zeros(2))), [2, 2])
+            assert s.get_value() == 2
+        finally:
+            release.set()
+            asyncio.set_event_loop(None)
+            loop.close()
+
+    def test_function_pool(self):
+        x = T.dvector('x')
+        w = theano.shared(np.ones(3), 'w')
+        f = function([x], [T.exp(x * w), (x * w).sum()])
+        pool = theano.compile.FunctionPool(f, size=2)
+        args_list = [np.arange(3.) + i for i in range(20)]
+        results = [None] * len(args_list)
+
+        def run(start):
+            for i in range(start, len(args_list), 4):
+                results[i] = pool(args_list[i])
+
+        threads = [threading.Thread(target=run, args=(start,))
+                   for start in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for a, r in zip(args_list, results):
+            assert np.allclose(r[0], np.exp(a))
+            assert np.allclose(r[1], a.sum())
+        assert 1 <= pool.n_copies <= 2
+
+        # The copies share the shared variables.
+        w.set_value(np.ones(3) * 2)
+        assert np.allclose(pool(np.ones(3))[1], 6)
+        f1 = pool.acquire()
+        f2 = pool.acquire()
+        assert f1 is not f2 and f1 is not f and f2 is not f
+        pool.release(f1)
+        assert pool.acquire() is f1
+
+        s = theano.shared(0.)
+        g = function([x], x, updates=[(s, s + 1)])
+        self.assertRaises(ValueError, theano.compile.FunctionPool, g)
+
 
 class T_picklefunction(unittest.TestCase):
 
@@ -4,6 +4,7 @@ Test of memory profiling
 """
 from __future__ import absolute_import, print_function, division
 
+import json
 import unittest
 
 import numpy as np
@@ -11,6 +12,7 @@ import numpy as np
 import theano
 from six.moves import StringIO
 import theano.tensor as T
+from theano.gof import compiletime
 from theano.ifelse import ifelse
 
 
@@ -108,6 +110,131 @@ class Test_profiling(unittest.TestCase):
             theano.config.profile = config1
             theano.config.profile_memory = config2
 
+    def test_compile_phases(self):
+        x = T.fvector('x')
+        p = theano.ProfileStats(False, gpu_checks=False)
+        theano.function([x], T.tanh(x) * 2 + x.sum(), profile=p,
+                        mode='FAST_RUN')
+        stats = p.compile_phases
+        assert stats.phase_count['fgraph'] == 1
+        # The optimizers nested in the optimizer phase are only items.
+        assert stats.phase_count['optimizer'] == 1
+        assert any(phase == 'optimizer' for phase, item in stats.item_time)
+        assert stats.phase_count['linker'] == 1
+        assert 0 < sum(stats.phase_time.values()) <= stats.total_time
+        if theano.config.cxx:
+            assert stats.phase_count['cmodule_key'] > 0
+
+        buf = StringIO()
+        p.summary(buf)
+        assert 'Compile phases' in buf.getvalue()
+        buf = StringIO()
+        stats.to_json(buf)
+        d = json.loads(buf.getvalue())
+        assert d['total_time'] == stats.total_time
+        phases = [ph['phase'] for ph in d['phases']]
+        assert phases[:2] == ['fgraph', 'optimizer']
+
+        stats = compiletime.CompilePhaseStats()
+        with compiletime.collect(stats):
+            with compiletime.phase('compiler'):
+                with compiletime.phase('compiler', item='module'):
+                    pass
+            with compiletime.phase('compiler'):
+                pass
+        assert stats.phase_count['compiler'] == 2
+        assert ('compiler', 'module') in stats.item_time
+
+    def test_sampling(self):
+        x = T.dvector('x')
+        snapshots = []
+        p = theano.ProfileStats(False, gpu_checks=False, sample_every=4,
+                                snapshot_interval=1e-9,
+                                snapshot_callback=snapshots.append)
+        f = theano.function([x], T.tanh(x) * 2 + x.sum(), profile=p,
+                            mode='FAST_RUN')
+        for i in range(10):
+            assert np.allclose(f(np.ones(3) * i), np.tanh(i) * 2 + 3 * i)
+        assert p.fct_callcount == 10
+        assert p.sampled_callcount == 3
+        # The call counts are scaled.
+        assert p.apply_callcount
+        if isinstance(f.fn, theano.gof.vm.VM):
+            assert all(c == 12 for c in p.apply_callcount.values())
+            assert not f.fn.time_thunks
+
+        buf = StringIO()
+        p.summary(buf)
+        assert 'Thunks timed in 3 calls (1 in 4)' in buf.getvalue()
+
+        assert len(snapshots) == 3
+        snap = json.loads(json.dumps(snapshots[-1]))
+        assert snap['fct_callcount'] == 9
+        assert snap['sampled_callcount'] == 3
+        assert len(snap['applies']) == len(p.apply_time)
+        assert sum(op['nodes'] for op in snap['ops']) == len(p.apply_time)
+        times = [a['time'] for a in snap['applies']]
+        assert times == sorted(times, reverse=True)
+
+    def test_sampling_lazy(self):
+        # The Stack VM, used for lazy graphs, only counts the sampled calls.
+        x = T.dvector('x')
+        counts = []
+        for sample_every in [1, 10]:
+            p = theano.ProfileStats(False, gpu_checks=False,
+                                    sample_every=sample_every)
+            f = theano.function(
+                [x], ifelse(x.sum() > 0, T.tanh(x), T.exp(x)), profile=p,
+                mode=theano.Mode(linker=theano.gof.vm.VM_Linker(
+                    lazy=True, use_cloop=False)))
+            assert isinstance(f.fn, theano.gof.vm.Stack)
+            for i in range(100):
+                f(np.ones(3))
+            counts.append(sum(p.apply_callcount.values()))
+        assert counts[0] == counts[1]
+
+    def test_export(self):
+        x = T.dvector('x')
+        p = theano.ProfileStats(False, gpu_checks=False, max_traces=2,
+                                message='exported')
+        f = theano.function([x], T.exp(x).sum() + T.tanh(x), profile=p,
+                            mode='FAST_RUN')
+        for i in range(3):
+            f(np.ones(5))
+
+        buf = StringIO()
+        p.to_collapsed_stacks(buf)
+        lines = buf.getvalue().splitlines()
+        assert 0 < len(lines) <= len(p.apply_time)
+        for line in lines:
+            stack, count = line.rsplit(' ', 1)
+            assert stack.startswith('exported;')
+            assert len(stack.split(';')) == 3
+            assert int(count) > 0
+
+        if not hasattr(f.fn, 'nodes'):
+            assert p.traces is None
+            return
+        assert len(p.traces) == 2
+        assert f.fn.trace is None
+        buf = StringIO()
+        p.to_chrome_trace(buf)
+        events = json.loads(buf.getvalue())['traceEvents']
+        calls = [e for e in events if e['cat'] == 'call']
+        thunks = [e for e in events if e['cat'] == 'thunk']
+        assert len(calls) == 2
+        assert len(thunks) == 2 * len(f.fn.nodes)
+        assert calls[0]['ts'] == 0
+        for e in thunks:
+            assert calls[0]['ts'] <= e['ts']
+            assert e['ts'] + e['dur'] <= calls[-1]['ts'] + calls[-1]['dur']
+            assert e['args']['bytes'] in (0, 8, 40)
+            node = f.fn.nodes[e['args']['id']]
+            assert e['args']['node'] == str(node)
+            assert len(e['args']['shapes']) == len(node.outputs)
+        assert any(e['args']['shapes'] == [[5]] and e['args']['bytes'] == 40
+                   for e in thunks)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -472,16 +472,20 @@ del param
 if rc == 0 and config.cxx != "":
     # Keep the default linker the same as the one for the mode FAST_RUN
     AddConfigVar('linker',
-                 "Default linker used if the theano flags mode is Mode",
+                 "Default linker used if the theano flags mode is Mode."
+                 " vm_parallel only runs nodes concurrently while they"
+                 " release the GIL, as the BLAS Ops do.",
                  EnumStr('cvm', 'c|py', 'py', 'c', 'c|py_nogc',
-                         'vm', 'vm_nogc', 'cvm_nogc'),
+                         'vm', 'vm_nogc', 'cvm_nogc', 'vm_parallel'),
                  in_c_key=False)
 else:
     # g++ is not present or the user disabled it,
     # linker should default to python only.
     AddConfigVar('linker',
-                 "Default linker used if the theano flags mode is Mode",
-                 EnumStr('vm', 'py', 'vm_nogc'),
+                 "Default linker used if the theano flags mode is Mode."
+                 " vm_parallel only runs nodes concurrently while they"
+                 " release the GIL, as the BLAS Ops do.",
+                 EnumStr('vm', 'py', 'vm_nogc', 'vm_parallel'),
                  in_c_key=False)
     if type(config).cxx.is_default:
         # If the user provided an empty value for cxx, do not warn.
@@ -799,6 +803,18 @@ AddConfigVar(
     in_c_key=False)
 
 
+AddConfigVar(
+    'hash_consing',
+    ("If True, Op.__call__ reuses the node of a previous call with the same "
+     "op and inputs instead of building a duplicate one, so that graphs "
+     "are merged as they are built. Identical expressions are then the "
+     "same variable, e.g. naming one names the others. Ops with a "
+     "destroy_map are never reused, and nothing is reused while an "
+     "optimizer runs."),
+    BoolParam(False),
+    in_c_key=False)
+
+
 AddConfigVar(
     'print_test_value',
     ("If 'True', the __eval__ of a Theano variable will return its test_value "
@@ -908,14 +924,20 @@ AddConfigVar(
 
 AddConfigVar(
     'cache_optimizations',
-    "WARNING: work in progress, does not work yet. "
-    "Specify if the optimization cache should be used. This cache will "
-    "any optimized graph and its optimization. Actually slow downs a lot "
-    "the first optimization, and could possibly still contains some bugs. "
-    "Use at your own risks.",
+    "Specify if the optimization cache should be used. This cache stores "
+    "on disk (in compiledir/optimized_graphs) the optimized version of "
+    "each compiled graph, so that compiling the same graph again, in the "
+    "same or another process, skips the optimizer.",
     BoolParam(False),
     in_c_key=False)
 
+AddConfigVar(
+    'cache_optimizations_max_size',
+    "In MB. When the optimization cache gets bigger than this, the least "
+    "recently used graphs are deleted from it.",
+    FloatParam(256, lambda i: i >= 0),
+    in_c_key=False)
+
 
 def good_seed_param(seed):
     if seed == "random":
@@ -1042,6 +1064,13 @@ AddConfigVar('profiling.time_thunks',
              BoolParam(True),
              in_c_key=False)
 
+AddConfigVar('profiling.sample_every',
+             "When profiling, time the thunks of only one call in N. The "
+             "time and number of calls of each Apply node are estimated "
+             "by scaling the sampled ones by N.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
 AddConfigVar('profiling.n_apply',
              "Number of Apply instances to print by default",
              IntParam(20, lambda i: i > 0),
@@ -1100,6 +1129,14 @@ AddConfigVar('optdb.max_use_ratio',
              FloatParam(8),
              in_c_key=False)
 
+AddConfigVar('optdb.incremental',
+             'If True, after their first pass over the graph, the '
+             'EquilibriumOptimizers only visit again the nodes whose inputs '
+             'or clients changed, and do a last pass over the whole graph '
+             'to check the equilibrium.',
+             BoolParam(False),
+             in_c_key=False)
+
 AddConfigVar('gcc.cxxflags',
              "Extra compiler flags for gcc",
              StrParam(""),
@@ -1134,6 +1171,14 @@ AddConfigVar('cmodule.preload_cache',
              BoolParam(False, allow_override=False),
              in_c_key=False)
 
+AddConfigVar('cmodule.use_index',
+             "If True, keep an index of the compiled modules in "
+             "compiledir/module_index. Processes then find the modules "
+             "through it instead of walking the whole compiledir at startup "
+             "and on each cache miss.",
+             BoolParam(True, allow_override=False),
+             in_c_key=False)
+
 AddConfigVar('cmodule.age_thresh_use',
              "In seconds. The time after which "
              "Theano won't reuse a compile c module.",
@@ -1141,6 +1186,52 @@ AddConfigVar('cmodule.age_thresh_use',
              IntParam(60 * 60 * 24 * 24, allow_override=False),
              in_c_key=False)
 
+AddConfigVar('cmodule.max_cache_size',
+             "In megabytes. When the compiled modules take more space, the "
+             "least recently used ones are deleted when a process that "
+             "compiled new modules exits, or by 'theano-cache gc'. "
+             "0 means no limit.",
+             FloatParam(0, lambda x: x >= 0, allow_override=False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.max_cache_entries',
+             "Maximum number of compiled modules kept in the cache, see "
+             "cmodule.max_cache_size. 0 means no limit.",
+             IntParam(0, lambda i: i >= 0, allow_override=False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.parallel_compile',
+             "Number of C modules that can be compiled at the same time "
+             "when a function needs several modules that are not in the "
+             "cache. Each one is compiled by a separate compiler process. "
+             "1 disables parallel compilation.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
+AddConfigVar('cmodule.batch_compile',
+             "Maximum number of C modules that are compiled together into "
+             "one shared library when a function needs several modules "
+             "that are not in the cache. This saves compiler process "
+             "startups and library loads. 1 disables batching.",
+             IntParam(1, lambda i: i > 0),
+             in_c_key=False)
+
+AddConfigVar('cmodule.precompiled_headers',
+             "If True, g++ uses a precompiled header, built once in the "
+             "compiledir for each set of compiler flags, for the standard "
+             "headers included by all the C modules. The headers are never "
+             "removed by 'theano-cache clear', as other processes may be "
+             "using them.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('cmodule.key_cache_size',
+             "Maximum number of (op, input types, output types) combinations "
+             "for which the versions put in C module keys are remembered, to "
+             "compute the keys of big graphs faster.",
+             IntParam(10000, lambda i: i >= 0, allow_override=False),
+             in_c_key=False)
+
 AddConfigVar('cmodule.debug',
              "If True, define a DEBUG macro (if not exists) for any compiled C code.",
              BoolParam(False),
@@ -1425,6 +1516,23 @@ AddConfigVar('vm.lazy',
              ConfigParam('None', filter_vm_lazy),
              in_c_key=False)
 
+AddConfigVar('vm.memory_planner',
+             "Useful only for the vm linkers. If True, intermediate results "
+             "whose lifetimes do not overlap and that have the same type and "
+             "shape share their storage, so that their ops reuse the same "
+             "buffers instead of allocating new ones. Only done for the "
+             "graphs whose shapes were inferred by the optimizer. With "
+             "allow_gc, a buffer is kept between its users, which can raise "
+             "the peak memory.",
+             BoolParam(False),
+             in_c_key=False)
+
+AddConfigVar('vm.n_threads',
+             "Number of threads used by the 'vm_parallel' linker to run "
+             "independent nodes at the same time. 0 means one per CPU.",
+             IntParam(0, lambda i: i >= 0),
+             in_c_key=False)
+
 AddConfigVar(
     'warn.identify_1pexp_bug',
     'Warn if Theano versions prior to 7987b51 (2011-12-18) could have '
@@ -1485,6 +1593,16 @@ AddConfigVar('compile.wait',
              IntParam(5, lambda i: i > 0, allow_override=False),
              in_c_key=False)
 
+AddConfigVar('compile.lock_mode',
+             "global: a single lock on the compilation directory protects "
+             "all compilations. per_module: only the module being compiled "
+             "is locked (with one fcntl lock file per module), so that "
+             "different modules can be compiled by different processes at "
+             "the same time. per_module is not available on Windows, where "
+             "global is always used.",
+             EnumStr('global', 'per_module'),
+             in_c_key=False)
+
 AddConfigVar('cycle_detection',
              "If cycle_detection is set to regular, most inplaces are allowed,"
              "but it is slower. If cycle_detection is set to faster, less inplaces"
@@ -183,6 +183,28 @@ def _config_print(thing, buf, print_doc=True):
         print("", file=buf)
 
 
+_config_version = 0
+"""
+Incremented each time a config option is added, or a config option that
+enters the C key (see `AddConfigVar`) changes value, so that values computed
+from these options can be cached as long as it does not change.
+
+"""
+_config_md5_cache = (None, None)
+
+
+def get_config_version():
+    """
+    Return a number that changes each time a config option is added, or a
+    config option that enters the C key changes value.
+
+    Setting other options, e.g. the ones toggled by each compilation, does
+    not change it.
+
+    """
+    return _config_version
+
+
 def get_config_md5():
     """
     Return a string md5 of the current config options. It should be such that
@@ -191,6 +213,16 @@ def get_config_md5():
 
     We only take into account config options for which `in_c_key` is True.
     """
+    global _config_md5_cache
+    version, md5 = _config_md5_cache
+    if version == _config_version:
+        return md5
+    md5 = _compute_config_md5()
+    _config_md5_cache = (_config_version, md5)
+    return md5
+
+
+def _compute_config_md5():
     all_opts = []
     for c in _config_var_list:
         if callable(c.in_c_key):
@@ -303,6 +335,8 @@ def AddConfigVar(name, doc, configparam, root=config, in_c_key=True):
                 pass
         setattr(root.__class__, sections[0], configparam)
         _config_var_list.append(configparam)
+        global _config_version
+        _config_version += 1
 
 
 class ConfigParam(object):
@@ -349,10 +383,21 @@ class ConfigParam(object):
                 "Can't change the value of this config parameter "
                 "after initialization!")
         # print "SETTING PARAM", self.fullname,(cls), val
+        had_val = hasattr(self, 'val')
+        old_val = getattr(self, 'val', None)
         if self.filter:
             self.val = self.filter(val)
         else:
             self.val = val
+        if getattr(self, 'in_c_key', True) is False:
+            return
+        try:
+            changed = not had_val or bool(old_val != self.val)
+        except Exception:
+            changed = True
+        if changed:
+            global _config_version
+            _config_version += 1
 
 
 class EnumStr(ConfigParam):
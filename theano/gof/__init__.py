@@ -74,7 +74,8 @@ from theano.gof.optdb import \
 from theano.gof.toolbox import \
     Feature, \
     Bookkeeper, History, Validator, ReplaceValidate, NodeFinder,\
-    PrintListener, ReplacementDidntRemovedError, NoOutputFromInplace
+    OpTypeIndex, PrintListener, ReplacementDidntRemovedError,\
+    NoOutputFromInplace
 
 from theano.gof.type import \
     Type, Generic, generic
@@ -25,6 +25,9 @@ from theano.gof import graph
 from theano.gof import link
 from theano.gof import utils
 from theano.gof import cmodule
+from theano.gof import compilelock
+from theano.gof import compiletime
+from theano.gof.fg import FunctionGraph
 from theano.gof.compilelock import get_lock, release_lock
 from theano.gof.callcache import CallCache
 
@@ -50,6 +53,19 @@ def get_module_cache(init_args=None):
 
 _persistent_module_cache = None
 
+_node_version_cache = utils.LRUCache(config.cmodule.key_cache_size)
+"""
+Maps (op, input types, output types, config version) to the versions of the
+op and types that `CLinker.cmodule_key_` puts in the key of each node.
+
+"""
+_key_header_cache = utils.LRUCache(100)
+"""
+Maps the arguments of `CLinker.cmodule_key_` that build the header of the
+key (compile arguments, libraries, ...) to that header.
+
+"""
+
 
 def get_persistent_module_cache():
     global _persistent_module_cache
@@ -59,6 +75,74 @@ def get_persistent_module_cache():
     return _persistent_module_cache
 
 
+def compile_nodes(nodes, storage_map, compute_map, no_recycling,
+                  n_jobs=None, batch_size=None):
+    """
+    Compile in parallel, or in batches, the C modules of `nodes` missing
+    from the cache.
+
+    This builds, for each node, the same single-node CLinker as
+    `Op.make_c_thunk`, so that the `make_thunk` calls done afterwards by
+    the linker find their module in the cache. Nodes that have no C
+    implementation are skipped.
+
+    Parameters
+    ----------
+    nodes
+        List of Apply nodes, usually in toposort order.
+    storage_map, compute_map, no_recycling
+        As given to `Op.make_thunk`.
+    n_jobs : int
+        Maximum number of compilations running at the same time. Defaults
+        to config.cmodule.parallel_compile.
+    batch_size : int
+        Maximum number of modules compiled into the same shared library.
+        Defaults to config.cmodule.batch_compile.
+
+    Returns
+    -------
+    int
+        The number of modules that were compiled.
+
+    """
+    if n_jobs is None:
+        n_jobs = config.cmodule.parallel_compile
+    if batch_size is None:
+        batch_size = config.cmodule.batch_compile
+    if (n_jobs <= 1 and batch_size <= 1) or not config.cxx:
+        return 0
+    key_lnk_pairs = []
+    for node in nodes:
+        if not hasattr(node.op, 'make_c_thunk'):
+            continue
+        if not getattr(node.op, '_f16_ok', False) and any(
+                getattr(v.type, 'dtype', '') == 'float16'
+                for v in node.inputs + node.outputs):
+            # make_c_thunk will fall back to the Python implementation.
+            continue
+        try:
+            node.op.prepare_node(node, storage_map=storage_map,
+                                 compute_map=compute_map, impl='c')
+            e = FunctionGraph(node.inputs, node.outputs)
+            e_no_recycling = [new_o for (new_o, old_o)
+                              in zip(e.outputs, node.outputs)
+                              if old_o in no_recycling]
+            lnk = CLinker().accept(e, no_recycling=e_no_recycling)
+            key = lnk.cmodule_key()
+            if key is None:
+                continue
+            # Done the same way in cthunk_factory.
+            for n in lnk.node_order:
+                n.op.prepare_node(n, storage_map, None, 'c')
+            # This raises MethodNotDefined if there is no C code.
+            lnk.get_src_code()
+        except (NotImplementedError, utils.MethodNotDefined, KeyError):
+            continue
+        key_lnk_pairs.append((key, lnk))
+    return get_module_cache().compile_many(key_lnk_pairs, n_jobs,
+                                           batch_size)
+
+
 class CodeBlock:
     """
     Represents a computation unit composed of declare, behavior, and cleanup.
@@ -1216,6 +1300,7 @@ class CLinker(link.Linker):
         res.nodes = self.node_order
         return res, in_storage, out_storage
 
+    @compiletime.timed('cmodule_key')
     def cmodule_key(self):
         """
         Return a complete hashable signature of the module we compiled.
@@ -1344,44 +1429,59 @@ class CLinker(link.Linker):
                                   enumerate(fgraph.inputs))
         constant_ids = dict()
         op_pos = {}  # Apply -> topological position
+        # The cached parts of the key are only valid while the config options
+        # in the C key keep their value.
+        config_version = theano.configparser.get_config_version()
 
         # First we put the header, compile_args, library names and config md5
         # into the signature.
-        sig = ['CLinker.cmodule_key']  # will be cast to tuple on return
-        if compile_args is not None:
-            # We must sort it as the order from a set is not guaranteed.
-            # In  particular, 2 sets with the same content can give different
-            # order depending on the order you put data in it.
-            # Sets are used to remove duplicate elements.
-            args = sorted(compile_args)
-            args = tuple(args)
-            sig.append(args)
-        if libraries is not None:
-            # see comments for compile_args
-            args = sorted(libraries)
-            args = tuple(args)
-            sig.append(args)
-
-        if header_dirs is not None:
-            args = sorted(header_dirs)
-            args = tuple(args)
-            sig.append(args)
-
-        # We must always add the numpy ABI version here as
-        # DynamicModule always add the include <numpy/arrayobject.h>
-        sig.append('NPY_ABI_VERSION=0x%X' %
-                   np.core.multiarray._get_ndarray_c_version())
-        if c_compiler:
-            sig.append('c_compiler_str=' + c_compiler.version_str())
-
-        # IMPORTANT: The 'md5' prefix is used to isolate the compilation
-        # parameters from the rest of the key. If you want to add more key
-        # elements, they should be before this md5 hash if and only if they
-        # can lead to a different compiled file with the same source code.
-        if insert_config_md5:
-            sig.append('md5:' + theano.configparser.get_config_md5())
-        else:
-            sig.append('md5: <omitted>')
+        header_key = tuple(None if args is None else tuple(args)
+                           for args in (compile_args, libraries,
+                                        header_dirs))
+        # c_compiler.version_str() depends on config.cxx, which is not in
+        # the config version.
+        header_key += (c_compiler, insert_config_md5, config_version,
+                       config.cxx)
+        sig = _key_header_cache.get(header_key)
+        if sig is None:
+            sig = ['CLinker.cmodule_key']  # will be cast to tuple on return
+            if compile_args is not None:
+                # We must sort it as the order from a set is not guaranteed.
+                # In  particular, 2 sets with the same content can give
+                # different order depending on the order you put data in it.
+                # Sets are used to remove duplicate elements.
+                args = sorted(compile_args)
+                args = tuple(args)
+                sig.append(args)
+            if libraries is not None:
+                # see comments for compile_args
+                args = sorted(libraries)
+                args = tuple(args)
+                sig.append(args)
+
+            if header_dirs is not None:
+                args = sorted(header_dirs)
+                args = tuple(args)
+                sig.append(args)
+
+            # We must always add the numpy ABI version here as
+            # DynamicModule always add the include <numpy/arrayobject.h>
+            sig.append('NPY_ABI_VERSION=0x%X' %
+                       np.core.multiarray._get_ndarray_c_version())
+            if c_compiler:
+                sig.append('c_compiler_str=' + c_compiler.version_str())
+
+            # IMPORTANT: The 'md5' prefix is used to isolate the compilation
+            # parameters from the rest of the key. If you want to add more key
+            # elements, they should be before this md5 hash if and only if
+            # they can lead to a different compiled file with the same source
+            # code.
+            if insert_config_md5:
+                sig.append('md5:' + theano.configparser.get_config_md5())
+            else:
+                sig.append('md5: <omitted>')
+            _key_header_cache[header_key] = sig = tuple(sig)
+        sig = list(sig)
 
         error_on_play = [False]
 
@@ -1435,12 +1535,30 @@ class CLinker(link.Linker):
 
         version = []
         for node_pos, node in enumerate(order):
-            if hasattr(node.op, 'c_code_cache_version_apply'):
-                version.append(node.op.c_code_cache_version_apply(node))
-            for i in node.inputs:
-                version.append(i.type.c_code_cache_version())
-            for o in node.outputs:
-                version.append(o.type.c_code_cache_version())
+            # The versions only depend on the op and the types, which are
+            # repeated across many nodes of big graphs.
+            node_key = (node.op,
+                        tuple(i.type for i in node.inputs),
+                        tuple(o.type for o in node.outputs),
+                        config_version)
+            try:
+                node_version = _node_version_cache.get(node_key)
+            except TypeError:
+                # Some op or type is not hashable.
+                node_key = node_version = None
+            if node_version is None:
+                node_version = []
+                if hasattr(node.op, 'c_code_cache_version_apply'):
+                    node_version.append(
+                        node.op.c_code_cache_version_apply(node))
+                for i in node.inputs:
+                    node_version.append(i.type.c_code_cache_version())
+                for o in node.outputs:
+                    node_version.append(o.type.c_code_cache_version())
+                node_version = tuple(node_version)
+                if node_key is not None:
+                    _node_version_cache[node_key] = node_version
+            version.extend(node_version)
 
             # add the signature for this node
             sig.append((
@@ -1481,10 +1599,12 @@ class CLinker(link.Linker):
                 return ((), sig)
         return version, sig
 
+    @compiletime.timed('code_gen')
     def get_src_code(self):
         mod = self.get_dynamic_module()
         return mod.code()
 
+    @compiletime.timed('compiler')
     def compile_cmodule(self, location=None):
         """
         This compiles the source code for this linker and returns a
@@ -1493,30 +1613,43 @@ class CLinker(link.Linker):
         """
         if location is None:
             location = cmodule.dlimport_workdir(config.compiledir)
-        mod = self.get_dynamic_module()
-        c_compiler = self.c_compiler()
-        libs = self.libraries()
-        preargs = self.compile_args()
         # We want to compute the code without the lock
-        src_code = mod.code()
-        get_lock()
+        c_compiler, compile_kwargs = self.compile_cmodule_args(location)
+        # With per-module locks, the caller holds the lock on this module
+        # and `location` is not shared with anybody else.
+        use_lock = not compilelock.use_module_locks()
+        if use_lock:
+            get_lock()
         try:
             _logger.debug("LOCATION %s", str(location))
-            module = c_compiler.compile_str(
-                module_name=mod.code_hash,
-                src_code=src_code,
-                location=location,
-                include_dirs=self.header_dirs(),
-                lib_dirs=self.lib_dirs(),
-                libs=libs,
-                preargs=preargs)
+            module = c_compiler.compile_str(**compile_kwargs)
         except Exception as e:
             e.args += (str(self.fgraph),)
             raise
         finally:
-            release_lock()
+            if use_lock:
+                release_lock()
         return module
 
+    def compile_cmodule_args(self, location):
+        """
+        Return the compiler and the keyword arguments of its `compile_str`
+        method that will compile this linker's module in `location`.
+
+        This does all the Python work needed before calling the compiler,
+        so that the compilation itself can be run in another thread.
+
+        """
+        mod = self.get_dynamic_module()
+        return self.c_compiler(), dict(
+            module_name=mod.code_hash,
+            src_code=mod.code(),
+            location=location,
+            include_dirs=self.header_dirs(),
+            lib_dirs=self.lib_dirs(),
+            libs=self.libraries(),
+            preargs=self.compile_args())
+
     def get_dynamic_module(self):
         """
         Return a cmodule.DynamicModule instance full of the code for our fgraph.
@@ -1808,6 +1941,8 @@ class OpWiseCLinker(link.LocalLinker):
             for k in storage_map:
                 compute_map[k] = [k.owner is None]
 
+            compile_nodes(order, storage_map, compute_map, no_recycling)
+
             thunks = []
             for node in order:
                 # make_thunk will try by default C code, otherwise
@@ -15,15 +15,17 @@ import stat
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import platform
 import distutils.sysconfig
 import warnings
+from multiprocessing.pool import ThreadPool
 
 import numpy.distutils
 
 import theano
-from theano.compat import PY3, decode, decode_iter
+from theano.compat import OrderedDict, PY3, decode, decode_iter
 from six import b, BytesIO, StringIO, string_types, iteritems
 from six.moves import xrange
 from theano.gof.utils import flatten
@@ -34,6 +36,7 @@ from theano.misc.windows import (subprocess_Popen,
 
 # we will abuse the lockfile mechanism when reading and writing the registry
 from theano.gof import compilelock
+from theano.gof import compiletime
 from theano.configdefaults import gcc_version_str, local_bitwidth
 
 importlib = None
@@ -248,6 +251,7 @@ static struct PyModuleDef moduledef = {{
     # TODO: add_type
 
 
+@compiletime.timed('dlimport')
 def dlimport(fullpath, suffix=None):
     """
     Dynamically load a .so, .pyd, .dll, or .py file.
@@ -375,6 +379,81 @@ def is_same_entry(entry_1, entry_2):
     return False
 
 
+# Preprocessor directives that can make the code of a module behave
+# differently when it follows the code of other modules in the same file.
+# The macros defined or undefined by a module are scoped by batch_src_code.
+_batch_unsafe_directive = re.compile(
+    r'^\s*#\s*(include|import|if|ifdef|ifndef|elif|else|endif|pragma)\b',
+    re.MULTILINE)
+
+_batch_macro_directive = re.compile(r'^\s*#\s*(?:define|undef)\s+(\w+)',
+                                    re.MULTILINE)
+
+
+def _split_includes(src_code):
+    """
+    Split the code generated by `DynamicModule.code` into its list of
+    #include lines and the rest of the code.
+
+    """
+    lines = src_code.split('\n')
+    n_includes = 0
+    while (n_includes < len(lines) and
+           lines[n_includes].startswith('#include')):
+        n_includes += 1
+    return lines[:n_includes], '\n'.join(lines[n_includes:])
+
+
+def batchable(src_code):
+    """
+    Return True if the module `src_code` can be compiled together with
+    other modules by `batch_src_code`.
+
+    """
+    return not _batch_unsafe_directive.search(_split_includes(src_code)[1])
+
+
+def batch_src_code(src_codes):
+    """
+    Return the code of one shared library holding several Python modules.
+
+    The code of each module, as generated by `DynamicModule.code`, is put in
+    its own C++ namespace, so that the names they define do not clash. Their
+    module init functions have C linkage, so each module can still be
+    imported from a copy or a hard link of the library named after it.
+    The macros a module defines or undefines are saved before its code and
+    restored after it with ``#pragma push_macro``/``pop_macro``, so that
+    they do not leak into the modules that follow.
+
+    Parameters
+    ----------
+    src_codes
+        List of source codes for which `batchable` is True.
+
+    """
+    includes = []
+    bodies = []
+    for i, src_code in enumerate(src_codes):
+        module_includes, body = _split_includes(src_code)
+        for include in module_includes:
+            if include not in includes:
+                includes.append(include)
+        macros = sorted(set(_batch_macro_directive.findall(body)))
+        bodies.append(''.join(
+            ['#pragma push_macro("%s")\n' % macro for macro in macros] +
+            ['namespace theano_batch_%i {\n%s\n}\n' % (i, body)] +
+            ['#pragma pop_macro("%s")\n' % macro for macro in macros]))
+    return '\n'.join(includes) + '\n' + ''.join(bodies)
+
+
+def _link_or_copy(src, dst):
+    # Hard links let the dynamic loader map the library only once.
+    try:
+        os.link(src, dst)
+    except (AttributeError, OSError):
+        shutil.copy2(src, dst)
+
+
 def get_module_hash(src_code, key):
     """
     Return an MD5 hash that uniquely identifies a module.
@@ -563,6 +642,173 @@ class KeyData(object):
                     pass
 
 
+class ModuleIndex(object):
+    """
+    Index of the modules stored in a ModuleCache directory.
+
+    The index is a text file mapping each module hash to the directory
+    containing that module, so that a module compiled by another process
+    can be found without walking the whole cache directory. The first line
+    is a header holding the index format version and the time the file was
+    last rewritten. Each process then appends one line per module it
+    compiles, and `rewrite` replaces the file by a compact version after a
+    full walk of the cache directory.
+
+    Where fcntl is available, `add` and `rewrite` lock the index file, so
+    that no line appended by another process is lost by a rewrite.
+
+    Parameters
+    ----------
+    filename : str
+        Path of the index file.
+
+    """
+
+    version = 1
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._reset()
+
+    def _reset(self):
+        self.dirs = {}
+        self.last_rewrite = None
+        self._file_id = None
+        self._offset = 0
+
+    def update(self):
+        """
+        Read the lines appended to the index since the last call.
+
+        Returns
+        -------
+        bool
+            False if the index file does not exist or has an incompatible
+            format, in which case it cannot be used.
+
+        """
+        try:
+            f = open(self.filename, 'rb')
+        except IOError:
+            self._reset()
+            return False
+        with f:
+            st = os.fstat(f.fileno())
+            file_id = (st.st_dev, st.st_ino)
+            if file_id != self._file_id or st.st_size < self._offset:
+                # The file was rewritten since we last read it.
+                self._reset()
+                header = decode(f.readline()).split()
+                if (len(header) != 3 or
+                        header[0] != 'theano-module-index' or
+                        header[1] != str(self.version)):
+                    return False
+                self.last_rewrite = float(header[2])
+                self._file_id = file_id
+                self._offset = f.tell()
+            f.seek(self._offset)
+            data = f.read()
+        # A process may be in the middle of appending a line.
+        end = data.rfind(b('\n')) + 1
+        for line in decode(data[:end]).splitlines():
+            parts = line.split()
+            if len(parts) == 2:
+                self.dirs[parts[0]] = parts[1]
+        self._offset += end
+        return True
+
+    def add(self, module_hash, subdir):
+        """
+        Record that the module `module_hash` is in directory `subdir`.
+
+        Nothing is written if the index file does not exist yet: it is
+        created by `rewrite`.
+
+        """
+        self.dirs[module_hash] = subdir
+        fd = self._open_locked(os.O_WRONLY | os.O_APPEND)
+        if fd is None:
+            return
+        try:
+            # Lines are short enough to be appended atomically.
+            os.write(fd, b('%s %s\n' % (module_hash, subdir)))
+        finally:
+            os.close(fd)
+
+    def _open_locked(self, flags):
+        """
+        Open the index file and lock it, if fcntl is available.
+
+        A process that rewrites the index holds the lock until the new file
+        has replaced the old one, so the file is opened again if it was
+        replaced while we waited for the lock. Closing the returned file
+        descriptor releases the lock. Return None if the file does not
+        exist.
+
+        """
+        while True:
+            try:
+                fd = os.open(self.filename, flags)
+            except OSError:
+                return None
+            if compilelock.fcntl is None:
+                return fd
+            try:
+                compilelock.fcntl.flock(fd, compilelock.fcntl.LOCK_EX)
+                st = os.fstat(fd)
+                current = os.stat(self.filename)
+            except OSError:
+                os.close(fd)
+                continue
+            if (st.st_dev, st.st_ino) == (current.st_dev, current.st_ino):
+                return fd
+            os.close(fd)
+
+    def rewrite(self, keep):
+        """
+        Replace the index file by a compact version.
+
+        The lines appended by other processes until the new file replaces
+        the old one are read first, so they are not lost.
+
+        Parameters
+        ----------
+        keep : callable
+            Called with the dict mapping module hashes to their directory
+            read from the index. Returns the dict of the entries to write.
+
+        """
+        fd = self._open_locked(os.O_RDONLY)
+        try:
+            self.update()
+            self._write(keep(dict(self.dirs)))
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def _write(self, dirs):
+        dirname, basename = os.path.split(self.filename)
+        fd, tmp_name = tempfile.mkstemp(prefix=basename + '.', dir=dirname)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(b('theano-module-index %s %r\n' % (self.version,
+                                                           time.time())))
+                for module_hash, subdir in sorted(iteritems(dirs)):
+                    f.write(b('%s %s\n' % (module_hash, subdir)))
+            try:
+                os.rename(tmp_name, self.filename)
+            except OSError:
+                # Windows does not replace existing files.
+                os.remove(self.filename)
+                os.rename(tmp_name, self.filename)
+        except Exception:
+            if os.path.exists(tmp_name):
+                os.remove(tmp_name)
+            raise
+        self._reset()
+        self.update()
+
+
 class ModuleCache(object):
     """
     Interface to the cache of dynamically compiled modules on disk.
@@ -622,7 +868,11 @@ class ModuleCache(object):
 
     do_refresh : bool
         If True, then the ``refresh`` method will be called
-        in the constructor.
+        in the constructor. When ``config.cmodule.use_index`` is True, this
+        only happens if the module index is missing or has not been rebuilt
+        for ``index_refresh_period`` seconds, or if
+        ``config.cmodule.preload_cache`` is True. Otherwise, the modules are
+        loaded lazily, through the index, when they are needed.
 
     """
 
@@ -661,6 +911,17 @@ class ModuleCache(object):
     """
     Set of all key.pkl files that have been loaded.
 
+    """
+    index = None
+    """
+    The ModuleIndex of the cache directory, or None if it is not used.
+
+    """
+    index_refresh_period = 60 * 60 * 24  # 1 day
+    """
+    Period (in seconds) after which a process walks the whole cache
+    directory at startup, to clean it up and rebuild the module index.
+
     """
 
     def __init__(self, dirname, check_for_broken_eq=True, do_refresh=True):
@@ -673,9 +934,17 @@ class ModuleCache(object):
         self.check_for_broken_eq = check_for_broken_eq
         self.loaded_key_pkl = set()
         self.time_spent_in_check_key = 0
+        self.full_refresh_done = False
+        if config.cmodule.use_index:
+            self.index = ModuleIndex(os.path.join(dirname, 'module_index'))
 
         if do_refresh:
-            self.refresh()
+            if (self.index is None or
+                    config.cmodule.preload_cache or
+                    not self.index.update() or
+                    time.time() - self.index.last_rewrite >
+                    self.index_refresh_period):
+                self.refresh()
 
     age_thresh_use = config.cmodule.age_thresh_use  # default 24 days
     """
@@ -699,6 +968,7 @@ class ModuleCache(object):
             self.stats[0] += 1
         return self.module_from_name[name]
 
+    @compiletime.timed('cache_refresh')
     def refresh(self, age_thresh_use=None, delete_if_problem=False,
                 cleanup=True):
         """
@@ -754,8 +1024,8 @@ class ModuleCache(object):
             subdirs = []
         files, root = None, None  # To make sure the "del" below works
         for subdirs_elem in subdirs:
-            # Never clean/remove lock_dir
-            if subdirs_elem == 'lock_dir':
+            # Never clean/remove lock_dir and module_locks
+            if subdirs_elem in ('lock_dir', 'module_locks'):
                 continue
             root = os.path.join(self.dirname, subdirs_elem)
             # Don't delete the gpuarray kernel cache
@@ -900,35 +1170,7 @@ class ModuleCache(object):
                                               age, entry)
                         continue
 
-                    # Remember the map from a module's hash to the KeyData
-                    # object associated with it.
-                    self.module_hash_to_key_data[mod_hash] = key_data
-
-                    for key in key_data.keys:
-                        if key not in self.entry_from_key:
-                            self.entry_from_key[key] = entry
-                            # Assert that we have not already got this
-                            # entry somehow.
-                            assert entry not in self.module_from_name
-                            # Store safe part of versioned keys.
-                            if key[0]:
-                                self.similar_keys.setdefault(
-                                    get_safe_part(key),
-                                    []).append(key)
-                        else:
-                            dir1 = os.path.dirname(self.entry_from_key[key])
-                            dir2 = os.path.dirname(entry)
-                            _logger.warning(
-                                "The same cache key is associated to "
-                                "different modules (%s and %s). This "
-                                "is not supposed to happen! You may "
-                                "need to manually delete your cache "
-                                "directory to fix this.",
-                                dir1, dir2)
-                    # Clean up the name space to prevent bug.
-                    if key_data.keys:
-                        del key
-                    self.loaded_key_pkl.add(key_pkl)
+                    self._register_key_data(key_data, key_pkl)
                 else:
                     too_old_to_use.append(entry)
 
@@ -988,14 +1230,135 @@ class ModuleCache(object):
                     _rmtree(*a, **kw)
                 for a, kw in to_delete_empty:
                     files = os.listdir(a[0])
+                    if (compilelock.use_module_locks() and
+                            time.time() - os.stat(a[0]).st_mtime <
+                            config.compile.timeout):
+                        # Holding the global lock does not prevent other
+                        # processes from compiling, so this may be a
+                        # directory that was just created to compile into.
+                        continue
                     if not files:
                         _rmtree(*a, **kw)
 
+        if cleanup and self.index is not None:
+            # Only the full refresh rewrites the index: the refreshes done
+            # on a cache miss leave it append-only.
+            self._rewrite_index()
+        self.full_refresh_done = True
+
         _logger.debug('Time needed to refresh cache: %s',
                       (time.time() - start_time))
 
         return too_old_to_use
 
+    def _register_key_data(self, key_data, key_pkl):
+        """
+        Add the keys of a KeyData loaded from disk to the cache mappings.
+
+        """
+        entry = key_data.get_entry()
+        # Remember the map from a module's hash to the KeyData
+        # object associated with it.
+        self.module_hash_to_key_data[key_data.module_hash] = key_data
+
+        for key in key_data.keys:
+            if key not in self.entry_from_key:
+                self.entry_from_key[key] = entry
+                # Assert that we have not already got this
+                # entry somehow.
+                assert entry not in self.module_from_name
+                # Store safe part of versioned keys.
+                if key[0]:
+                    self.similar_keys.setdefault(
+                        get_safe_part(key),
+                        []).append(key)
+            else:
+                dir1 = os.path.dirname(self.entry_from_key[key])
+                dir2 = os.path.dirname(entry)
+                _logger.warning(
+                    "The same cache key is associated to "
+                    "different modules (%s and %s). This "
+                    "is not supposed to happen! You may "
+                    "need to manually delete your cache "
+                    "directory to fix this.",
+                    dir1, dir2)
+        self.loaded_key_pkl.add(key_pkl)
+
+    def _rewrite_index(self):
+        """
+        Rewrite the module index from the modules known to this process.
+
+        Modules that are in the index but could not be loaded here (e.g.
+        because they use Ops that are not imported) are kept as long as
+        their directory is still there.
+
+        """
+        def keep(indexed):
+            dirs = {}
+            for module_hash, subdir in iteritems(indexed):
+                if os.path.exists(os.path.join(self.dirname, subdir,
+                                               'key.pkl')):
+                    dirs[module_hash] = subdir
+            for module_hash, key_data in iteritems(
+                    self.module_hash_to_key_data):
+                if os.path.exists(key_data.key_pkl):
+                    dirs[module_hash] = os.path.basename(
+                        os.path.dirname(key_data.key_pkl))
+            return dirs
+
+        try:
+            self.index.rewrite(keep)
+        except (IOError, OSError) as e:
+            _logger.warning('Could not write the module index %s: %s',
+                            self.index.filename, e)
+
+    def _refresh_from_index(self, module_hashes):
+        """
+        Load from disk the modules in `module_hashes` that the index knows.
+
+        This is a cheap alternative to `refresh` to find the modules compiled
+        by other processes. Entries that look broken are ignored here and
+        left to be cleaned up by `refresh`.
+
+        Returns
+        -------
+        bool
+            False if the index cannot be used, in which case `refresh` must
+            be called instead.
+
+        """
+        if self.index is None or not self.index.update():
+            return False
+        for module_hash in module_hashes:
+            if (module_hash in self.module_hash_to_key_data or
+                    module_hash not in self.index.dirs):
+                continue
+            root = os.path.join(self.dirname, self.index.dirs[module_hash])
+            key_pkl = os.path.join(root, 'key.pkl')
+            if (key_pkl in self.loaded_key_pkl or
+                    os.path.exists(os.path.join(root, 'delete.me'))):
+                continue
+            try:
+                entry = module_name_from_dir(root)
+                with open(key_pkl, 'rb') as f:
+                    key_data = pickle.load(f)
+            except Exception as e:
+                _logger.debug('Could not load indexed module %s: %s',
+                              root, e)
+                continue
+            if (not isinstance(key_data, KeyData) or
+                    key_data.module_hash != module_hash or
+                    not is_same_entry(entry, key_data.get_entry()) or
+                    not all(key[0] for key in key_data.keys) or
+                    time.time() - last_access_time(entry) >=
+                    self.age_thresh_use):
+                continue
+            _logger.debug('refresh from index adding %s', key_pkl)
+            key_data.entry = entry
+            key_data.key_pkl = key_pkl
+            self._register_key_data(key_data, key_pkl)
+        return True
+
     def _get_from_key(self, key, key_data=None):
         """
         Returns a module if the passed-in key is found in the cache
@@ -1025,7 +1388,8 @@ class ModuleCache(object):
         if module_hash in self.module_hash_to_key_data:
             key_data = self.module_hash_to_key_data[module_hash]
             module = self._get_from_key(None, key_data)
-            with compilelock.lock_ctx(keep_lock=keep_lock):
+            with compilelock.module_lock_ctx(module_hash,
+                                             keep_lock=keep_lock):
                 try:
                     key_data.add_key(key, save_pkl=bool(key[0]))
                     key_broken = False
@@ -1091,6 +1455,8 @@ class ModuleCache(object):
             if not key_broken and self.check_for_broken_eq:
                 self.check_key(key, key_pkl)
             self.loaded_key_pkl.add(key_pkl)
+            if self.index is not None:
+                self.index.add(module_hash, os.path.basename(location))
         elif config.cmodule.warn_no_version:
             key_flat = flatten(key)
             ops = [k for k in key_flat if isinstance(k, theano.Op)]
@@ -1101,6 +1467,7 @@ class ModuleCache(object):
         self._update_mappings(key, key_data, module.__file__, not key_broken)
         return key_data
 
+    @compiletime.timed('cache_lookup')
     def module_from_key(self, key, lnk=None, keep_lock=False):
         """
         Return a module from the cache, compiling it if necessary.
@@ -1131,7 +1498,17 @@ class ModuleCache(object):
         if module is not None:
             return module
 
-        with compilelock.lock_ctx(keep_lock=keep_lock):
+        # Modules compiled by other processes are found through the index
+        # without taking the lock, which is only needed to compile.
+        if self._refresh_from_index([module_hash]):
+            module = self._get_from_key(key)
+            if module is None:
+                module = self._get_from_hash(module_hash, key,
+                                             keep_lock=keep_lock)
+            if module is not None:
+                return module
+
+        with compilelock.module_lock_ctx(module_hash, keep_lock=keep_lock):
             # 1) Maybe somebody else compiled it for us while we
             #    where waiting for the lock. Try to load it again.
             # 2) If other repo that import Theano have Theano ops defined,
@@ -1146,7 +1523,9 @@ class ModuleCache(object):
             #    compilation to skip them, but not for future
             #    compilations. So reloading the cache here
             #    compilation fixes this problem. (we could do that only once)
-            self.refresh(cleanup=False)
+            #    The module index, when used, tells us where to look.
+            if not self._refresh_from_index([module_hash]):
+                self.refresh(cleanup=False)
 
             module = self._get_from_key(key)
             if module is not None:
@@ -1189,6 +1568,204 @@ class ModuleCache(object):
         self.stats[2] += 1
         return module
 
+    @compiletime.timed('cache_lookup')
+    def compile_many(self, key_lnk_pairs, n_jobs, batch_size=1):
+        """
+        Compile in parallel the modules that are missing from the cache.
+
+        Each module is compiled by a separate compiler process, at most
+        `n_jobs` of them running at the same time. The compiled modules are
+        then loaded and registered in the cache, so that subsequent calls to
+        `module_from_key` with the same keys are cache hits.
+
+        If `batch_size` is above 1, modules with the same compilation
+        arguments are compiled together, up to `batch_size` of them, into
+        one shared library (see `batch_src_code`). The library is hard
+        linked in the directory of each of these modules, so the cache
+        still has one directory per module, but the compiler runs once and
+        the dynamic loader maps the library once.
+
+        Parameters
+        ----------
+        key_lnk_pairs
+            List of (key, lnk) pairs, where `lnk` is a CLinker and `key` is
+            the value of its `cmodule_key()`.
+        n_jobs : int
+            Maximum number of compilations that run at the same time.
+        batch_size : int
+            Maximum number of modules compiled into the same library.
+
+        Returns
+        -------
+        int
+            The number of modules that were compiled.
+
+        """
+        def missing(pairs):
+            todo = []
+            seen_hash = set()
+            for key, lnk, module_hash in pairs:
+                if (self._get_from_key(key) is not None or
+                        module_hash in seen_hash or
+                        self._get_from_hash(module_hash, key) is not None):
+                    # Keys sharing the hash of a module compiled here will be
+                    # found by `module_from_key` through that hash.
+                    continue
+                seen_hash.add(module_hash)
+                todo.append((key, lnk, module_hash))
+            return todo
+
+        todo = missing([(key, lnk, get_module_hash(lnk.get_src_code(), key))
+                        for key, lnk in key_lnk_pairs
+                        if key is not None])
+        # Look for the modules compiled by other processes without the lock
+        # (see `module_from_key`).
+        if todo and self._refresh_from_index([job[2] for job in todo]):
+            todo = missing(todo)
+        if not todo:
+            return 0
+
+        with compilelock.module_lock_ctx([job[2] for job in todo]):
+            # Somebody else may have compiled some of them while we were
+            # waiting for the lock (see `module_from_key`).
+            if not self._refresh_from_index([job[2] for job in todo]):
+                self.refresh(cleanup=False)
+            todo = missing(todo)
+            if not todo:
+                return 0
+
+            jobs = []
+            for key, lnk, module_hash in todo:
+                location = dlimport_workdir(self.dirname)
+                try:
+                    c_compiler, kwargs = lnk.compile_cmodule_args(location)
+                except Exception:
+                    _rmtree(location, ignore_if_missing=True,
+                            msg='exception during compilation')
+                    raise
+                jobs.append((key, lnk, module_hash, location, c_compiler,
+                             kwargs))
+
+            @compiletime.timed('compiler')
+            def compile_job(group):
+                if len(group) > 1:
+                    try:
+                        self._compile_batch(group)
+                        return [None] * len(group)
+                    except Exception as e:
+                        # Compile them one by one to find which module
+                        # has a problem.
+                        _logger.debug('Batch compilation failed: %s', e)
+                errors = []
+                for job in group:
+                    c_compiler, kwargs = job[4:]
+                    try:
+                        c_compiler.compile_str(py_module=False, **kwargs)
+                    except Exception as e:
+                        errors.append(e)
+                    else:
+                        errors.append(None)
+                return errors
+
+            groups = self._batch_groups(jobs, n_jobs, batch_size)
+            _logger.debug('Compiling %i modules in %i libraries with %i '
+                          'jobs', len(jobs), len(groups), n_jobs)
+            # The work is done by the compiler processes, so threads are
+            # enough to keep up to `n_jobs` of them busy.
+            pool = ThreadPool(max(1, min(n_jobs, len(groups))))
+            try:
+                group_errors = pool.map(compile_job, groups)
+            finally:
+                pool.close()
+                pool.join()
+            jobs = [job for group in groups for job in group]
+            errors = [error for group_error in group_errors
+                      for error in group_error]
+
+            first_error = None
+            for job, error in zip(jobs, errors):
+                key, lnk, module_hash, location, c_compiler, kwargs = job
+                if error is None:
+                    try:
+                        open(os.path.join(location, "__init__.py"),
+                             'w').close()
+                        module = dlimport(os.path.join(
+                            location, '%s.%s' % (kwargs['module_name'],
+                                                 get_lib_extension())))
+                    except Exception as e:
+                        error = e
+                if error is not None:
+                    _rmtree(location, ignore_if_missing=True,
+                            msg='exception during compilation')
+                    if first_error is None:
+                        error.args += (str(lnk.fgraph),)
+                        first_error = error
+                    continue
+                self.module_from_name[module.__file__] = module
+                key_data = self._add_to_cache(module, key, module_hash)
+                self.module_hash_to_key_data[module_hash] = key_data
+                self.stats[2] += 1
+
+        if first_error is not None:
+            raise first_error
+        return len(jobs)
+
+    @staticmethod
+    def _batch_groups(jobs, n_jobs, batch_size):
+        """
+        Split the compilation jobs of `compile_many` into groups compiled
+        into the same library.
+
+        Only modules sharing the same compiler and arguments are grouped.
+        Groups are kept small enough to keep `n_jobs` compilers busy.
+
+        """
+        if batch_size <= 1:
+            return [[job] for job in jobs]
+        groups = []
+        same_args = OrderedDict()
+        for job in jobs:
+            c_compiler, kwargs = job[4:]
+            if not batchable(kwargs['src_code']):
+                groups.append([job])
+                continue
+            args = (c_compiler,) + tuple(
+                tuple(kwargs[name] or ()) for name in
+                ('include_dirs', 'lib_dirs', 'libs', 'preargs'))
+            same_args.setdefault(args, []).append(job)
+        for args_jobs in same_args.values():
+            n_groups = -(-len(args_jobs) // batch_size)
+            n_groups = min(len(args_jobs), max(n_groups, n_jobs))
+            groups.extend(args_jobs[i::n_groups] for i in range(n_groups))
+        return groups
+
+    def _compile_batch(self, group):
+        """
+        Compile the modules of the `compile_many` jobs in `group` into one
+        library, and link it in the location of each module.
+
+        """
+        c_compiler, kwargs = group[0][4:]
+        src_code = batch_src_code([job[5]['src_code'] for job in group])
+        location = dlimport_workdir(self.dirname)
+        try:
+            batch_kwargs = dict(kwargs, module_name=hash_from_code(src_code),
+                                src_code=src_code, location=location)
+            c_compiler.compile_str(py_module=False, **batch_kwargs)
+            lib_filename = os.path.join(location, '%s.%s' % (
+                batch_kwargs['module_name'], get_lib_extension()))
+            for job in group:
+                module_kwargs = job[5]
+                with open(os.path.join(module_kwargs['location'], 'mod.cpp'),
+                          'w') as f:
+                    f.write(module_kwargs['src_code'])
+                _link_or_copy(lib_filename, os.path.join(
+                    module_kwargs['location'], '%s.%s' % (
+                        module_kwargs['module_name'], get_lib_extension())))
+        finally:
+            _rmtree(location, ignore_if_missing=True,
+                    msg='batch library linked in its modules')
+
     def check_key(self, key, key_pkl):
         """
         Perform checks to detect broken __eq__ / __hash__ implementations.
@@ -1316,6 +1893,126 @@ class ModuleCache(object):
                 _rmtree(parent, msg='old cache directory', level=logging.INFO,
                         ignore_nocleanup=True)
 
+    def module_dirs_usage(self):
+        """
+        Return the size and last access time of each module directory.
+
+        The directory is walked without the lock. Files shared between
+        modules through hard links (see `compile_many`) are split evenly
+        between them.
+
+        Returns
+        -------
+        list
+            List of (last access time, size in bytes, directory) tuples.
+
+        """
+        usage = []
+        for subdir in os.listdir(self.dirname):
+            if not subdir.startswith('tmp'):
+                continue
+            root = os.path.join(self.dirname, subdir)
+            try:
+                files = os.listdir(root)
+                if 'key.pkl' not in files or 'delete.me' in files:
+                    continue
+                entry = module_name_from_dir(root, err=False, files=files)
+                if entry is None:
+                    continue
+                size = 0
+                for name in files:
+                    st = os.lstat(os.path.join(root, name))
+                    size += st.st_size // max(st.st_nlink, 1)
+                usage.append((last_access_time(entry), size, root))
+            except (OSError, ValueError):
+                # Deleted or changed by another process while we looked.
+                continue
+        return usage
+
+    def evict(self, max_size=None, max_entries=None, min_age=60 * 60):
+        """
+        Delete the least recently used modules until the cache fits in
+        `max_size` and `max_entries`.
+
+        The cache directory is walked without the lock, and the lock is
+        only held while deleting a few directories at a time, so that
+        compilations in other processes are not blocked for long.
+
+        Parameters
+        ----------
+        max_size : float
+            Maximum total size of the modules, in megabytes. Defaults to
+            config.cmodule.max_cache_size. 0 means no limit.
+        max_entries : int
+            Maximum number of modules. Defaults to
+            config.cmodule.max_cache_entries. 0 means no limit.
+        min_age : float
+            Modules used less than `min_age` seconds ago are never deleted,
+            since other processes may be about to load them.
+
+        Returns
+        -------
+        int
+            The number of modules deleted.
+
+        """
+        if max_size is None:
+            max_size = config.cmodule.max_cache_size
+        if max_entries is None:
+            max_entries = config.cmodule.max_cache_entries
+        if not max_size and not max_entries:
+            return 0
+        max_bytes = max_size * 2 ** 20
+        usage = sorted(self.module_dirs_usage())
+        total_size = sum(size for _, size, _ in usage)
+        n_entries = len(usage)
+        loaded = set(os.path.dirname(entry) for entry in self.module_from_name)
+        time_limit = time.time() - min_age
+        victims = []
+        for atime, size, root in usage:
+            if not ((max_bytes and total_size > max_bytes) or
+                    (max_entries and n_entries > max_entries)):
+                break
+            if root in loaded or atime > time_limit:
+                continue
+            victims.append(root)
+            total_size -= size
+            n_entries -= 1
+        if ((max_bytes and total_size > max_bytes) or
+                (max_entries and n_entries > max_entries)):
+            _logger.info('The cache %s stays over budget: modules used in '
+                         'the last %s seconds are not deleted.',
+                         self.dirname, min_age)
+
+        key_pkl_to_hash = dict((key_data.key_pkl, module_hash)
+                               for module_hash, key_data in
+                               iteritems(self.module_hash_to_key_data))
+        n_deleted = 0
+        chunk_size = 100
+        for i in xrange(0, len(victims), chunk_size):
+            with compilelock.lock_ctx():
+                for root in victims[i:i + chunk_size]:
+                    try:
+                        entry = module_name_from_dir(root)
+                        if last_access_time(entry) > time_limit:
+                            # Used since we looked at it.
+                            continue
+                    except (OSError, ValueError):
+                        continue
+                    key_pkl = os.path.join(root, 'key.pkl')
+                    module_hash = key_pkl_to_hash.get(key_pkl)
+                    if module_hash is not None:
+                        key_data = self.module_hash_to_key_data.pop(
+                            module_hash)
+                        key_data.delete_keys_from(self.entry_from_key)
+                        self.loaded_key_pkl.discard(key_pkl)
+                    _rmtree(root, msg='evicted from cache', level=logging.INFO,
+                            ignore_nocleanup=True)
+                    n_deleted += 1
+        if n_deleted and self.index is not None:
+            self._rewrite_index()
+        return n_deleted
+
     def clear(self, unversioned_min_age=None, clear_base_files=False,
               delete_if_problem=False):
         """
@@ -1353,6 +2050,10 @@ class ModuleCache(object):
         rename them with the '.delete.me' extension, to mark them to be deleted
         next time we clear the cache.
 
+        The 'precompiled_headers' directory is left in place, as other
+        processes may be compiling with headers in it. Each header there is
+        specific to a compiler and its flags, so a stale one is never used.
+
         """
         with compilelock.lock_ctx():
             for base_dir in ('cutils_ext', 'lazylinker_ext', 'scan_perform'):
@@ -1493,7 +2194,13 @@ class ModuleCache(object):
 
         # Note: for clear_old(), as this happen unfrequently, we only
         # take the lock when it happen.
-        self.clear_old()
+        # Note: when the module index is used, walking the cache directory
+        # is left to the processes that refresh the index at startup.
+        if self.index is None or self.full_refresh_done:
+            self.clear_old()
+        if self.stats[2]:
+            # Only compilations make the cache grow.
+            self.evict()
         self.clear_unversioned()
         _logger.debug('Time spent checking keys: %s',
                       self.time_spent_in_check_key)
@@ -1874,6 +2581,107 @@ def try_march_flag(flags):
     return compilation_result, execution_result
 
 
+precompiled_header_includes = ['<Python.h>', '<iostream>',
+                               '"theano_mod_helper.h"', '<math.h>',
+                               '<numpy/arrayobject.h>',
+                               '<numpy/arrayscalars.h>']
+"""
+Headers put in the precompiled header used by `GCC_compiler.compile_str`.
+
+They are the first ones included by almost all the modules generated by
+CLinker.
+
+"""
+
+_precompiled_header_lock = threading.Lock()
+_precompiled_header_failed = set()
+
+
+def precompiled_header_args(src_code, args):
+    """
+    Return the arguments that make g++ use a precompiled header to compile
+    `src_code`, building the header if needed.
+
+    The precompiled header contains `precompiled_header_includes`. It is
+    only used for code starting by these includes, in the same order, so
+    that including it first does not change the code. As g++ can only use a
+    precompiled header built with the same options, one is built in
+    `config.compiledir` for each set of arguments.
+
+    Parameters
+    ----------
+    src_code : str
+        The code to compile.
+    args : list of str
+        The arguments of the compiler, except the input, output and
+        libraries.
+
+    Returns
+    -------
+    list of str
+        The arguments to add, or an empty list if the precompiled header
+        cannot be used.
+
+    """
+    code = ''.join('#include %s\n' % include
+                   for include in precompiled_header_includes)
+    if not src_code.startswith(code):
+        return []
+    # Warnings do not change the precompiled header.
+    args = [arg for arg in args if not arg.startswith('-W')]
+    fingerprint = hash_from_code('\n'.join(
+        [theano.config.cxx, gcc_version_str, code] + args))
+    header = os.path.join(config.compiledir, 'precompiled_headers',
+                          fingerprint, 'theano_pch.h')
+    if not os.path.exists(header + '.gch'):
+        with _precompiled_header_lock:
+            if fingerprint in _precompiled_header_failed:
+                return []
+            if not os.path.exists(header + '.gch'):
+                try:
+                    _build_precompiled_header(code, header, args)
+                except Exception as e:
+                    _logger.info('Cannot build precompiled header: %s', e)
+                    _precompiled_header_failed.add(fingerprint)
+                    return []
+    # g++ uses `header`.gch if it is valid, and `header` otherwise.
+    return ['-include', header]
+
+
+def _build_precompiled_header(code, header, args):
+    dirname = os.path.dirname(header)
+    if not os.path.isdir(dirname):
+        try:
+            os.makedirs(dirname)
+        except OSError:
+            # Someone else probably created it at the same time.
+            assert os.path.isdir(dirname)
+    # Files are written under temporary names then renamed, as other
+    # processes may be using them.
+    for suffix in ('', '.gch'):
+        fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        os.close(fd)
+        try:
+            if suffix:
+                cmd = ([theano.config.cxx, '-x', 'c++-header'] + args +
+                       ['-o', tmp_path, header])
+                _logger.debug('Running cmd: %s', ' '.join(cmd))
+                with compiletime.phase('compiler', item='precompiled header'):
+                    p_out = output_subprocess_Popen(cmd)
+                if p_out[2]:
+                    raise Exception('Compilation failed (return status=%s): '
+                                    '%s' % (p_out[2], decode(p_out[1])))
+            elif os.path.exists(header):
+                continue
+            else:
+                with open(tmp_path, 'w') as f:
+                    f.write(code)
+            os.rename(tmp_path, header + suffix)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+
 class GCC_compiler(Compiler):
     # The equivalent flags of --march=native used by g++.
     march_flags = None
@@ -1884,8 +2692,22 @@ class GCC_compiler(Compiler):
     def version_str():
         return theano.config.cxx + " " + gcc_version_str
 
+    # Maps (march_flags, cxx, cxxflags) to the result of compile_args().
+    _compile_args_cache = {}
+
     @staticmethod
     def compile_args(march_flags=True):
+        # These are the only config options read by _compute_compile_args.
+        key = (march_flags, config.cxx, config.gcc.cxxflags)
+        if key not in GCC_compiler._compile_args_cache:
+            if len(GCC_compiler._compile_args_cache) > 100:
+                GCC_compiler._compile_args_cache.clear()
+            GCC_compiler._compile_args_cache[key] = (
+                GCC_compiler._compute_compile_args(march_flags))
+        return list(GCC_compiler._compile_args_cache[key])
+
+    @staticmethod
+    def _compute_compile_args(march_flags):
         cxxflags = [flag for flag in config.gcc.cxxflags.split(' ') if flag]
 
         # Add the equivalent of -march=native flag.  We can't use
@@ -2282,6 +3104,9 @@ class GCC_compiler(Compiler):
             # improved loading times on most platforms (win32 is
             # different, as usual).
             cmd.append('-fvisibility=hidden')
+        if config.cmodule.precompiled_headers:
+            cmd.extend(precompiled_header_args(
+                src_code, [arg for arg in cmd[2:] if not arg.startswith('-L')]))
         cmd.extend(['-o', '%s%s%s' % (path_wrapper, lib_filename, path_wrapper)])
         cmd.append('%s%s%s' % (path_wrapper, cppfilename, path_wrapper))
         cmd.extend(['-l%s' % l for l in libs])
@@ -2295,7 +3120,8 @@ class GCC_compiler(Compiler):
             print(' '.join(cmd), file=sys.stderr)
 
         try:
-            p_out = output_subprocess_Popen(cmd)
+            with compiletime.phase('compiler', item=module_name):
+                p_out = output_subprocess_Popen(cmd)
             compile_stderr = decode(p_out[1])
         except Exception:
             # An exception can occur e.g. if `g++` is not found.
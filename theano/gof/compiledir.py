@@ -1,14 +1,21 @@
 from __future__ import absolute_import, print_function, division
 import six.moves.cPickle as pickle
+import json
 import logging
 import os
 import shutil
+import tarfile
+import tempfile
 
 import numpy as np
 
 import theano
-from six import string_types, iteritems
+from six import BytesIO, string_types, iteritems
+from theano.configdefaults import compiledir_format_dict
 from theano.configparser import config
+from theano.gof import compilelock
+from theano.gof.cc import get_module_cache
+from theano.gof.cmodule import GCC_compiler, KeyData, module_name_from_dir
 from theano.gof.utils import flatten
 
 
@@ -245,3 +252,180 @@ def basecompiledir_ls():
 
 def basecompiledir_purge():
     shutil.rmtree(config.base_compiledir)
+
+
+def module_fingerprint():
+    """
+    Return a dict describing what compiled modules depend on.
+
+    Modules compiled by a process can only be reused by a process with the
+    same fingerprint.
+
+    """
+    fingerprint = dict(
+        (k, str(compiledir_format_dict[k]))
+        for k in ('short_platform', 'processor', 'python_version',
+                  'python_bitwidth', 'python_int_bitwidth', 'theano_version',
+                  'numpy_version', 'gxx_version'))
+    fingerprint['npy_abi_version'] = '0x%X' % (
+        np.core.multiarray._get_ndarray_c_version())
+    fingerprint['compile_args'] = ' '.join(GCC_compiler.compile_args())
+    fingerprint['config_md5'] = theano.configparser.get_config_md5()
+    return fingerprint
+
+
+def export_modules(module_files, path):
+    """
+    Write compiled modules and their keys to a tar archive.
+
+    Only modules with versioned keys are exported, as the others cannot be
+    reused by another process.
+
+    Parameters
+    ----------
+    module_files : list of str or None
+        Paths of the compiled modules (.so/.pyd files) in the compiledir.
+        If None, all the modules of the compiledir are exported.
+    path : str
+        Path of the archive to create. It is compressed with gzip.
+
+    Returns
+    -------
+    int
+        The number of modules exported.
+
+    """
+    compiledir = config.compiledir
+    if module_files is None:
+        module_files = []
+        for subdir in sorted(os.listdir(compiledir)):
+            root = os.path.join(compiledir, subdir)
+            if os.path.isfile(os.path.join(root, 'key.pkl')):
+                entry = module_name_from_dir(root, err=False)
+                if entry is not None:
+                    module_files.append(entry)
+
+    modules = []
+    with tarfile.open(path, 'w:gz') as archive:
+        for module_file in sorted(set(module_files)):
+            root = os.path.dirname(module_file)
+            subdir = os.path.basename(root)
+            key_pkl = os.path.join(root, 'key.pkl')
+            if (os.path.dirname(root) != compiledir or
+                    not os.path.isfile(key_pkl) or
+                    os.path.exists(os.path.join(root, 'delete.me'))):
+                _logger.debug('Not exporting %s', module_file)
+                continue
+            try:
+                with open(key_pkl, 'rb') as f:
+                    key_data = pickle.load(f)
+            except Exception as e:
+                _logger.warning('Not exporting %s: %s', module_file, e)
+                continue
+            if not isinstance(key_data, KeyData):
+                continue
+            for name in sorted(os.listdir(root)):
+                filename = os.path.join(root, name)
+                if os.path.isfile(filename):
+                    archive.add(filename, arcname=subdir + '/' + name)
+            modules.append({'hash': key_data.module_hash, 'dir': subdir})
+        manifest = json.dumps({'format': 1,
+                               'fingerprint': module_fingerprint(),
+                               'modules': modules},
+                              indent=1, sort_keys=True).encode('utf-8')
+        info = tarfile.TarInfo('manifest.json')
+        info.size = len(manifest)
+        archive.addfile(info, BytesIO(manifest))
+    return len(modules)
+
+
+def import_modules(path, force=False):
+    """
+    Install in the compiledir the modules of an archive made by
+    `export_modules`.
+
+    Modules that are already in the compiledir are not installed again.
+
+    Parameters
+    ----------
+    path : str
+        Path of the archive.
+    force : bool
+        If True, install the modules even if they were compiled with a
+        different fingerprint. They will most probably never be used.
+
+    Returns
+    -------
+    int
+        The number of modules installed.
+
+    Raises
+    ------
+    ValueError
+        If the archive was created with a different fingerprint (compiler,
+        flags, library versions...) than the current one.
+
+    """
+    compiledir = config.compiledir
+    cache = get_module_cache()
+    if cache.index is not None:
+        cache.index.update()
+    installed = 0
+    with tarfile.open(path, 'r:*') as archive:
+        manifest = json.loads(
+            archive.extractfile('manifest.json').read().decode('utf-8'))
+        if manifest.get('format') != 1:
+            raise ValueError('Unknown compiled modules archive format',
+                             path, manifest.get('format'))
+        fingerprint = module_fingerprint()
+        diff = sorted(k for k in set(fingerprint) | set(manifest['fingerprint'])
+                      if fingerprint.get(k) !=
+                      manifest['fingerprint'].get(k))
+        if diff and not force:
+            raise ValueError(
+                'The modules in %s were compiled in a different '
+                'environment. Differences: %s' % (path, ', '.join(
+                    '%s (%s != %s)' % (k, manifest['fingerprint'].get(k),
+                                       fingerprint.get(k))
+                    for k in diff)))
+
+        members = {}
+        for member in archive.getmembers():
+            parts = member.name.split('/')
+            if member.isfile() and len(parts) == 2:
+                members.setdefault(parts[0], []).append(member)
+
+        for module in manifest['modules']:
+            subdir = module['dir']
+            target = os.path.join(compiledir, subdir)
+            if (not subdir.startswith('tmp') or '/' in subdir or
+                    os.sep in subdir or subdir not in members):
+                _logger.warning('Invalid module entry in %s: %s',
+                                path, subdir)
+                continue
+            with compilelock.module_lock_ctx(module['hash']):
+                if (module['hash'] in cache.module_hash_to_key_data or
+                        os.path.exists(target)):
+                    continue
+                if (cache.index is not None and
+                        module['hash'] in cache.index.dirs and
+                        os.path.exists(os.path.join(
+                            compiledir, cache.index.dirs[module['hash']],
+                            'key.pkl'))):
+                    continue
+                # Extract in a temporary directory first, so that no other
+                # process sees a partial module.
+                tmp_dir = tempfile.mkdtemp(prefix='import_', dir=compiledir)
+                try:
+                    for member in members[subdir]:
+                        name = os.path.basename(member.name)
+                        with open(os.path.join(tmp_dir, name), 'wb') as f:
+                            shutil.copyfileobj(archive.extractfile(member), f)
+                    os.rename(tmp_dir, target)
+                finally:
+                    if os.path.exists(tmp_dir):
+                        shutil.rmtree(tmp_dir)
+                if cache.index is not None:
+                    cache.index.add(module['hash'], subdir)
+                installed += 1
+    return installed
@@ -10,10 +10,18 @@ import logging
 
 from contextlib import contextmanager
 
+from six import string_types
+
 import numpy as np
 
 from theano import config
 
+try:
+    import fcntl
+except ImportError:
+    # Windows.
+    fcntl = None
+
 random = np.random.RandomState([2015, 8, 2])
 
 _logger = logging.getLogger("theano.gof.compilelock")
@@ -42,6 +50,108 @@ def lock_ctx(lock_dir=None, keep_lock=False, **kw):
         release_lock()
 
 
+def use_module_locks():
+    """
+    Return True if compilations should lock only the module they build (see
+    `module_lock_ctx`) instead of the whole compilation directory.
+
+    """
+    return (config.compile.lock_mode == 'per_module' and
+            fcntl is not None and
+            getattr(get_lock, 'lock_is_enabled', True))
+
+
+@contextmanager
+def module_lock_ctx(module_hashes, lock_dir=None, keep_lock=False):
+    """
+    Obtain a lock on the modules identified by `module_hashes`.
+
+    When `use_module_locks()` is True, each module hash has its own lock file
+    in `lock_dir`, locked with an fcntl advisory lock. Processes compiling
+    different modules thus do not wait for each other, and a waiting process
+    is woken up as soon as the lock is released, instead of polling. The OS
+    releases the lock if its owner dies, so no timeout is needed.
+
+    Otherwise, this is the same as `lock_ctx` (and `keep_lock` is forwarded
+    to it).
+
+    Parameters
+    ----------
+    module_hashes : str or list of str
+        Hash(es) of the module(s) to lock, as returned by
+        `cmodule.get_module_hash`.
+    lock_dir : str
+        Directory of the per-module lock files (default
+        `config.compiledir`/module_locks).
+
+    """
+    if not use_module_locks():
+        with lock_ctx(keep_lock=keep_lock):
+            yield
+        return
+    if isinstance(module_hashes, string_types):
+        module_hashes = [module_hashes]
+    if lock_dir is None:
+        lock_dir = os.path.join(config.compiledir, 'module_locks')
+    if not os.path.isdir(lock_dir):
+        try:
+            os.makedirs(lock_dir)
+        except OSError:
+            # Someone else was probably trying to create it at the same time.
+            assert os.path.isdir(lock_dir)
+    # Always lock in the same order to avoid dead locks.
+    lock_files = [os.path.join(lock_dir, module_hash + '.lock')
+                  for module_hash in sorted(set(module_hashes))]
+    acquired = []
+    try:
+        for lock_file in lock_files:
+            _acquire_module_lock(lock_file)
+            acquired.append(lock_file)
+        yield
+    finally:
+        for lock_file in reversed(acquired):
+            _release_module_lock(lock_file)
+
+
+# Map a lock file to [file descriptor, number of times we locked it], so that
+# module locks are reentrant within one process. fcntl locks are not
+# inherited by child processes, so neither is this dict.
+_module_locks = {}
+_module_locks_pid = os.getpid()
+
+
+def _acquire_module_lock(lock_file):
+    global _module_locks, _module_locks_pid
+    if _module_locks_pid != os.getpid():
+        _module_locks = {}
+        _module_locks_pid = os.getpid()
+    if lock_file not in _module_locks:
+        fd = os.open(lock_file, os.O_RDWR | os.O_CREAT, 0o666)
+        try:
+            try:
+                fcntl.lockf(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                _logger.info("Waiting for existing lock %s (I am process "
+                             "'%s')", lock_file, os.getpid())
+                fcntl.lockf(fd, fcntl.LOCK_EX)
+        except Exception:
+            os.close(fd)
+            raise
+        _module_locks[lock_file] = [fd, 0]
+    _module_locks[lock_file][1] += 1
+
+
+def _release_module_lock(lock_file):
+    entry = _module_locks[lock_file]
+    entry[1] -= 1
+    if entry[1] == 0:
+        del _module_locks[lock_file]
+        try:
+            fcntl.lockf(entry[0], fcntl.LOCK_UN)
+        finally:
+            os.close(entry[0])
+
+
 # We define this name with an underscore so that python shutdown
 # deletes this before non-underscore names (like os).  We need to do
 # it this way to avoid errors on shutdown.
@@ -0,0 +1,258 @@
+"""
+Measure the time spent in each phase of the compilation of Theano functions.
+
+The code implementing a compilation phase is wrapped with `phase`, which does
+nothing unless a `CompilePhaseStats` object is collecting timings (see
+`collect`). Phases can be nested: the time of a phase does not include the
+time of the phases nested inside it, so that the times of all phases add up
+to the total compilation time. A phase nested in a phase of the same name
+(e.g. a compiler call inside a batch of compiler calls) is not counted
+again.
+
+The collectors are process-wide: while one is active, it also records the
+phases run by the other threads, including the compilations they start
+themselves. This lets it include the threads that compile modules in
+parallel for the function being timed.
+
+>>> with collect(CompilePhaseStats()) as stats:  # doctest: +SKIP
+...     f = theano.function([x], y)
+>>> stats.summary()  # doctest: +SKIP
+>>> stats.to_json('compile_phases.json')  # doctest: +SKIP
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import json
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from six import iteritems, string_types
+
+phase_descriptions = [
+    ('fgraph', 'graph cloning and features setup (std_fgraph)'),
+    ('optimizer', 'graph optimization'),
+    ('cmodule_key', 'computation of the C module keys (CLinker.cmodule_key)'),
+    ('code_gen', 'C code generation (CLinker.get_src_code)'),
+    ('cache_lookup', 'lookups and locks in the compiled module cache'),
+    ('cache_refresh', 'walks of the compiledir (ModuleCache.refresh)'),
+    ('compiler', 'C compiler processes, one item per module'),
+    ('dlimport', 'import of the compiled modules'),
+    ('linker', 'other linker work (thunks and storage creation)'),
+]
+"""
+The phases, in the order they are printed.
+
+"""
+
+_collectors = []
+_collectors_lock = threading.Lock()
+_local = threading.local()
+
+
+class CompilePhaseStats(object):
+    """
+    Time spent in each compilation phase.
+
+    Attributes
+    ----------
+    phase_time : dict
+        Maps each phase to the time spent in it, excluding nested phases.
+    phase_count : dict
+        Maps each phase to the number of times it was entered, not
+        counting the phases nested in a phase of the same name.
+    item_time : dict
+        Maps (phase, item) pairs to the time spent in the phase for that item
+        (e.g. an optimizer or a module name).
+    total_time : float
+        Total time during which timings were collected.
+
+    """
+
+    def __init__(self):
+        self.phase_time = defaultdict(float)
+        self.phase_count = defaultdict(int)
+        self.item_time = defaultdict(float)
+        self.total_time = 0.
+
+    def add(self, name, elapsed, item=None, count=True):
+        self.phase_time[name] += elapsed
+        if count:
+            self.phase_count[name] += 1
+        if item is not None:
+            self.item_time[(name, item)] += elapsed
+
+    def merge(self, other):
+        """
+        Return a new CompilePhaseStats with the timings of self and `other`.
+
+        """
+        rval = CompilePhaseStats()
+        for stats in (self, other):
+            for name, t in iteritems(stats.phase_time):
+                rval.phase_time[name] += t
+            for name, n in iteritems(stats.phase_count):
+                rval.phase_count[name] += n
+            for key, t in iteritems(stats.item_time):
+                rval.item_time[key] += t
+            rval.total_time += stats.total_time
+        return rval
+
+    def _phases(self):
+        known = [name for name, _ in phase_descriptions]
+        return known + sorted(name for name in self.phase_time
+                              if name not in known)
+
+    def summary(self, file=sys.stderr, n_items=5):
+        """
+        Print a table of the time spent in each phase.
+
+        Parameters
+        ----------
+        file
+            Where to print the table.
+        n_items : int
+            For each phase, print the `n_items` items it spent the most time
+            on.
+
+        """
+        descriptions = dict(phase_descriptions)
+        print('Compile phases', file=file)
+        print('---', file=file)
+        print('  Time spent collecting: %.3fs' % self.total_time, file=file)
+        print('  <% time> <sum %> <time> <count> <phase>', file=file)
+        cumulated = 0.
+        for name in self._phases():
+            t = self.phase_time.get(name, 0.)
+            if not self.phase_count.get(name):
+                continue
+            cumulated += t
+            print('  %6.1f%%  %6.1f%%  %7.3fs  %6d  %s: %s' % (
+                _percent(t, self.total_time),
+                _percent(cumulated, self.total_time),
+                t, self.phase_count[name], name,
+                descriptions.get(name, '')), file=file)
+            items = sorted(((t, item) for (phase, item), t in
+                            iteritems(self.item_time) if phase == name),
+                           reverse=True)
+            for item_t, item in items[:n_items]:
+                print('                     %7.3fs          %s' % (
+                    item_t, item), file=file)
+        other = self.total_time - cumulated
+        print('  %6.1f%%  %6s   %7.3fs          other' % (
+            _percent(other, self.total_time), '', other), file=file)
+        print('  Phases run in parallel threads (e.g. the C compiler with '
+              'cmodule.parallel_compile > 1) can add up to more than 100%.',
+              file=file)
+        print('', file=file)
+
+    def as_dict(self):
+        """
+        Return the timings as a dict that can be serialized to JSON.
+
+        """
+        phases = []
+        for name in self._phases():
+            if not self.phase_count.get(name):
+                continue
+            items = sorted(((t, str(item)) for (phase, item), t in
+                            iteritems(self.item_time) if phase == name),
+                           reverse=True)
+            phases.append({'phase': name,
+                           'time': self.phase_time[name],
+                           'count': self.phase_count[name],
+                           'items': [{'name': item, 'time': t}
+                                     for t, item in items]})
+        return {'total_time': self.total_time, 'phases': phases}
+
+    def to_json(self, file):
+        """
+        Write the timings to `file` (a path or a file object) as JSON.
+
+        """
+        if isinstance(file, string_types):
+            with open(file, 'w') as f:
+                json.dump(self.as_dict(), f, indent=1)
+        else:
+            json.dump(self.as_dict(), file, indent=1)
+
+
+def _percent(t, total):
+    if total <= 0:
+        return 0.
+    return 100. * t / total
+
+
+@contextmanager
+def collect(stats):
+    """
+    Collect the timings of the compilation phases run inside this context,
+    by any thread.
+
+    Parameters
+    ----------
+    stats : CompilePhaseStats or None
+        The object accumulating the timings. If None, nothing is collected.
+
+    """
+    if stats is None:
+        yield stats
+        return
+    with _collectors_lock:
+        _collectors.append(stats)
+    t0 = time.time()
+    try:
+        yield stats
+    finally:
+        stats.total_time += time.time() - t0
+        with _collectors_lock:
+            _collectors.remove(stats)
+
+
+@contextmanager
+def phase(name, item=None):
+    """
+    Record the time spent in the code run inside this context as phase
+    `name`, optionally for `item`.
+
+    """
+    if not _collectors:
+        yield
+        return
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    # Each frame is [name, start time, time spent in nested phases].
+    frame = [name, time.time(), 0.]
+    stack.append(frame)
+    try:
+        yield
+    finally:
+        stack.pop()
+        elapsed = time.time() - frame[1]
+        if stack:
+            stack[-1][2] += elapsed
+        count = all(outer[0] != name for outer in stack)
+        with _collectors_lock:
+            for stats in _collectors:
+                stats.add(name, elapsed - frame[2], item, count=count)
+
+
+def timed(name):
+    """
+    Decorator recording the time spent in the decorated function as
+    phase `name`.
+
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not _collectors:
+                return f(*args, **kwargs)
+            with phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -7,7 +7,7 @@ from __future__ import absolute_import, print_function, division
 
 from collections import deque, OrderedDict
 
-from six import iteritems
+from six import iteritems, string_types
 import itertools
 
 import theano
@@ -182,6 +182,174 @@ def _contains_cycle(fgraph, orderings):
     return visited != len(parent_counts)
 
 
+def _topological_labels(fgraph, orderings):
+    """
+    Return a dict mapping each Apply of `fgraph` to its position in a
+    topological order of the graph respecting `orderings` (see
+    `_contains_cycle`), or None if there is a cycle.
+
+    """
+    parent_counts = {}
+    node_to_children = {}
+    visitable = deque()
+    for a_n in fgraph.apply_nodes:
+        parents = set(r.owner for r in a_n.inputs if r.owner is not None)
+        parents.update(orderings.get(a_n, ()))
+        for parent in parents:
+            node_to_children.setdefault(parent, []).append(a_n)
+        parent_counts[a_n] = len(parents)
+        if not parents:
+            visitable.append(a_n)
+
+    labels = {}
+    while visitable:
+        a_n = visitable.popleft()
+        labels[a_n] = len(labels)
+        for client in node_to_children.get(a_n, ()):
+            parent_counts[client] -= 1
+            if not parent_counts[client]:
+                visitable.append(client)
+    if len(labels) != len(parent_counts):
+        return None
+    return labels
+
+
+class _TopologicalOrder(object):
+    """
+    Topological order of the Apply nodes of a FunctionGraph, maintained
+    as edges are added to detect the cycles incrementally.
+
+    The edges go from a node to the clients of its outputs, and from the
+    nodes in `orderings[app]` to `app`. A new edge from `a` to `b` can only
+    create a cycle if `a` comes after `b` in the order. In that case, the
+    nodes between `b` and `a` that depend on `b` or that `a` depends on
+    are searched (a cycle is found if `a` depends on `b`) and reordered, as
+    in the algorithm of Pearce and Kelly. Nodes are imported at the end of
+    the order.
+
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.labels = None
+        self.next_label = 0
+        # Edges added by on_change_input since the last check.
+        self.new_edges = []
+        # The orderings at the last successful check.
+        self.orderings = {}
+
+    def on_import(self, app):
+        if self.labels is not None:
+            self.labels[app] = self.next_label
+            self.next_label += 1
+
+    def on_prune(self, app):
+        if self.labels is not None:
+            self.labels.pop(app, None)
+
+    def on_change_input(self, app, new_r):
+        if self.labels is not None and new_r.owner is not None:
+            self.new_edges.append((new_r.owner, app))
+
+    def contains_cycle(self, fgraph, orderings):
+        """
+        Return True if the graph with `orderings` contains a cycle.
+
+        `orderings` maps Apply instances to sets of Apply instances, like
+        `DestroyHandler.orderings(fgraph, ordered=False)`.
+
+        """
+        if self.labels is None:
+            labels = _topological_labels(fgraph, orderings)
+            if labels is None:
+                return True
+            self.labels = labels
+            self.next_label = len(labels)
+            self.new_edges = []
+            self.orderings = orderings
+            return False
+
+        edges = list(self.new_edges)
+        for app, prereqs in iteritems(orderings):
+            old_prereqs = self.orderings.get(app, ())
+            edges.extend((p, app) for p in prereqs if p not in old_prereqs)
+
+        labels = self.labels
+        successors = None
+        for a, b in edges:
+            if (a not in labels or b not in labels or
+                    labels[a] < labels[b]):
+                continue
+            if (a not in orderings.get(b, ()) and
+                    not any(r.owner is a for r in b.inputs)):
+                # The edge was removed since.
+                continue
+            if successors is None:
+                successors = {}
+                for app, prereqs in iteritems(orderings):
+                    for p in prereqs:
+                        successors.setdefault(p, []).append(app)
+            if not self._reorder(a, b, orderings, successors):
+                # Keep the new edges: if the graph is not reverted, it
+                # still contains the cycle. The order may not respect the
+                # orderings that were removed in the meantime, so they
+                # will all be checked again.
+                self.orderings = {}
+                return True
+        self.new_edges = []
+        self.orderings = orderings
+        return False
+
+    def _reorder(self, a, b, orderings, successors):
+        """
+        Update the order for the edge a -> b, where `a` comes after `b`.
+        Return False, without changing the order, if `b` is an ancestor of
+        `a`.
+
+        """
+        labels = self.labels
+        lower = labels[b]
+        upper = labels[a]
+
+        forward = set([b])
+        todo = [b]
+        while todo:
+            node = todo.pop()
+            clients = [c for r in node.outputs for c, _ in r.clients
+                       if not isinstance(c, string_types)]
+            clients.extend(successors.get(node, ()))
+            for c in clients:
+                if c is a:
+                    return False
+                label = labels.get(c)
+                if (label is not None and lower < label < upper and
+                        c not in forward):
+                    forward.add(c)
+                    todo.append(c)
+
+        backward = set([a])
+        todo = [a]
+        while todo:
+            node = todo.pop()
+            parents = [r.owner for r in node.inputs if r.owner is not None]
+            parents.extend(orderings.get(node, ()))
+            for p in parents:
+                label = labels.get(p)
+                if (label is not None and lower < label < upper and
+                        p not in backward):
+                    backward.add(p)
+                    todo.append(p)
+
+        affected = sorted(backward, key=labels.get)
+        affected.extend(sorted(forward, key=labels.get))
+        for node, label in zip(affected,
+                               sorted(labels[n] for n in affected)):
+            labels[node] = label
+        return True
+
+
 def _build_droot_impact(destroy_handler):
     droot = {}   # destroyed view + nonview variables -> foundation
     impact = {}  # destroyed nonview variable -> it + all views of it
@@ -291,7 +459,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
 
     It is a work in progress. The following data structures have been
     converted to use the incremental strategy:
-        <none>
+        topological_order (the order of the nodes used to detect cycles)
 
     The following data structures remain to be converted:
         <unknown>
@@ -380,6 +548,8 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         # clients: how many times does an apply use a given variable
         self.clients = OrderedDict()  # variable -> apply -> ninputs
         self.stale_droot = True
+        # order of the nodes used to detect cycles incrementally
+        self.topological_order = _TopologicalOrder()
 
         self.debug_all_apps = set()
         if self.do_imports_on_attach:
@@ -414,6 +584,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         del self.view_o
         del self.clients
         del self.stale_droot
+        del self.topological_order
         assert self.fgraph.destroyer_handler is self
         delattr(self.fgraph, 'destroyers')
         delattr(self.fgraph, 'destroy_handler')
@@ -472,6 +643,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
             raise ProtocolError("double import")
         self.debug_all_apps.add(app)
         # print 'DH IMPORT', app, id(app), id(self), len(self.debug_all_apps)
+        self.topological_order.on_import(app)
 
         # If it's a destructive op, add it to our watch list
         if getattr(app.op, 'destroy_map', None):
@@ -508,6 +680,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         if app not in self.debug_all_apps:
             raise ProtocolError("prune without import")
         self.debug_all_apps.remove(app)
+        self.topological_order.on_prune(app)
 
         # UPDATE self.clients
         for input in set(app.inputs):
@@ -551,6 +724,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
         else:
             if app not in self.debug_all_apps:
                 raise ProtocolError("change without import")
+            self.topological_order.on_change_input(app, new_r)
 
             # UPDATE self.clients
             self.clients[old_r][app] -= 1
@@ -615,7 +789,7 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
                         raise app_err_pairs[app]
             else:
                 ords = self.orderings(fgraph, ordered=False)
-                if _contains_cycle(fgraph, ords):
+                if self.topological_order.contains_cycle(fgraph, ords):
                     raise InconsistencyError("Dependency graph contains cycles")
         else:
             # James's Conjecture:
@@ -628,7 +802,9 @@ class DestroyHandler(toolbox.Bookkeeper):  # noqa
             # doing this conjecture should speed up compilation most of
             # the time. The user should create such dependency except
             # if he mess too much with the internal.
-            pass
+
+            # The order is rebuilt when destroyers are added again.
+            self.topological_order.reset()
         return True
 
     def orderings(self, fgraph, ordered=True):
@@ -114,6 +114,9 @@ typedef struct {
     int do_timing;
     int need_update_inputs;
     int position_of_error; // -1 for no error, otw the index into `thunks` that failed.
+    PyObject * cancel; // exception raised before running the next thunk, or None
+    int release_gil; // 1 to let other threads run between thunks
+    PyObject * trace; // called as trace(node_idx, t0, t1) after timed thunks, or None
 } CLazyLinker;
 
 
@@ -173,6 +176,8 @@ CLazyLinker_dealloc(PyObject* _self)
   Py_XDECREF(self->call_times);
   Py_XDECREF(self->call_counts);
   Py_XDECREF(self->pre_call_clear);
+  Py_XDECREF(self->cancel);
+  Py_XDECREF(self->trace);
   Py_TYPE(self)->tp_free((PyObject*)self);
 }
 static PyObject *
@@ -222,6 +227,11 @@ CLazyLinker_new(PyTypeObject *type, PyObject *args, PyObject *kwds)
 
       self->need_update_inputs = 0;
       self->position_of_error = -1;
+      Py_INCREF(Py_None);
+      self->cancel = Py_None;
+      self->release_gil = 0;
+      Py_INCREF(Py_None);
+      self->trace = Py_None;
     }
     return (PyObject *)self;
 }
@@ -477,6 +487,21 @@ static void set_position_of_error(CLazyLinker * self, int owner_idx)
       self->position_of_error = owner_idx;
     }
 }
+/**
+  Call self->trace(node_idx, t0, t1) if it is set. Return nonzero, with an
+  exception set, if it failed.
+  */
+static int call_trace(CLazyLinker * self, Py_ssize_t node_idx, double t0, double t1)
+{
+  if (!self->trace || self->trace == Py_None)
+    return 0;
+  PyObject * r = PyObject_CallFunction(self->trace, (char*)"ndd",
+                                       node_idx, t0, t1);
+  if (!r)
+    return 1;
+  Py_DECREF(r);
+  return 0;
+}
 static PyObject * pycall(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
 {
   // call thunk to see which inputs it wants
@@ -499,6 +524,11 @@ static PyObject * pycall(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
           long icount = PyInt_AsLong(count);
           PyList_SetItem(self->call_counts, node_idx,
                          PyInt_FromLong(icount + 1));
+          if (call_trace(self, node_idx, t0, t1))
+            {
+              Py_DECREF(rval);
+              rval = NULL;
+            }
       }
     }
   else
@@ -517,11 +547,12 @@ static int c_call(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
   int (*fn)(void*) = (int (*)(void*))(ptr_addr);
   if (verbose) fprintf(stderr, "calling non-lazy shortcut (node %i)\n", (int)node_idx);
   int err = 0;
+  double t0 = 0, t1 = 0;
   if (self->do_timing)
     {
-      double t0 = pytime(NULL);
+      t0 = pytime(NULL);
       err = fn(self->thunk_cptr_data[node_idx]);
-      double t1 = pytime(NULL);
+      t1 = pytime(NULL);
       double ti = PyFloat_AsDouble(PyList_GetItem(self->call_times, node_idx));
       PyList_SetItem(self->call_times, node_idx, PyFloat_FromDouble(t1 - t0 + ti));
       PyObject * count = PyList_GetItem(self->call_counts, node_idx);
@@ -549,9 +580,36 @@ static int c_call(CLazyLinker * self, Py_ssize_t node_idx, int verbose)
       assert(!PyErr_Occurred()); // because CLinker hid the exception in __ERROR aka data
       PyErr_Restore(err_type, err_msg, err_trace); //steals refs to args
     }
+  else if (self->do_timing && call_trace(self, node_idx, t0, t1))
+    {
+      err = 1;
+    }
   if (err) set_position_of_error(self, node_idx);
   return err;
 }
+/**
+  Called before each thunk. Return nonzero, with an exception set, if the
+  call was cancelled. The cancellation is not an error of a node, so the
+  callers return without setting position_of_error.
+  */
+static int check_cancel(CLazyLinker * self)
+{
+  if (self->release_gil)
+    {
+      // Give other threads a chance to run, e.g. to cancel the call.
+      Py_BEGIN_ALLOW_THREADS
+      Py_END_ALLOW_THREADS
+    }
+  if (self->cancel && self->cancel != Py_None)
+    {
+      if (PyExceptionClass_Check(self->cancel))
+        PyErr_SetNone(self->cancel);
+      else
+        PyErr_SetObject(PyExceptionInstance_Class(self->cancel), self->cancel);
+      return 1;
+    }
+  return 0;
+}
 static
 int lazy_rec_eval(CLazyLinker * self, Py_ssize_t var_idx, PyObject*one, PyObject*zero)
 {
@@ -599,6 +657,7 @@ int lazy_rec_eval(CLazyLinker * self, Py_ssize_t var_idx, PyObject*one, PyObject
           if (err) goto fail;
         }
 
+      if (check_cancel(self)) return 1;
       rval = pycall(self, owner_idx, verbose);
       // refcounting - rval is new ref
       //TODO: to prevent infinite loops
@@ -694,6 +753,7 @@ int lazy_rec_eval(CLazyLinker * self, Py_ssize_t var_idx, PyObject*one, PyObject
         }
 
       // call the thunk for this owner.
+      if (check_cancel(self)) return 1;
       if (self->thunk_cptr_fn[owner_idx])
         {
           err = c_call(self, owner_idx, verbose);
@@ -1003,6 +1063,12 @@ static PyMemberDef CLazyLinker_members[] = {
      (char*)"bool: nonzero means call will time thunks"},
     {(char*)"need_update_inputs", T_INT, offsetof(CLazyLinker, need_update_inputs), 0,
      (char*)"bool: nonzero means Function.__call__ must implement update mechanism"},
+    {(char*)"cancel", T_OBJECT, offsetof(CLazyLinker, cancel), 0,
+     (char*)"exception raised before running the next thunk, or None"},
+    {(char*)"release_gil", T_INT, offsetof(CLazyLinker, release_gil), 0,
+     (char*)"bool: nonzero means the GIL is released between thunks"},
+    {(char*)"trace", T_OBJECT, offsetof(CLazyLinker, trace), 0,
+     (char*)"called as trace(node_idx, t0, t1) after each timed thunk, or None"},
     {NULL}  /* Sentinel */
 };
 
@@ -1054,7 +1120,7 @@ static PyTypeObject lazylinker_ext_CLazyLinkerType = {
 
 static PyObject * get_version(PyObject *dummy, PyObject *args)
 {
-  PyObject *result = PyFloat_FromDouble(0.211);
+  PyObject *result = PyFloat_FromDouble(0.214);
   return result;
 }
 
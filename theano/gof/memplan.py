@@ -0,0 +1,309 @@
+"""
+Static planning of the storage of the intermediate results of a graph.
+
+Before the thunks of a graph are made, `plan_memory` assigns the variables
+computed by the graph to a set of buffers. Two variables can share a buffer
+when their lifetimes do not overlap and they have the same type and the same
+symbolic shape (as inferred by `ShapeFeature`): the op computing the second
+variable then finds an array of the right shape in its output storage and
+writes into it instead of allocating a new one. Buffers are assigned
+greedily, in the order of execution (interval coloring).
+
+The node computing the second variable must also depend on all the nodes
+computing and using the first one, so that the plan holds for any order of
+execution respecting the dependencies (the C VM evaluates the graph from its
+outputs, not in the order of the nodes given to the linker).
+
+The lifetime of a variable starts with the node computing it and ends after
+the last node using it or any of its views. Only variables owning their
+memory are planned: views, variables aliasing an input of the graph and
+variables (or views of variables) returned by the graph are left alone.
+
+"""
+from __future__ import absolute_import, print_function, division
+
+import heapq
+
+import numpy as np
+from six import iteritems
+
+from theano.compat import izip
+
+
+class MemoryPlan(object):
+    """
+    Assignment of the intermediate results of a graph to buffers.
+
+    Attributes
+    ----------
+    order : list of Apply
+        The nodes, in the order they are run.
+    buffers : list of lists of Variable
+        The variables sharing a buffer, in the order they are computed.
+        Variables that do not share their buffer are not listed.
+    intervals : dict
+        Maps each variable owning its memory to the (first, last) positions
+        in `order` of the nodes computing and using it, `last` being None
+        for variables that are used after the call.
+    shapes : dict
+        Maps the variables in `intervals` and the inputs of the graph to
+        their symbolic shape, or None.
+
+    """
+
+    def __init__(self, order, buffers, intervals, shapes, fgraph_inputs):
+        self.order = order
+        self.buffers = buffers
+        self.intervals = intervals
+        self.shapes = shapes
+        self.fgraph_inputs = fgraph_inputs
+
+    def reallocated_info(self):
+        """
+        Return a dict mapping each variable that hands over its buffer to
+        [variable, next variable using the buffer].
+
+        """
+        info = {}
+        for buf in self.buffers:
+            for var, next_var in zip(buf[:-1], buf[1:]):
+                info[var] = [var, next_var]
+        return info
+
+    def sizes(self, input_shapes):
+        """
+        Return the size in bytes of the variables in `intervals`.
+
+        Parameters
+        ----------
+        input_shapes : list of tuples
+            The shape of each input of the graph (None for the inputs that
+            are not tensors).
+
+        Returns
+        -------
+        dict
+            Maps each variable to its size. Variables whose shape depends on
+            the value of the inputs, or with an unknown shape, are not
+            included.
+
+        """
+        import theano
+        from theano import tensor
+
+        replace = {}
+        for var, shape in zip(self.fgraph_inputs, input_shapes):
+            sym_shape = self.shapes.get(var)
+            if sym_shape is None or shape is None:
+                continue
+            for dim, value in zip(sym_shape, shape):
+                if not isinstance(dim, theano.Constant):
+                    replace[dim] = tensor.constant(value, dtype='int64')
+
+        known = []
+        known_dims = []
+        for var, sym_shape in iteritems(self.shapes):
+            if (var not in self.intervals or sym_shape is None or
+                    not hasattr(var.type, 'dtype')):
+                continue
+            dims = theano.clone(list(sym_shape), replace=replace)
+            if all(isinstance(leaf, theano.Constant)
+                   for leaf in theano.gof.graph.inputs(dims)):
+                known.append(var)
+                known_dims.extend(dims)
+        if known_dims:
+            values = theano.function([], known_dims)()
+        else:
+            values = []
+
+        rval = {}
+        pos = 0
+        for var in known:
+            ndim = len(self.shapes[var])
+            n_elements = int(np.prod(values[pos:pos + ndim], dtype='int64'))
+            rval[var] = n_elements * np.dtype(var.type.dtype).itemsize
+            pos += ndim
+        return rval
+
+    def peak_memory(self, input_shapes, planned=True):
+        """
+        Return the largest amount of memory, in bytes, held by the variables
+        computed by the graph at any time during a call.
+
+        Parameters
+        ----------
+        input_shapes : list of tuples
+            See `sizes`.
+        planned : bool
+            If False, return the peak when every variable has its own buffer,
+            released after its last use.
+
+        """
+        sizes = self.sizes(input_shapes)
+        n_nodes = len(self.order)
+        delta = [0] * (n_nodes + 1)
+
+        def hold(size, first, last):
+            if last is None:
+                last = n_nodes - 1
+            delta[first] += size
+            delta[last + 1] -= size
+
+        shared = set()
+        if planned:
+            for buf in self.buffers:
+                shared.update(buf)
+                hold(max(sizes.get(var, 0) for var in buf),
+                     self.intervals[buf[0]][0], self.intervals[buf[-1]][1])
+        for var, (first, last) in iteritems(self.intervals):
+            if var not in shared:
+                hold(sizes.get(var, 0), first, last)
+
+        peak = current = 0
+        for d in delta:
+            current += d
+            peak = max(peak, current)
+        return peak
+
+
+def _intervals(order, fgraph):
+    """
+    Return the lifetime of the variables owning their memory (see
+    `MemoryPlan.intervals`), and for each of them the set of the positions
+    of the nodes computing and using it.
+
+    """
+    position = dict((node, i) for i, node in enumerate(order))
+    outputs = set(fgraph.outputs)
+    # Maps each variable to the set of variables owning the memory it uses.
+    roots = {}
+    intervals = {}
+    users = {}
+    for i, node in enumerate(order):
+        aliased = {}
+        for alias_map in (getattr(node.op, 'destroy_map', None),
+                          getattr(node.op, 'view_map', None)):
+            for o, ins in iteritems(alias_map or {}):
+                aliased.setdefault(o, []).extend(ins)
+        for o, out in enumerate(node.outputs):
+            if o in aliased:
+                roots[out] = set()
+                for j in aliased[o]:
+                    roots[out].update(roots.get(node.inputs[j],
+                                                [node.inputs[j]]))
+            else:
+                roots[out] = set([out])
+                intervals[out] = [i, i]
+                users[out] = set([i])
+
+    for var, var_roots in iteritems(roots):
+        clients = [position[client] for client, _ in var.clients
+                   if client in position]
+        for root in var_roots:
+            if root not in intervals:
+                # An input of the graph or a constant.
+                continue
+            interval = intervals[root]
+            if var in outputs or interval[1] is None:
+                interval[1] = None
+            else:
+                interval[1] = max([interval[1]] + clients)
+            for i in clients:
+                users[root].add(i)
+    return (dict((var, tuple(interval))
+                 for var, interval in iteritems(intervals)),
+            users)
+
+
+def _ancestors(order, fgraph):
+    """
+    Yield, for each node of `order`, the set of the positions of the nodes
+    it depends on, as a bit mask.
+
+    The mask of a node is forgotten once all the nodes depending directly on
+    it have been yielded, so that the masks kept at a time do not grow with
+    the square of the number of nodes for long chains of nodes.
+
+    """
+    position = dict((node, i) for i, node in enumerate(order))
+    orderings = fgraph.orderings()
+    preds = []
+    # Position of the last node depending directly on each node.
+    last_succ = {}
+    for i, node in enumerate(order):
+        node_preds = set(position[pred] for pred in
+                         [var.owner for var in node.inputs] +
+                         list(orderings.get(node, []))
+                         if pred in position)
+        preds.append(node_preds)
+        for p in node_preds:
+            last_succ[p] = i
+    masks = {}
+    for i in range(len(order)):
+        mask = 0
+        for p in preds[i]:
+            mask |= masks[p] | (1 << p)
+        yield mask
+        masks[i] = mask
+        for p in preds[i]:
+            if last_succ[p] == i:
+                del masks[p]
+        if i not in last_succ:
+            del masks[i]
+
+
+def plan_memory(order, fgraph):
+    """
+    Assign the variables computed by `order` to buffers.
+
+    Parameters
+    ----------
+    order : list of Apply
+        The nodes of `fgraph`, in the order they will be run.
+    fgraph : FunctionGraph
+        It must have a `ShapeFeature` (as the graphs optimized by the
+        'ShapeOpt' optimizer do): the shapes are not inferred here, to keep
+        linking cheap.
+
+    Returns
+    -------
+    MemoryPlan
+
+    """
+    shape_feature = fgraph.shape_feature
+    intervals, users = _intervals(order, fgraph)
+    shapes = {}
+    for var in list(intervals) + list(fgraph.inputs):
+        shapes[var] = shape_feature.shape_of.get(var)
+
+    def compatible(buf, var, ancestors):
+        if any(not ancestors & (1 << j) for j in users[buf[-1]]):
+            return False
+        if (buf[0].type != var.type or
+                getattr(var, 'ndim', None) is None):
+            return False
+        return var.ndim == 0 or shape_feature.same_shape(buf[0], var)
+
+    buffers = []
+    free = []
+    # (last use, buffer index) of the buffers in use.
+    busy = []
+    all_ancestors = _ancestors(order, fgraph)
+    for i, (node, ancestors) in enumerate(izip(order, all_ancestors)):
+        while busy and busy[0][0] < i:
+            free.append(heapq.heappop(busy)[1])
+        for out in node.outputs:
+            if out not in intervals or intervals[out][1] is None:
+                continue
+            for pos, b in enumerate(free):
+                if compatible(buffers[b], out, ancestors):
+                    del free[pos]
+                    buffers[b].append(out)
+                    break
+            else:
+                b = len(buffers)
+                buffers.append([out])
+            heapq.heappush(busy, (intervals[out][1], b))
+
+    return MemoryPlan(order, [buf for buf in buffers if len(buf) > 1],
+                      intervals, shapes, list(fgraph.inputs))
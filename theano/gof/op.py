@@ -7,13 +7,16 @@ compatible with `gof`'s :doc:`graph` routines.
 """
 from __future__ import absolute_import, print_function, division
 
+from contextlib import contextmanager
 import inspect
 import logging
 import numpy as np
 import os
 import re
 import sys
+import threading
 import warnings
+import weakref
 
 import theano
 from theano import config
@@ -46,6 +49,86 @@ else:
         return open(file, 'U')
 
 
+# Table of the Apply nodes built by `PureOp.__call__` when
+# config.hash_consing is True. It maps a key made of the op and its
+# inputs to a weak reference to the node and a snapshot of its inputs,
+# so that the entry disappears with the node and is ignored once an
+# optimizer has changed the inputs of the node inplace.
+_hash_cons_table = {}
+# Its `suspended` attribute is True in the threads running an optimizer.
+_hash_cons_local = threading.local()
+
+
+@contextmanager
+def hash_consing_suspended():
+    """
+    Context manager disabling the hash consing of `PureOp.__call__` in the
+    current thread, whatever the value of config.hash_consing.
+
+    """
+    orig = getattr(_hash_cons_local, 'suspended', False)
+    _hash_cons_local.suspended = True
+    try:
+        yield
+    finally:
+        _hash_cons_local.suspended = orig
+
+
+def _hash_cons_key(op, inputs):
+    """
+    Return the key of `op` applied to `inputs` in `_hash_cons_table`.
+
+    Constants are identified by their signature, as in the MergeOptimizer,
+    other variables by their identity. Return None if `inputs` are not
+    all variables, if one of them belongs to a FunctionGraph (the nodes
+    built by optimizers are left to the MergeOptimizer), or if the key is
+    not hashable.
+
+    """
+    key = [op]
+    for inp in inputs:
+        if getattr(inp, 'fgraph', None) is not None:
+            return None
+        if isinstance(inp, graph.Constant):
+            key.append((graph.Constant, inp.signature()))
+        elif isinstance(inp, graph.Variable):
+            key.append(inp)
+        else:
+            return None
+    key = tuple(key)
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def _hash_cons_lookup(key):
+    """
+    Return the live node registered under `key`, or None.
+
+    """
+    entry = _hash_cons_table.get(key)
+    if entry is None:
+        return None
+    ref, inputs = entry
+    node = ref()
+    if (node is None or getattr(node, 'fgraph', None) is not None or
+            len(node.inputs) != len(inputs) or
+            any(a is not b for a, b in zip(node.inputs, inputs))):
+        del _hash_cons_table[key]
+        return None
+    return node
+
+
+def _hash_cons_register(key, node):
+    def remove(ref):
+        entry = _hash_cons_table.get(key)
+        if entry is not None and entry[0] is ref:
+            del _hash_cons_table[key]
+    _hash_cons_table[key] = (weakref.ref(node, remove), tuple(node.inputs))
+
+
 class CLinkerObject(object):
     """
     Standard elements of an Op or Type used with the CLinker.
@@ -580,6 +663,34 @@ class PureOp(object):
         detailed_err_msg = utils.get_variable_trace_string(v)
         raise AttributeError('%s has no test value %s' % (v, detailed_err_msg))
 
+    def _hash_consed_node(self, inputs, kwargs):
+        """
+        Return the node of a previous identical call, or a new node.
+
+        When all the arguments are variables, the lookup is done on them
+        and `make_node` is skipped entirely on a hit. Otherwise, the new node
+        is looked up by its inputs and dropped if an equivalent one exists.
+
+        """
+        key = None
+        if not kwargs:
+            key = _hash_cons_key(self, inputs)
+            if key is not None:
+                node = _hash_cons_lookup(key)
+                if node is not None:
+                    return node
+        node = self.make_node(*inputs, **kwargs)
+        node_key = _hash_cons_key(node.op, node.inputs)
+        if node_key is not None:
+            cached = _hash_cons_lookup(node_key)
+            if cached is not None:
+                node = cached
+            else:
+                _hash_cons_register(node_key, node)
+        if key is not None:
+            _hash_cons_register(key, node)
+        return node
+
     def __call__(self, *inputs, **kwargs):
         """
         Optional: return some or all output[s] of `make_node`.
@@ -612,7 +723,12 @@ class PureOp(object):
 
         """
         return_list = kwargs.pop('return_list', False)
-        node = self.make_node(*inputs, **kwargs)
+        if (config.hash_consing and
+                not getattr(self, 'destroy_map', None) and
+                not getattr(_hash_cons_local, 'suspended', False)):
+            node = self._hash_consed_node(inputs, kwargs)
+        else:
+            node = self.make_node(*inputs, **kwargs)
 
         if config.compute_test_value != 'off':
             run_perform = True
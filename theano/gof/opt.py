@@ -22,7 +22,7 @@ from theano import config
 from theano.compat import izip
 from six import string_types, iteritems, itervalues, integer_types
 from six.moves import reduce
-from theano.gof import graph, op, utils, unify, toolbox
+from theano.gof import compiletime, graph, op, utils, unify, toolbox
 from theano.gof.fg import InconsistencyError
 from theano.misc.ordered_set import OrderedSet
 
@@ -84,7 +84,10 @@ class Optimizer(object):
         try:
             orig = theano.tensor.basic.constant.enable
             theano.tensor.basic.constant.enable = False
-            ret = self.apply(fgraph, *args, **kwargs)
+            # The nodes built by the optimizers may have their inputs
+            # changed inplace, they must not be shared.
+            with op.hash_consing_suspended():
+                ret = self.apply(fgraph, *args, **kwargs)
         finally:
             theano.tensor.basic.constant.enable = orig
         return ret
@@ -238,7 +241,11 @@ class SeqOptimizer(Optimizer, list):
                 try:
                     nb_nodes_before = len(fgraph.apply_nodes)
                     t0 = time.time()
-                    sub_prof = optimizer.optimize(fgraph)
+                    with compiletime.phase(
+                            'optimizer',
+                            getattr(optimizer, 'name', None) or
+                            optimizer.__class__.__name__):
+                        sub_prof = optimizer.optimize(fgraph)
                     l.append(float(time.time() - t0))
                     sub_profs.append(sub_prof)
                     nb_nodes.append((nb_nodes_before,
@@ -2257,6 +2264,58 @@ class ChangeTracker:
         del fgraph.change_tracker
 
 
+class DirtyNodeTracker:
+    """
+    Feature collecting the nodes whose inputs or clients changed, which an
+    optimizer may have to visit again.
+
+    The nodes are kept in `nodes` (an OrderedDict used as an ordered set)
+    in the order they were changed. The nodes using the outputs of a node
+    whose inputs changed are collected too, as local optimizers look at the
+    owner of the inputs of the node they are applied to.
+
+    """
+    def __init__(self):
+        self.nodes = OrderedDict()
+
+    def mark(self, fgraph, node):
+        if node is not None and node in fgraph.apply_nodes:
+            self.nodes[node] = None
+
+    def on_import(self, fgraph, node, reason):
+        self.mark(fgraph, node)
+        for r in node.inputs:
+            self.mark(fgraph, r.owner)
+
+    def on_prune(self, fgraph, node, reason):
+        self.discard(node)
+        for r in node.inputs:
+            self.mark(fgraph, r.owner)
+
+    def on_change_input(self, fgraph, node, i, r, new_r, reason):
+        self.mark(fgraph, r.owner)
+        self.mark(fgraph, new_r.owner)
+        if isinstance(node, string_types):
+            return
+        self.mark(fgraph, node)
+        for out in node.outputs:
+            for client, _ in out.clients:
+                if not isinstance(client, string_types):
+                    self.mark(fgraph, client)
+
+    def discard(self, node):
+        self.nodes.pop(node, None)
+
+    def pop_all(self):
+        """
+        Return the nodes collected so far and forget them.
+
+        """
+        nodes = list(self.nodes)
+        self.nodes.clear()
+        return nodes
+
+
 def merge_dict(d1, d2):
     """
     merge 2 dicts by adding the values.
@@ -2292,6 +2351,14 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         They must not traverse the graph as they are called very frequently.
         The MergeOptimizer is one example of optimization that respect this.
         They are applied after all global optimizer, then when one local optimizer is applied, then after all final optimizer.
+    incremental : bool or None
+        If True, only the first iteration applies the local optimizers to
+        all the nodes of the graph. The next ones only visit the nodes whose
+        inputs or clients changed since they were last visited (see
+        `DirtyNodeTracker`). Once such an iteration changes nothing, the
+        local optimizers are applied to the whole graph again, to check that
+        the equilibrium is reached. If None, use the value of the flag
+        `optdb.incremental`.
 
     """
 
@@ -2302,7 +2369,8 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                  tracks_on_change_inputs=False,
                  max_use_ratio=None,
                  final_optimizers=None,
-                 cleanup_optimizers=None):
+                 cleanup_optimizers=None,
+                 incremental=None):
         super(EquilibriumOptimizer, self).__init__(
             None,
             ignore_newtrees=ignore_newtrees,
@@ -2313,6 +2381,7 @@ class EquilibriumOptimizer(NavigatorOptimizer):
         self.final_optimizers = []
         self.cleanup_optimizers = []
         self.tracks_on_change_inputs = tracks_on_change_inputs
+        self.incremental = incremental
 
         for opt in optimizers:
             if isinstance(opt, LocalOptimizer):
@@ -2356,11 +2425,22 @@ class EquilibriumOptimizer(NavigatorOptimizer):
     def apply(self, fgraph, start_from=None):
         change_tracker = ChangeTracker()
         fgraph.attach_feature(change_tracker)
+        incremental = self.incremental
+        if incremental is None:
+            incremental = config.optdb.incremental
         if start_from is None:
             start_from = fgraph.outputs
         else:
             for node in start_from:
                 assert node in fgraph.outputs
+            # The nodes that changed may not be ancestors of start_from.
+            incremental = False
+        dirty_tracker = None
+        if incremental:
+            dirty_tracker = DirtyNodeTracker()
+            fgraph.attach_feature(dirty_tracker)
+        # Whether the local optimizers must visit all the nodes.
+        full_sweep = True
 
         changed = True
         max_use_abort = False
@@ -2442,11 +2522,22 @@ class EquilibriumOptimizer(NavigatorOptimizer):
 
             # apply local optimizer
             topo_t0 = time.time()
-            q = deque(graph.io_toposort(fgraph.inputs, start_from))
+            swept = full_sweep
+            if full_sweep:
+                q = deque(graph.io_toposort(fgraph.inputs, start_from))
+                if dirty_tracker is not None:
+                    dirty_tracker.pop_all()
+                    full_sweep = False
+            else:
+                q = deque(dirty_tracker.pop_all())
             io_toposort_timing.append(time.time() - topo_t0)
 
             nb_nodes.append(len(q))
             max_nb_nodes = max(max_nb_nodes, len(q))
+            if dirty_tracker is not None:
+                # The queue only holds the changed nodes, the threshold
+                # stays relative to the size of the graph.
+                max_nb_nodes = max(max_nb_nodes, len(fgraph.apply_nodes))
             max_use = max_nb_nodes * self.max_use_ratio
 
             def importer(node):
@@ -2466,6 +2557,8 @@ class EquilibriumOptimizer(NavigatorOptimizer):
                     node = q.pop()
                     if node not in fgraph.apply_nodes:
                         continue
+                    if dirty_tracker is not None:
+                        dirty_tracker.discard(node)
                     current_node = node
                     for lopt in (self.local_optimizers_all +
                                  self.local_optimizers_map.get(type(node.op), []) +
@@ -2530,7 +2623,13 @@ class EquilibriumOptimizer(NavigatorOptimizer):
             loop_process_count.append(process_count)
             loop_timing.append(float(time.time() - t0))
 
+            if dirty_tracker is not None and not changed and not swept:
+                # Check the equilibrium on the whole graph.
+                changed = full_sweep = True
+
         end_nb_nodes = len(fgraph.apply_nodes)
+        if dirty_tracker is not None:
+            fgraph.remove_feature(dirty_tracker)
 
         if max_use_abort:
             msg = ("EquilibriumOptimizer max'ed out by '%s'" % opt_name +
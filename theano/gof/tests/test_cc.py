@@ -1,12 +1,15 @@
 from __future__ import absolute_import, print_function, division
 
+import os
+
 from nose.plugins.skip import SkipTest
 
 import numpy as np
 
 import theano
 from theano.gof.link import PerformLinker
-from theano.gof.cc import CLinker, DualLinker, OpWiseCLinker
+from theano.configparser import change_flags
+from theano.gof.cc import CLinker, DualLinker, OpWiseCLinker, compile_nodes
 from theano.gof.type import Type
 from theano.gof.graph import Variable, Apply, Constant
 from theano.gof.op import Op
@@ -160,6 +163,52 @@ class Div(Binary):
 div = Div()
 
 
+class AddCst(MyOp):
+    # Unversioned, with a random constant, so it is always compiled.
+    __props__ = ("nin", "name", "cst")
+
+    def __init__(self, cst):
+        MyOp.__init__(self, 1, self.__class__.__name__)
+        self.cst = cst
+
+    def c_code(self, node, name, inp, out, sub):
+        x, = inp
+        z, = out
+        return "%(z)s = %(x)s + %(cst)r;" % dict(locals(), cst=self.cst)
+
+    def impl(self, x):
+        return x + self.cst
+
+    def c_code_cache_version(self):
+        return ()
+
+
+class MacroAddCst(MyOp):
+    # Defines the macro `macro` and declares a variable named `var`.
+    __props__ = ("nin", "name", "cst", "macro", "var")
+
+    def __init__(self, cst, macro, var):
+        MyOp.__init__(self, 1, self.__class__.__name__)
+        self.cst = cst
+        self.macro = macro
+        self.var = var
+
+    def c_support_code(self):
+        return "#define %s %r\n" % (self.macro, self.cst)
+
+    def c_code(self, node, name, inp, out, sub):
+        x, = inp
+        z, = out
+        return "{ double %(var)s = %(macro)s; %(z)s = %(x)s + %(var)s; }" % dict(
+            locals(), var=self.var, macro=self.macro)
+
+    def impl(self, x):
+        return x + self.cst
+
+    def c_code_cache_version(self):
+        return ()
+
+
 def inputs():
     x = double('x')
     y = double('y')
@@ -252,6 +301,23 @@ def test_clinker_dups():
     # note: for now the behavior of fn(2.0, 7.0) is undefined
 
 
+def test_clinker_cmodule_key_cache():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x, y, z = inputs()
+    e = add(mul(add(x, y), div(x, y)), add(x, z))
+    key = CLinker().accept(Env([x, y, z], [e])).cmodule_key()
+    assert len(theano.gof.cc._node_version_cache) > 0
+    # The memoized versions give the same key.
+    assert CLinker().accept(Env([x, y, z], [e])).cmodule_key() == key
+    # Changing the config invalidates them.
+    other = 'float32' if theano.config.floatX == 'float64' else 'float64'
+    with change_flags(floatX=other):
+        other_key = CLinker().accept(Env([x, y, z], [e])).cmodule_key()
+    assert other_key != key
+    assert CLinker().accept(Env([x, y, z], [e])).cmodule_key() == key
+
+
 def test_clinker_not_used_inputs():
     if not theano.config.cxx:
         raise SkipTest("G++ not available, so we need to skip this test.")
@@ -291,6 +357,54 @@ def test_opwiseclinker_straightforward():
         assert fn(2.0, 2.0, 2.0) == -6
 
 
+def test_opwiseclinker_parallel_compile():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x, y, z = inputs()
+    csts = np.random.rand(3)
+    e = add(AddCst(csts[0])(x), add(AddCst(csts[1])(y), AddCst(csts[2])(z)))
+    env = Env([x, y, z], [e])
+    order = env.toposort()
+    storage_map = dict((v, [None]) for v in env.variables)
+    compute_map = dict((v, [v.owner is None]) for v in env.variables)
+    assert compile_nodes(order, storage_map, compute_map, [], n_jobs=3) >= 3
+    # Everything is in the cache now.
+    assert compile_nodes(order, storage_map, compute_map, [], n_jobs=3) == 0
+
+    csts = np.random.rand(3)
+    e = add(AddCst(csts[0])(x), add(AddCst(csts[1])(y), AddCst(csts[2])(z)))
+    with change_flags(**{'cmodule.parallel_compile': 3}):
+        fn = OpWiseCLinker().accept(Env([x, y, z], [e])).make_function()
+    assert np.allclose(fn(1.0, 2.0, 3.0), 6.0 + csts.sum())
+
+
+def test_opwiseclinker_batch_compile():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x, y, z = inputs()
+    csts = np.random.rand(3)
+    e = add(AddCst(csts[0])(x), add(AddCst(csts[1])(y), AddCst(csts[2])(z)))
+    env = Env([x, y, z], [e])
+    order = env.toposort()
+    storage_map = dict((v, [None]) for v in env.variables)
+    compute_map = dict((v, [v.owner is None]) for v in env.variables)
+    assert compile_nodes(order, storage_map, compute_map, [], n_jobs=1,
+                         batch_size=3) >= 3
+    assert compile_nodes(order, storage_map, compute_map, [], n_jobs=1,
+                         batch_size=3) == 0
+    with change_flags(**{'cmodule.batch_compile': 3}):
+        lnk = OpWiseCLinker().accept(env)
+        fn, in_storage, out_storage, thunks, _ = lnk.make_all()
+    for storage, value in zip(in_storage, [1.0, 2.0, 3.0]):
+        storage.data = value
+    fn()
+    assert np.allclose(out_storage[0].data, 6.0 + csts.sum())
+    # The modules of the AddCst nodes come from the same library.
+    libs = set(os.stat(thunk.thunk.module.__file__).st_ino for thunk, node
+               in zip(thunks, order) if isinstance(node.op, AddCst))
+    assert len(libs) == 1
+
+
 def test_opwiseclinker_constant():
     x, y, z = inputs()
     x = Constant(tdouble, 7.2, name='x')
@@ -448,3 +562,26 @@ def test_shared_input_output():
     gv0 = gv(0)
     assert np.all(fv0 == 5), fv0
     assert np.all(gv0 == 5), gv0
+
+
+def test_batch_compile_macros():
+    # A macro defined by a module does not leak into the modules compiled
+    # after it in the same library, where it would replace a variable name.
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x, y, z = inputs()
+    csts = np.random.rand(2)
+    e = add(MacroAddCst(csts[0], 'THEANO_TEST_A', 'THEANO_TEST_B')(x),
+            MacroAddCst(csts[1], 'THEANO_TEST_B', 'THEANO_TEST_A')(y))
+    env = Env([x, y], [e])
+    with change_flags(**{'cmodule.batch_compile': 3}):
+        lnk = OpWiseCLinker().accept(env)
+        fn, in_storage, out_storage, thunks, _ = lnk.make_all()
+    for storage, value in zip(in_storage, [1.0, 2.0]):
+        storage.data = value
+    fn()
+    assert np.allclose(out_storage[0].data, 3.0 + csts.sum())
+    libs = set(os.stat(thunk.thunk.module.__file__).st_ino for thunk, node
+               in zip(thunks, env.toposort())
+               if isinstance(node.op, MacroAddCst))
+    assert len(libs) == 1
@@ -6,10 +6,20 @@ deterministic based on the input type and the op.
 """
 from __future__ import absolute_import, print_function, division
 
+import os
+import shutil
+import tempfile
+import time
+
 import numpy as np
+from nose.plugins.skip import SkipTest
 
 import theano
-from theano.gof.cmodule import GCC_compiler
+from theano.gof import compilelock
+from theano.gof.cc import CLinker
+from theano.configparser import change_flags
+from theano.gof.cmodule import (GCC_compiler, ModuleCache, ModuleIndex,
+                                precompiled_header_args, std_include_dirs)
 
 
 class MyOp(theano.compile.ops.DeepCopyOp):
@@ -69,3 +79,117 @@ def test_flag_detection():
     # but was not detected because that path is not usually taken,
     # so we test it here directly.
     GCC_compiler.try_flags(["-lblas"])
+
+
+def test_module_index():
+    # A new ModuleCache finds the modules compiled by another one through
+    # the index, without walking the cache directory.
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        x = theano.tensor.dvector()
+        fgraph = theano.gof.FunctionGraph([x], [theano.tensor.tanh(x) + 1])
+        lnk = CLinker().accept(fgraph)
+        key = lnk.cmodule_key()
+
+        cache1 = ModuleCache(dirname)
+        assert cache1.full_refresh_done
+        assert cache1.index.dirs == {}
+        cache1.module_from_key(key, lnk)
+        assert cache1.stats[2] == 1
+        assert len(cache1.index.dirs) == 1
+
+        cache2 = ModuleCache(dirname)
+        assert not cache2.full_refresh_done
+        assert cache2.index.dirs == cache1.index.dirs
+        # A module found through the index does not need the lock.
+        module_lock_ctx = compilelock.module_lock_ctx
+        compilelock.module_lock_ctx = None
+        try:
+            cache2.module_from_key(key, lnk)
+        finally:
+            compilelock.module_lock_ctx = module_lock_ctx
+        assert cache2.stats[2] == 0
+        assert not cache2.full_refresh_done
+
+        # A rewrite keeps the lines appended by others since it last read
+        # the index.
+        ModuleIndex(cache1.index.filename).add('0' * 32, 'other')
+        cache2.index.rewrite(lambda dirs: dirs)
+        assert cache2.index.dirs['0' * 32] == 'other'
+        del cache2.index.dirs['0' * 32]
+        cache1.refresh(cleanup=False)
+        index = ModuleIndex(cache2.index.filename)
+        assert index.update()
+        assert '0' * 32 in index.dirs
+
+        # The index is rebuilt by a full refresh.
+        cache2.refresh()
+        index = ModuleIndex(cache2.index.filename)
+        assert index.update()
+        assert index.dirs == cache1.index.dirs
+    finally:
+        shutil.rmtree(dirname)
+
+
+def test_precompiled_header():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x = theano.tensor.dvector()
+    fgraph = theano.gof.FunctionGraph([x], [theano.tensor.tanh(x) * 3])
+    lnk = CLinker().accept(fgraph)
+    location = tempfile.mkdtemp()
+    try:
+        c_compiler, kwargs = lnk.compile_cmodule_args(location)
+        src_code = kwargs['src_code']
+        cmd_args = kwargs['preargs'] + [
+            '-I' + d for d in kwargs['include_dirs'] + std_include_dirs()]
+        args = precompiled_header_args(src_code, cmd_args)
+        assert args[0] == '-include'
+        assert os.path.exists(args[1] + '.gch')
+        # Warning flags do not change the header.
+        assert precompiled_header_args(src_code, cmd_args + ['-Wall']) == args
+        assert precompiled_header_args('#include <vector>\n' + src_code,
+                                       cmd_args) == []
+        with change_flags(**{'cmodule.precompiled_headers': True}):
+            module = lnk.compile_cmodule(location)
+        assert module.__file__.startswith(location)
+    finally:
+        shutil.rmtree(location)
+
+
+def test_evict():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    dirname = tempfile.mkdtemp()
+    try:
+        cache = ModuleCache(dirname)
+        x = theano.tensor.dvector()
+        now = time.time()
+        dirs = []
+        for i, out in enumerate([theano.tensor.tanh(x) + 1,
+                                 theano.tensor.exp(x) + 2,
+                                 theano.tensor.sin(x) + 3]):
+            lnk = CLinker().accept(theano.gof.FunctionGraph([x], [out]))
+            module = cache.module_from_key(lnk.cmodule_key(), lnk)
+            # The first module is the least recently used.
+            os.utime(module.__file__, (now - 3600 * (3 - i), now))
+            dirs.append(os.path.dirname(module.__file__))
+        # Modules loaded by the cache itself are not deleted.
+        assert cache.evict(max_entries=1, min_age=0) == 0
+
+        cache = ModuleCache(dirname)
+        assert len(cache.module_dirs_usage()) == 3
+        # Nothing was used long enough ago.
+        assert cache.evict(max_entries=1, min_age=4 * 3600) == 0
+        assert cache.evict(max_entries=1, min_age=0) == 2
+        assert [root for _, _, root in cache.module_dirs_usage()] == dirs[2:]
+        # The remaining module is still found.
+        lnk = CLinker().accept(theano.gof.FunctionGraph(
+            [x], [theano.tensor.sin(x) + 3]))
+        cache.module_from_key(lnk.cmodule_key(), lnk)
+        assert cache.stats[2] == 0
+        assert cache.evict(max_size=1e-6, min_age=0) == 0
+    finally:
+        shutil.rmtree(dirname)
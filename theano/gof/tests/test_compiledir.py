@@ -1,4 +1,17 @@
 from __future__ import absolute_import, print_function, division
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+from nose.plugins.skip import SkipTest
+from nose.tools import assert_raises
+from six import BytesIO
+
+import theano
 from theano.configdefaults import short_platform
 
 
@@ -19,3 +32,50 @@ def test_short_platform():
     ]:
         o = short_platform(r, p)
         assert o == a, (o, a)
+
+
+def test_export_import_compiled():
+    if not theano.config.cxx:
+        raise SkipTest("G++ not available, so we need to skip this test.")
+    x = theano.tensor.dvector()
+    f = theano.function([x], theano.tensor.tanh(x) * 3.5 + 1)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        archive = os.path.join(tmpdir, 'modules.tar.gz')
+        assert theano.compile.export_compiled(f, archive) >= 1
+        # Everything is already in the current compiledir.
+        assert theano.compile.import_compiled(archive) == 0
+
+        with tarfile.open(archive) as tar:
+            manifest = json.loads(
+                tar.extractfile('manifest.json').read().decode('utf-8'))
+
+        # In an empty compiledir, the function uses the imported module.
+        # (Other modules may be compiled while optimizing the graph.)
+        compiledir = os.path.join(tmpdir, 'compiledir')
+        env = dict(os.environ)
+        env['THEANO_FLAGS'] = '%s,compiledir=%s' % (
+            env.get('THEANO_FLAGS', ''), compiledir)
+        script = (
+            "import os, sys, theano\n"
+            "n = theano.compile.import_compiled(sys.argv[1])\n"
+            "x = theano.tensor.dvector()\n"
+            "f = theano.function([x], theano.tensor.tanh(x) * 3.5 + 1)\n"
+            "module = f.fn.thunks[0].thunk.module\n"
+            "print(n, os.path.basename(os.path.dirname(module.__file__)))\n")
+        out = subprocess.check_output([sys.executable, '-c', script, archive],
+                                      env=env)
+        n_installed, subdir = out.decode().split()[-2:]
+        assert int(n_installed) == len(manifest['modules'])
+        assert subdir in [m['dir'] for m in manifest['modules']]
+
+        manifest['fingerprint']['gxx_version'] = 'other'
+        other = os.path.join(tmpdir, 'other.tar.gz')
+        with tarfile.open(other, 'w:gz') as tar:
+            data = json.dumps(manifest).encode('utf-8')
+            info = tarfile.TarInfo('manifest.json')
+            info.size = len(data)
+            tar.addfile(info, BytesIO(data))
+        assert_raises(ValueError, theano.compile.import_compiled, other)
+    finally:
+        shutil.rmtree(tmpdir)
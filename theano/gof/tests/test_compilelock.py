@@ -0,0 +1,62 @@
+from __future__ import absolute_import, print_function, division
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from nose.plugins.skip import SkipTest
+
+import numpy as np
+
+import theano
+from theano.configparser import change_flags
+from theano.gof import compilelock
+
+
+def _lock_and_report(lock_dir, queue):
+    compilelock.get_lock.lock_is_enabled = True
+    with change_flags(**{'compile.lock_mode': 'per_module'}):
+        with compilelock.module_lock_ctx('other', lock_dir=lock_dir):
+            queue.put('other')
+        with compilelock.module_lock_ctx('shared', lock_dir=lock_dir):
+            queue.put('shared')
+
+
+def test_module_lock_ctx():
+    if compilelock.fcntl is None:
+        raise SkipTest("fcntl is not available.")
+    lock_dir = tempfile.mkdtemp()
+    try:
+        with change_flags(**{'compile.lock_mode': 'per_module'}):
+            assert compilelock.use_module_locks()
+            queue = multiprocessing.Queue()
+            with compilelock.module_lock_ctx('shared', lock_dir=lock_dir):
+                # Reentrant within the same process.
+                with compilelock.module_lock_ctx(['shared', 'mine'],
+                                                 lock_dir=lock_dir):
+                    pass
+                p = multiprocessing.Process(target=_lock_and_report,
+                                            args=(lock_dir, queue))
+                p.start()
+                # A different module is not blocked by our lock.
+                assert queue.get(timeout=30) == 'other'
+                time.sleep(0.5)
+                assert queue.empty()
+            # The other process gets the lock as soon as we release it.
+            assert queue.get(timeout=30) == 'shared'
+            p.join()
+            assert sorted(os.listdir(lock_dir)) == [
+                'mine.lock', 'other.lock', 'shared.lock']
+    finally:
+        shutil.rmtree(lock_dir)
+
+
+def test_per_module_lock_compile():
+    if compilelock.fcntl is None or not theano.config.cxx:
+        raise SkipTest("fcntl or g++ is not available.")
+    x = theano.tensor.dvector()
+    with change_flags(**{'compile.lock_mode': 'per_module'}):
+        f = theano.function([x], theano.tensor.tanh(x) * 3)
+    assert np.allclose(f([0., 1.]), np.tanh([0., 1.]) * 3)
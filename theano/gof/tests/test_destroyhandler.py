@@ -1,5 +1,6 @@
 from __future__ import absolute_import, print_function, division
 
+import numpy as np
 from six.moves import xrange
 from theano.gof.type import Type
 from theano.gof import graph
@@ -480,3 +481,51 @@ def test_multiple_inplace():
     OpSubOptimizer(multiple_in_place_1, multiple_in_place_0_1, fail).optimize(g)
     consistent(g)
     assert fail.failures == 1
+
+
+def test_incremental_cycle_detection():
+    # Compare the incremental cycle detection with a full check after
+    # random replacements, some of which create cycles.
+    rng = np.random.RandomState(42)
+    x, y, z = inputs()
+    variables = [x, y, z]
+    for i in xrange(30):
+        a, b = rng.randint(len(variables), size=2)
+        op = [add, dot][rng.randint(2)]
+        variables.append(op(variables[a], variables[b]))
+        variables.append(transpose_view(variables[-1]))
+    g = Env([x, y, z], variables[-4:])
+    dh = g.destroy_handler
+    n_cycles = n_valid = 0
+    for i in xrange(300):
+        all_vars = graph.variables(g.inputs, g.outputs)
+        computed = [v for v in all_vars if v.owner is not None]
+        old = computed[rng.randint(len(computed))]
+        other = all_vars[rng.randint(len(all_vars))]
+        # Views whose input depends on their output would make the
+        # DestroyHandler loop forever.
+        op = [sigmoid, add_in_place][rng.randint(2)]
+        new = op(other) if op.nin == 1 else op(other, old)
+        chk = g.checkpoint()
+        g.replace(old, new, verbose=False)
+        try:
+            ords = dh.orderings(g, ordered=False)
+        except InconsistencyError:
+            g.revert(chk)
+            continue
+        contains_cycle = destroyhandler._contains_cycle(g, ords)
+        if not dh.destroyers:
+            # Cycles are not checked then.
+            if contains_cycle:
+                g.revert(chk)
+            continue
+        try:
+            g.validate()
+        except InconsistencyError:
+            assert contains_cycle
+            n_cycles += 1
+            g.revert(chk)
+        else:
+            assert not contains_cycle
+            n_valid += 1
+    assert n_cycles > 10 and n_valid > 10
@@ -1,15 +1,18 @@
 from __future__ import absolute_import, print_function, division
 import os
+import shutil
 import numpy as np
 import theano
 import theano.tensor as T
+from theano.compile.optcache import get_optimized_graph_cache, hash_fgraph
 
 floatX = 'float32'
 
 
 def test_graph_opt_caching():
-    opt_db_file = theano.config.compiledir + '/optimized_graphs.pkl'
-    os.system('rm %s' % opt_db_file)
+    cache = get_optimized_graph_cache()
+    if os.path.isdir(cache.dirname):
+        shutil.rmtree(cache.dirname)
 
     mode = theano.config.mode
     if mode in ["DEBUG_MODE", "DebugMode"]:
@@ -22,7 +25,9 @@ def test_graph_opt_caching():
         c = theano.shared(np.ones((10, 10), dtype=floatX))
         d = theano.shared(np.ones((10, 10), dtype=floatX))
         e = T.sum(T.sum(T.sum(a ** 2 + b) + c) + d)
+        hits = cache.hits
         f1 = theano.function([a, b], e, mode=mode)
+        assert cache.hits == hits
 
         m = T.fmatrix('x1')
         n = T.fmatrix('x2')
@@ -30,12 +35,32 @@ def test_graph_opt_caching():
         q = theano.shared(np.ones((10, 10), dtype=floatX))
         j = T.sum(T.sum(T.sum(m ** 2 + n) + p) + q)
         f2 = theano.function([m, n], j, mode=mode)
+        assert cache.hits == hits + 1
+
+        # A different graph is not found in the cache.
+        k = T.sum(T.sum(T.sum(m ** 3 + n) + p) + q)
+        f3 = theano.function([m, n], k, mode=mode)
+        assert cache.hits == hits + 1
 
         in1 = np.ones((10, 10), dtype=floatX)
         in2 = np.ones((10, 10), dtype=floatX)
         assert f1(in1, in2) == f2(in1, in2)
+        assert f3(in1 * 2, in2) == f1(in1 * 2 ** 1.5, in2)
     finally:
         theano.config.cache_optimizations = default
 
+
+def test_hash_fgraph():
+    x = T.dvector('x')
+    y = T.dvector('y')
+    fg1 = theano.gof.FunctionGraph([x, y], [x * 2 + y])
+    fg2 = theano.gof.FunctionGraph([x, y], [x * 2 + y])
+    fg3 = theano.gof.FunctionGraph([x, y], [x * 3 + y])
+    fg4 = theano.gof.FunctionGraph([y, x], [x * 2 + y])
+    assert hash_fgraph(fg1) == hash_fgraph(fg2)
+    assert hash_fgraph(fg1) != hash_fgraph(fg3)
+    assert hash_fgraph(fg1) != hash_fgraph(fg4)
+
+
 if __name__ == '__main__':
     test_graph_opt_caching()
@@ -0,0 +1,96 @@
+from __future__ import absolute_import, print_function, division
+
+import numpy as np
+
+import theano
+from theano import tensor
+from theano.configparser import change_flags
+from theano.gof import vm
+
+
+def _mode(**kwargs):
+    linker = vm.VM_Linker(lazy=False, **kwargs)
+    return theano.compile.get_mode(theano.Mode(linker=linker)).excluding(
+        'fusion', 'inplace')
+
+
+@change_flags(**{'vm.memory_planner': True})
+def test_plan_memory():
+    x = tensor.vector('x')
+    z = tensor.cos(tensor.tanh(tensor.exp(x) * 2) + 1)
+    linkers = [dict(allow_gc=False, use_cloop=False),
+               dict(allow_gc=True, use_cloop=False)]
+    if theano.config.cxx:
+        linkers.append(dict(allow_gc=True, use_cloop=True))
+    val = np.arange(5).astype(theano.config.floatX)
+    expected = np.cos(np.tanh(np.exp(val) * 2) + 1)
+    for kwargs in linkers:
+        f = theano.function([x], z, mode=_mode(**kwargs))
+        plan = f.fn.memory_plan
+        assert plan is not None
+        assert plan.buffers
+        for buf in plan.buffers:
+            assert len(set(id(f.fn.storage_map[var]) for var in buf)) == 1
+            for var, next_var in zip(buf[:-1], buf[1:]):
+                assert plan.intervals[var][1] < plan.intervals[next_var][0]
+        for i in range(2):
+            assert np.allclose(f(val), expected)
+
+    with change_flags(**{'vm.memory_planner': False}):
+        f = theano.function([x], z, mode=_mode(allow_gc=False,
+                                               use_cloop=False))
+        assert f.fn.memory_plan is None
+        assert np.allclose(f(val), expected)
+
+
+@change_flags(**{'vm.memory_planner': True})
+def test_plan_memory_views():
+    x = tensor.matrix('x')
+    # a is used through its transpose until the last node, so its storage
+    # cannot be given to the other intermediate results.
+    a = tensor.exp(x)
+    b = tensor.tanh(tensor.tanh(x) + 1) * 2
+    z = (a.T + b.T).sum() + a.T.sum()
+    f = theano.function([x], z, mode=_mode(allow_gc=False, use_cloop=False))
+    plan = f.fn.memory_plan
+    a_var, = [node.outputs[0] for node in plan.order
+              if isinstance(node.op, tensor.Elemwise) and
+              isinstance(node.op.scalar_op, theano.scalar.Exp)]
+    assert all(a_var not in buf for buf in plan.buffers)
+    assert plan.intervals[a_var][1] > plan.intervals[a_var][0] + 1
+
+    val = np.random.rand(3, 4).astype(theano.config.floatX)
+    expected = ((np.exp(val).T + (np.tanh(np.tanh(val) + 1) * 2).T).sum() +
+                np.exp(val).T.sum())
+    for i in range(2):
+        assert np.allclose(f(val), expected)
+
+
+@change_flags(**{'vm.memory_planner': True})
+def test_peak_memory():
+    x = tensor.vector('x')
+    z = tensor.cos(tensor.tanh(tensor.exp(x) * 2) + 1)
+    f = theano.function([x], z, mode=_mode(allow_gc=True, use_cloop=False))
+    plan = f.fn.memory_plan
+    itemsize = np.dtype(theano.config.floatX).itemsize
+    sizes = plan.sizes([(10,)])
+    assert len(sizes) == len(plan.intervals)
+    assert all(size == 10 * itemsize for size in sizes.values())
+    # Each node holds its input and its output.
+    assert plan.peak_memory([(10,)]) == 2 * 10 * itemsize
+    assert plan.peak_memory([(10,)], planned=False) == 2 * 10 * itemsize
+
+
+@change_flags(**{'vm.memory_planner': True})
+def test_plan_memory_without_shape_feature():
+    # The shapes are not inferred at link time for the graphs the
+    # optimizer did not give a ShapeFeature to.
+    x = tensor.vector('x')
+    z = tensor.cos(tensor.tanh(tensor.exp(x) * 2) + 1)
+    mode = theano.Mode(linker=vm.VM_Linker(lazy=False, use_cloop=False),
+                       optimizer=None)
+    f = theano.function([x], z, mode=mode)
+    assert not hasattr(f.maker.fgraph, 'shape_feature')
+    assert f.fn.memory_plan is None
+    val = np.arange(5).astype(theano.config.floatX)
+    assert np.allclose(f(val), np.cos(np.tanh(np.exp(val) * 2) + 1))
@@ -12,6 +12,8 @@ from theano.gof.graph import Apply, Variable
 import theano.tensor as T
 from theano import scalar
 from theano import shared
+from theano.tensor.inplace import add_inplace
+from theano.configparser import change_flags
 
 config = theano.config
 Op = op.Op
@@ -155,6 +157,41 @@ class TestOp:
         rval = f2()
         assert rval == [0, 0]
 
+    def test_hash_consing(self):
+        x = T.vector('x')
+        with change_flags(hash_consing=True):
+            y = T.exp(x) * 2
+            # Both the exp node and the mul node, with an equal constant,
+            # are reused.
+            assert (T.exp(x) * 2) is y
+            assert T.exp(x) is not T.tanh(x)
+            # Destructive ops always get a new node.
+            assert (add_inplace(y, 1) is not
+                    add_inplace(y, 1))
+            # The nodes built on variables of a FunctionGraph are left to
+            # the MergeOptimizer.
+            fgraph = theano.FunctionGraph([x], [T.tanh(x)], clone=False)
+            assert T.exp(x) is not T.exp(x)
+            fgraph.disown()
+            with op.hash_consing_suspended():
+                assert T.exp(x) is not T.exp(x)
+            assert T.exp(x) is T.exp(x)
+        with change_flags(hash_consing=False):
+            assert T.exp(x) is not T.exp(x)
+        with change_flags(hash_consing=True):
+            g = theano.grad((T.tanh(x) * T.tanh(x)).sum(), x)
+            f = theano.function([x], g)
+
+            # The optimizers do not share nodes, without changing the
+            # config seen by the other threads.
+            class CheckOpt(theano.gof.Optimizer):
+                def apply(self, fgraph):
+                    assert config.hash_consing
+                    assert T.exp(x) is not T.exp(x)
+            CheckOpt().optimize(theano.FunctionGraph([x], [T.tanh(x)]))
+        val = np.arange(3).astype(config.floatX)
+        assert np.allclose(f(val), 2 * np.tanh(val) * (1 - np.tanh(val) ** 2))
+
 
 class TestMakeThunk(unittest.TestCase):
 
@@ -4,7 +4,7 @@ from theano.gof.type import Type
 from theano.gof.graph import Variable, Apply, Constant
 from theano.gof.op import Op
 from theano.gof.opt import (OpKeyOptimizer, PatternSub, TopoOptimizer, OpSub,
-                            MergeOptimizer, config, theano,
+                            MergeOptimizer, Optimizer, config, theano,
                             EquilibriumOptimizer, logging, pre_constant_merge,
                             pre_greedy_local_optimizer)
 from theano.gof.fg import FunctionGraph
@@ -595,6 +595,39 @@ class TestEquilibrium(object):
         # print 'after', g
         assert str(g) == '[Op1(x, y)]'
 
+    def test_incremental(self):
+        class FirstOp3Sub(Optimizer):
+            # Replaces one Op3 by an Op4 at each call.
+            def apply(self, fgraph):
+                for node in fgraph.toposort():
+                    if node.op == op3:
+                        fgraph.replace(node.outputs[0], op4(*node.inputs))
+                        return
+
+        graphs = []
+        nb_nodes = []
+        for incremental in [False, True]:
+            x, y, z = map(MyVariable, 'xyz')
+            e = z
+            for i in range(10):
+                e = op2(op3(op5(x, y), op5(y, x)), e)
+            g = FunctionGraph([x, y, z], [e])
+            opt = EquilibriumOptimizer(
+                [FirstOp3Sub(),
+                 PatternSub((op4, (op5, 'x', 'y'), 'z'), (op1, 'x', 'z'))],
+                max_use_ratio=10, incremental=incremental)
+            prof = opt.optimize(g)
+            graphs.append(str(g))
+            nb_nodes.append(prof[5])
+        assert graphs[0] == graphs[1]
+        assert 'Op3' not in graphs[1] and 'Op4' not in graphs[1]
+        assert len(nb_nodes[0]) == 11
+        # The incremental run visits all the nodes in its first and last
+        # iterations only.
+        assert len(nb_nodes[1]) == 12
+        assert max(nb_nodes[1][1:-1]) < 10
+        assert sum(nb_nodes[1]) < sum(nb_nodes[0]) / 2
+
 
 def test_pre_constant_merge_slice():
     ms = theano.tensor.type_other.MakeSlice()(1)
@@ -5,7 +5,7 @@ from theano.gof.type import Type
 from theano.gof.op import Op
 
 from theano.gof.fg import FunctionGraph
-from theano.gof.toolbox import NodeFinder
+from theano.gof.toolbox import NodeFinder, OpTypeIndex
 
 
 def as_variable(x):
@@ -86,3 +86,37 @@ class TestNodeFinder:
         for type, num in ((add, 4), (sigmoid, 3), (dot, 1)):
             if not len([t for t in g.get_nodes(type)]) == num:
                 raise Exception("Expected: %i times %s" % (num, type))
+
+
+class MyOtherOp(MyOp):
+    pass
+
+
+class TestOpTypeIndex:
+
+    def test_straightforward(self):
+        x, y, z = inputs()
+        neg = MyOtherOp(1, 'Neg')
+        e0 = dot(y, z)
+        e = add(add(sigmoid(x), neg(sigmoid(z))), dot(add(x, y), e0))
+        g = FunctionGraph([x, y, z], [e], clone=False)
+        g.attach_feature(OpTypeIndex())
+        g.attach_feature(OpTypeIndex())
+        assert len([f for f in g._features
+                    if isinstance(f, OpTypeIndex)]) == 1
+
+        assert len(g.get_nodes_by_type(MyOp)) == 8
+        assert len(g.get_nodes_by_type(MyOtherOp)) == 1
+        assert len(g.get_nodes_by_type((MyOtherOp, MyType))) == 1
+        assert len(g.get_nodes_by_type(MyOp, props={'nin': 1})) == 3
+        assert g.get_nodes_by_type(MyOp, props={'name': 'Dot'}) == [
+            dot_node for dot_node in g.toposort() if dot_node.op == dot]
+        new_e0 = add(y, z)
+        g.replace(e0, new_e0)
+        assert e0.owner not in g.get_nodes_by_type(MyOp)
+        assert len(g.get_nodes_by_type(MyOp, props={'name': 'Add'})) == 4
+
+        nodes = g.get_nodes_by_type(MyOp, ordered=True)
+        assert nodes == g.toposort()
+        g.replace(e.owner.inputs[0].owner.inputs[1], z)
+        assert g.get_nodes_by_type(MyOtherOp) == []
@@ -1,7 +1,7 @@
 from __future__ import absolute_import, print_function, division
 import theano
 from theano.gof.utils import (
-    give_variables_names, remove, unique)
+    give_variables_names, remove, unique, LRUCache)
 
 
 def test_give_variables_names():
@@ -48,6 +48,19 @@ def test_remove():
     assert list(remove(even, range(5))) == list(filter(odd, range(5)))
 
 
+def test_lru_cache():
+    cache = LRUCache(2)
+    cache['a'] = 1
+    cache['b'] = 2
+    assert cache.get('a') == 1
+    # 'b' is now the least recently used entry.
+    cache['c'] = 3
+    assert len(cache) == 2
+    assert 'b' not in cache
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
 def test_stack_trace():
     orig = theano.config.traceback.limit
     try:
@@ -407,13 +407,18 @@ def test_vm_gc():
     f([1, 2, 3])
 
 
+@theano.configparser.change_flags(**{'vm.memory_planner': True})
 def test_reallocation():
     x = tensor.scalar('x')
     y = tensor.scalar('y')
     z = tensor.tanh(3 * x + y) + tensor.cosh(x + 5 * y)
-    # The functinality is currently implement for non lazy and non c VM only.
-    for l in [vm.VM_Linker(allow_gc=False, lazy=False, use_cloop=False),
-              vm.VM_Linker(allow_gc=True, lazy=False, use_cloop=False)]:
+    # The functinality is currently implement for non lazy VM only.
+    linkers = [vm.VM_Linker(allow_gc=False, lazy=False, use_cloop=False),
+               vm.VM_Linker(allow_gc=True, lazy=False, use_cloop=False)]
+    if theano.config.cxx:
+        linkers.append(vm.VM_Linker(allow_gc=True, lazy=False,
+                                    use_cloop=True))
+    for l in linkers:
         m = theano.compile.get_mode(theano.Mode(linker=l))
         m = m.excluding('fusion', 'inplace')
 
@@ -435,7 +440,9 @@ def test_reallocation():
                             return [True, storage_map[o][0]]
             return [False, None]
 
-        assert check_storage(storage_map)[0]
+        # With allow_gc, the storage is cleared at the end of the call.
+        if not l.allow_gc:
+            assert check_storage(storage_map)[0]
         assert len(set(id(v) for v in
                        itervalues(storage_map))) < len(storage_map)
 
@@ -455,3 +462,114 @@ def test_no_recycling():
         m1 = f.fn.thunks[0].thunk.module
         m2 = f2.fn.thunks[0].thunk.module
         assert m1 is m2
+
+
+class SleepOp(theano.Op):
+    # Releases the GIL while sleeping, like numpy and BLAS calls.
+    __props__ = ('seconds',)
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def make_node(self, x):
+        x = tensor.as_tensor_variable(x)
+        return theano.Apply(self, [x], [x.type()])
+
+    def perform(self, node, inputs, outputs):
+        time.sleep(self.seconds)
+        outputs[0][0] = np.asarray(inputs[0] + self.seconds,
+                                   dtype=node.outputs[0].dtype)
+
+
+def test_parallel_vm():
+    x = tensor.vector()
+    s = theano.shared(np.zeros(3, dtype=x.dtype))
+    branches = [SleepOp(0.2 + 0.01 * i)(x * (i + 1)) for i in range(4)]
+    out = tensor.exp(branches[0] + branches[1]) * (branches[2] - branches[3])
+    ref = theano.function([x], [out, branches[0]], updates=[(s, s + out)])
+    ref_out = ref(np.arange(3, dtype=x.dtype))
+    ref_s = s.get_value()
+    s.set_value(np.zeros(3, dtype=x.dtype))
+
+    for allow_gc in [True, False]:
+        lnk = vm.VM_Linker(use_cloop=False, parallel=True, allow_gc=allow_gc,
+                           c_thunks=bool(theano.config.cxx))
+        with theano.configparser.change_flags(**{'vm.n_threads': 4}):
+            f = theano.function([x], [out, branches[0]], updates=[(s, s + out)],
+                                mode=Mode(linker=lnk))
+        assert isinstance(f.fn, vm.ParallelLoop)
+        t0 = time.time()
+        f_out = f(np.arange(3, dtype=x.dtype))
+        # The sleeping branches run at the same time.
+        assert time.time() - t0 < 0.6
+        for a, b in zip(f_out, ref_out):
+            assert np.allclose(a, b)
+        assert np.allclose(s.get_value(), ref_s)
+        s.set_value(np.zeros(3, dtype=x.dtype))
+        intermediate = [v for v in f.fn.storage_map
+                        if v.owner and v not in f.maker.fgraph.outputs]
+        assert intermediate
+        for v in intermediate:
+            assert (f.fn.storage_map[v][0] is None) == allow_gc
+
+
+def test_parallel_vm_error():
+    x = tensor.vector()
+    y = tensor.vector()
+    f = theano.function([x, y], [SleepOp(0.1)(x), x + y],
+                        mode=Mode(linker='vm_parallel'))
+    try:
+        f(np.ones(2, dtype=x.dtype), np.ones(3, dtype=x.dtype))
+    except ValueError as e:
+        assert 'Apply node that caused the error' in str(e)
+    else:
+        assert False
+    # The function can still be used.
+    assert np.allclose(f(np.ones(2, dtype=x.dtype),
+                         np.ones(2, dtype=x.dtype))[1], 2)
+
+
+def test_parallel_vm_nested():
+    # The inner function of scan is also run by a ParallelLoop.
+    x = tensor.vector()
+    mode = Mode(linker='vm_parallel')
+    with theano.configparser.change_flags(**{'vm.n_threads': 1}):
+        out, _ = theano.scan(lambda v: SleepOp(0.01)(v) * 2, sequences=[x],
+                             mode=mode)
+        f = theano.function([x], out, mode=mode)
+        assert np.allclose(f(np.arange(3, dtype=x.dtype)),
+                           (np.arange(3) + 0.01) * 2)
+
+
+def test_cancel():
+    x = tensor.vector()
+    s = theano.shared(np.zeros(2, dtype=x.dtype))
+    z = tensor.exp(x) * 2 + 1
+    linkers = [vm.VM_Linker(use_cloop=False, allow_gc=True),
+               vm.VM_Linker(use_cloop=False, allow_gc=False),
+               vm.VM_Linker(use_cloop=False, lazy=True),
+               'vm_parallel']
+    if theano.config.cxx:
+        linkers += [vm.VM_Linker(use_cloop=True, allow_gc=True),
+                    vm.VM_Linker(use_cloop=True, allow_gc=False),
+                    vm.VM_Linker(use_cloop=True, lazy=True)]
+    val = np.ones(2, dtype=x.dtype)
+    for linker in linkers:
+        f = theano.function([x], z, updates=[(s, s + z)],
+                            mode=Mode(linker=linker))
+        f.fn.cancel = RuntimeError('cancelled')
+        try:
+            f(val)
+        except RuntimeError as e:
+            # The cancellation is not reported as an error of a node.
+            assert e.args == ('cancelled',)
+            assert not hasattr(e, '__thunk_trace__')
+        else:
+            assert False
+        # The updates are not applied.
+        assert np.all(s.get_value() == 0)
+        f.fn.cancel = None
+        f.fn.release_gil = True
+        assert np.allclose(f(val), np.exp(1) * 2 + 1)
+        assert np.allclose(s.get_value(), np.exp(1) * 2 + 1)
+        s.set_value(np.zeros(2, dtype=x.dtype))
@@ -7,6 +7,7 @@ import time
 import inspect
 
 import numpy as np
+from six import iteritems
 from six.moves import StringIO
 
 import theano
@@ -661,6 +662,72 @@ class NodeFinder(Bookkeeper):
         return all
 
 
+class OpTypeIndex(Bookkeeper):
+    """
+    Index of the nodes of a FunctionGraph by the class of their op.
+
+    It adds to the FunctionGraph the method
+    ``get_nodes_by_type(op_types, props=None, ordered=False)``, which
+    returns the nodes whose op is an instance of `op_types` (a class or a
+    tuple of classes) in time proportional to their number, instead of
+    going through the whole graph. `props` is an optional dict of values
+    the attributes of the ops must have. If `ordered` is True, the nodes
+    are returned in the order of `FunctionGraph.toposort`, which still
+    sorts the whole graph when there are several of them.
+
+    """
+    pickle_rm_attr = ["get_nodes_by_type"]
+
+    def __init__(self):
+        self.fgraph = None
+        self.index = OrderedDict()
+
+    def on_attach(self, fgraph):
+        if self.fgraph is not None:
+            raise Exception("An OpTypeIndex instance can only serve one "
+                            "FunctionGraph.")
+        if hasattr(fgraph, 'get_nodes_by_type'):
+            raise AlreadyThere("OpTypeIndex is already present or in "
+                               "conflict with another plugin.")
+        self.fgraph = fgraph
+        self.unpickle(fgraph)
+        Bookkeeper.on_attach(self, fgraph)
+
+    def unpickle(self, fgraph):
+        fgraph.get_nodes_by_type = partial(self.query, fgraph)
+
+    def on_detach(self, fgraph):
+        if self.fgraph is not fgraph:
+            raise Exception("This OpTypeIndex instance was not attached to "
+                            "the provided fgraph.")
+        self.fgraph = None
+        del fgraph.get_nodes_by_type
+        self.index = OrderedDict()
+
+    def on_import(self, fgraph, node, reason):
+        self.index.setdefault(type(node.op), OrderedDict())[node] = None
+
+    def on_prune(self, fgraph, node, reason):
+        nodes = self.index[type(node.op)]
+        del nodes[node]
+        if not nodes:
+            del self.index[type(node.op)]
+
+    def query(self, fgraph, op_types, props=None, ordered=False):
+        nodes = []
+        for cls, cls_nodes in iteritems(self.index):
+            if issubclass(cls, op_types):
+                nodes.extend(cls_nodes)
+        if props:
+            nodes = [node for node in nodes
+                     if all(getattr(node.op, k, None) == v
+                            for k, v in iteritems(props))]
+        if ordered and len(nodes) > 1:
+            nodes = set(nodes)
+            nodes = [node for node in fgraph.toposort() if node in nodes]
+        return nodes
+
+
 class PrintListener(Feature):
 
     def __init__(self, active=True):
@@ -8,7 +8,7 @@ from six import iteritems, integer_types, string_types, with_metaclass
 from six.moves import StringIO
 
 from theano import config
-from theano.compat import PY3
+from theano.compat import OrderedDict, PY3
 
 
 def simple_extract_stack(f=None, limit=None, skips=[]):
@@ -263,6 +263,42 @@ def memoize(f):
     return rval
 
 
+class LRUCache(object):
+    """
+    Dictionary-like cache keeping at most `maxsize` entries.
+
+    When it is full, adding an entry removes the least recently used one.
+
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            return default
+        self._data[key] = value
+        return value
+
+    def __setitem__(self, key, value):
+        self._data.pop(key, None)
+        self._data[key] = value
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def clear(self):
+        self._data.clear()
+
+
 def deprecated(filename, msg=''):
     """
     Decorator which will print a warning message on the first call.
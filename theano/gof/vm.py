@@ -7,112 +7,25 @@ VM was a better name at some point.
 """
 from __future__ import absolute_import, print_function, division
 
-from . import link
-from collections import defaultdict
+from . import link, memplan
 import logging
+import multiprocessing
 import sys
+import threading
 import time
 import warnings
+from contextlib import contextmanager
 
 from theano.configparser import (config, _config_var_list)
 
 import theano.gof.cmodule
 
 from six import iteritems, itervalues
-from six.moves import xrange
+from six.moves import queue, xrange
 
 logger = logging.getLogger(__name__)
 
 
-def calculate_reallocate_info(order, fgraph, storage_map, compute_map_re,
-                              dependencies):
-    """
-    WRITEME : explain the parameters
-    """
-    reallocated_info = {}
-    viewed_by = {}
-    for var in fgraph.variables:
-        viewed_by[var] = []
-    view_of = {}
-    pre_allocated = set([])
-    allocated = set([])
-
-    for idx in range(len(order)):
-        node = order[idx]
-        dmap = getattr(node.op, 'destroy_map', None)
-        vmap = getattr(node.op, 'view_map', None)
-
-        idx_o = 0
-        for out in node.outputs:
-            for var in node.outputs:
-                compute_map_re[var][0] = 1
-            ins = None
-            if dmap and idx_o in dmap:
-                idx_v = dmap[idx_o]
-                assert len(idx_v) == 1, ("Here we only support the possibility"
-                                         " to destroy one input")
-                ins = node.inputs[idx_v[0]]
-            if vmap and idx_o in vmap:
-                assert ins is None
-                idx_v = vmap[idx_o]
-                assert len(idx_v) == 1, ("Here we only support the possibility"
-                                         " to view one input")
-                ins = node.inputs[idx_v[0]]
-            if ins is not None:
-                assert isinstance(ins, theano.Variable)
-                origin = view_of.get(ins, ins)
-                view_of[out] = origin
-                viewed_by[origin].append(out)
-            idx_o += 1
-
-        for ins in node.inputs:
-            assert not (ins in view_of and viewed_by[ins])
-            if (getattr(ins, 'ndim', None) == 0 and not storage_map[ins][0] and
-                    ins not in fgraph.outputs and ins.owner and
-                    all([compute_map_re[v][0]
-                         for v in dependencies.get(ins, [])]) and
-                    ins not in allocated):
-                # Constant Memory cannot be changed
-                # Constant and shared variables' storage_map value is not empty
-                reuse_out = None
-                if ins not in view_of and not viewed_by.get(ins, []):
-                    # where gc
-                    for i in range(idx + 1, len(order)):
-                        if reuse_out is not None:
-                            break
-                        for out in order[i].outputs:
-                            if (getattr(out, 'ndim', None) == 0 and
-                                    out not in pre_allocated and
-                                    ins.type == out.type):
-                                reuse_out = out
-                                pre_allocated.add(out)
-                                allocated.add(ins)
-                                break
-                elif ins in view_of:
-                    origin = view_of[ins]
-                    if ins in viewed_by[origin]:
-                        viewed_by[origin].remove(ins)
-                    if (not viewed_by[origin] and
-                            origin not in fgraph.inputs and
-                            not isinstance(origin, theano.Constant)):
-                        # where gc
-                        for i in range(idx + 1, len(order)):
-                            if reuse_out is not None:
-                                break
-                            for out in order[i].outputs:
-                                if (getattr(out, 'ndim', None) == 0 and
-                                        out not in pre_allocated and
-                                        ins.type == out.type):
-                                    reuse_out = out
-                                    pre_allocated.add(out)
-                                    allocated.add(ins)
-                                    break
-                if reuse_out is not None:
-                    reallocated_info[ins] = [ins, reuse_out]
-
-    return reallocated_info
-
-
 class VM(object):
     """
     A VM object's __call__ method evaluates a Theano program.
@@ -150,8 +63,20 @@ class VM(object):
         True indicates that Function.__call__ must implement the feedback from
         output storage to input storage. False means it *must not* repeat that
         feedback.
+    cancel
+        None, or an exception that is raised before running the next thunk.
+        It can be set by another thread to stop the current call.
+    release_gil : bool
+        If True, the CVM releases the GIL between thunks, so that the other
+        threads can run. The Python VMs always let them run.
+    trace
+        None, or a function called as ``trace(i, t0, t1)`` after thunks[i]
+        ran from time t0 to t1, when the thunks are timed.
 
     """
+    cancel = None
+    release_gil = False
+    trace = None
 
     def __init__(self, nodes, thunks, pre_call_clear):
 
@@ -190,17 +115,41 @@ class VM(object):
         """
         raise NotImplementedError('override me')
 
-    def update_profile(self, profile):
+    @contextmanager
+    def kept_storage(self, cells):
+        """
+        Context manager in which the storage `cells` are not emptied at the
+        beginning of the calls, even if they are in `pre_call_clear`.
+
+        This lets the caller put in advance the arrays in which outputs
+        should be stored.
+
+        """
+        kept = [(i, cell) for i, cell in enumerate(self.pre_call_clear)
+                if any(cell is c for c in cells)]
+        for i, cell in reversed(kept):
+            del self.pre_call_clear[i]
+        try:
+            yield
+        finally:
+            for i, cell in kept:
+                self.pre_call_clear.insert(i, cell)
+
+    def update_profile(self, profile, scale=1):
         """
         Accumulate into the profile object
+
+        The times and call counts are multiplied by `scale`, when only some
+        calls are timed.
+
         """
         for node, thunk, t, c in zip(self.nodes, self.thunks,
                                      self.call_times, self.call_counts):
             profile.apply_time.setdefault(node, 0.0)
-            profile.apply_time[node] += t
+            profile.apply_time[node] += t * scale
 
             profile.apply_callcount.setdefault(node, 0)
-            profile.apply_callcount[node] += c
+            profile.apply_callcount[node] += c * scale
 
             profile.apply_cimpl[node] = hasattr(thunk, 'cthunk')
 
@@ -234,17 +183,23 @@ class Loop(VM):
     allow_gc = False
 
     def __call__(self):
+        cancel = None
         if self.time_thunks:
             for cont in self.pre_call_clear:
                 cont[0] = None
             try:
                 for i, (thunk, node) in enumerate(zip(self.thunks,
                                                       self.nodes)):
+                    cancel = self.cancel
+                    if cancel is not None:
+                        break
                     t0 = time.time()
                     thunk()
                     t1 = time.time()
                     self.call_counts[i] += 1
                     self.call_times[i] += t1 - t0
+                    if self.trace is not None:
+                        self.trace(i, t0, t1)
             except:
                 link.raise_with_op(node, thunk)
         else:
@@ -252,9 +207,16 @@ class Loop(VM):
                 cont[0] = None
             try:
                 for thunk, node in zip(self.thunks, self.nodes):
+                    cancel = self.cancel
+                    if cancel is not None:
+                        break
                     thunk()
             except:
                 link.raise_with_op(node, thunk)
+        # The cancellation is raised here, not to be reported as an error
+        # of the node that would have run next.
+        if cancel is not None:
+            raise cancel
 
 
 class LoopGC(VM):
@@ -273,6 +235,7 @@ class LoopGC(VM):
             raise ValueError()
 
     def __call__(self):
+        cancel = None
         if self.time_thunks:
             for cont in self.pre_call_clear:
                 cont[0] = None
@@ -281,11 +244,16 @@ class LoopGC(VM):
                 for thunk, node, old_storage in zip(self.thunks,
                                                     self.nodes,
                                                     self.post_thunk_clear):
+                    cancel = self.cancel
+                    if cancel is not None:
+                        break
                     t0 = time.time()
                     thunk()
                     t1 = time.time()
                     self.call_counts[i] += 1
                     self.call_times[i] += t1 - t0
+                    if self.trace is not None:
+                        self.trace(i, t0, t1)
                     for old_s in old_storage:
                         old_s[0] = None
                     i += 1
@@ -297,11 +265,187 @@ class LoopGC(VM):
             try:
                 for thunk, node, old_storage in zip(self.thunks, self.nodes,
                                                     self.post_thunk_clear):
+                    cancel = self.cancel
+                    if cancel is not None:
+                        break
                     thunk()
                     for old_s in old_storage:
                         old_s[0] = None
             except:
                 link.raise_with_op(node, thunk)
+        if cancel is not None:
+            raise cancel
+
+
+_parallel_tasks = queue.Queue()
+_parallel_workers = []
+_parallel_workers_lock = threading.Lock()
+_parallel_local = threading.local()
+
+
+def _run_parallel_task(thunk, i, done, time_thunk, trace=None):
+    t0 = t1 = time.time() if time_thunk else 0
+    try:
+        thunk()
+        if time_thunk:
+            t1 = time.time()
+            if trace is not None:
+                # Called by the worker, to record on which thread it ran.
+                trace(i, t0, t1)
+        exc_info = None
+    except BaseException:
+        exc_info = sys.exc_info()
+    done.put((i, exc_info, t1 - t0))
+
+
+def _parallel_worker():
+    _parallel_local.in_worker = True
+    while True:
+        _run_parallel_task(*_parallel_tasks.get())
+
+
+def _start_parallel_workers(n_threads):
+    """
+    Make sure that at least `n_threads` threads run the thunks sent by the
+    ParallelLoop VMs. The threads are shared by all of them.
+
+    """
+    with _parallel_workers_lock:
+        while len(_parallel_workers) < n_threads:
+            thread = threading.Thread(
+                target=_parallel_worker,
+                name='theano-vm-worker-%i' % len(_parallel_workers))
+            thread.daemon = True
+            thread.start()
+            _parallel_workers.append(thread)
+
+
+class ParallelLoop(VM):
+    """
+    Program execution in Python by several threads.
+
+    Each node is run by a thread as soon as the nodes it depends on are
+    done: the owners of its inputs, and the nodes that must run before it
+    according to `FunctionGraph.orderings` (e.g. the readers of a variable
+    it destroys). Independent branches of the graph thus run concurrently
+    when their thunks release the GIL, as numpy and most BLAS calls do.
+    Lazy thunks are not supported.
+
+    Parameters
+    ----------
+    nodes, thunks, pre_call_clear
+        See `VM`.
+    storage_map
+        Maps each variable to its storage.
+    fgraph
+        The FunctionGraph of the nodes.
+    allow_gc : bool
+        If True, the storage of intermediate results is cleared as soon as
+        all the nodes using them are done.
+    n_threads : int
+        Maximum number of thunks running at the same time.
+
+    """
+
+    def __init__(self, nodes, thunks, pre_call_clear, storage_map, fgraph,
+                 allow_gc, n_threads):
+        super(ParallelLoop, self).__init__(nodes, thunks, pre_call_clear)
+        # Some other part of Theano query that information
+        self.allow_gc = allow_gc
+        self.n_threads = n_threads
+        node_idx = dict((node, i) for i, node in enumerate(nodes))
+        orderings = fgraph.orderings()
+        predecessors = []
+        for node in nodes:
+            preds = set(node_idx[var.owner] for var in node.inputs
+                        if var.owner in node_idx)
+            preds.update(node_idx[prereq]
+                         for prereq in orderings.get(node, []))
+            predecessors.append(preds)
+        self.n_predecessors = [len(preds) for preds in predecessors]
+        self.successors = [[] for node in nodes]
+        for i, preds in enumerate(predecessors):
+            for j in preds:
+                self.successors[j].append(i)
+        self.roots = [i for i, n in enumerate(self.n_predecessors) if n == 0]
+
+        # For each node, the storage of its inputs that may be cleared
+        # once the node is done, with an index in `n_users`.
+        self.gc_inputs = [[] for node in nodes]
+        self.n_users = []
+        if allow_gc:
+            outputs = set(fgraph.outputs)
+            gc_idx = {}
+            for i, node in enumerate(nodes):
+                for var in set(node.inputs):
+                    if var.owner not in node_idx or var in outputs:
+                        continue
+                    if var not in gc_idx:
+                        gc_idx[var] = len(self.n_users)
+                        self.n_users.append(0)
+                    self.n_users[gc_idx[var]] += 1
+                    self.gc_inputs[i].append((storage_map[var],
+                                              gc_idx[var]))
+
+    def __call__(self):
+        for cont in self.pre_call_clear:
+            cont[0] = None
+        # Functions called by a thunk (e.g. the inner function of Scan) run
+        # their nodes in the calling worker, as waiting for other workers
+        # could deadlock.
+        inline = getattr(_parallel_local, 'in_worker', False)
+        if not inline:
+            _start_parallel_workers(self.n_threads)
+        done = queue.Queue()
+        time_thunks = self.time_thunks
+        n_predecessors = list(self.n_predecessors)
+        n_users = list(self.n_users)
+        ready = list(self.roots)
+        ready.reverse()
+        n_running = 0
+        n_left = len(self.nodes)
+        failure = None
+        cancel = None
+        while n_left:
+            # Once failed or cancelled, only wait for the running thunks.
+            while (ready and n_running < self.n_threads and
+                   failure is None and cancel is None):
+                cancel = self.cancel
+                if cancel is not None:
+                    break
+                i = ready.pop()
+                if inline:
+                    _run_parallel_task(self.thunks[i], i, done, time_thunks,
+                                       self.trace)
+                else:
+                    _parallel_tasks.put((self.thunks[i], i, done,
+                                         time_thunks, self.trace))
+                n_running += 1
+            if n_running == 0:
+                break
+            i, exc_info, elapsed = done.get()
+            n_running -= 1
+            n_left -= 1
+            if exc_info is not None:
+                if failure is None:
+                    failure = (i, exc_info)
+                continue
+            if time_thunks:
+                self.call_counts[i] += 1
+                self.call_times[i] += elapsed
+            for j in self.successors[i]:
+                n_predecessors[j] -= 1
+                if n_predecessors[j] == 0:
+                    ready.append(j)
+            for storage, k in self.gc_inputs[i]:
+                n_users[k] -= 1
+                if n_users[k] == 0:
+                    storage[0] = None
+        if failure is not None:
+            i, exc_info = failure
+            link.raise_with_op(self.nodes[i], self.thunks[i], exc_info)
+        if cancel is not None:
+            raise cancel
 
 
 class Stack(VM):
@@ -396,6 +540,8 @@ class Stack(VM):
         # Profile output looks buggy if a node has run but takes 0 time.
         # (and profile code might hide real bugs if it rounds up 0)
         dt = max(time.time() - t0, 1e-10)
+        if self.trace is not None:
+            self.trace(idx, t0, t0 + dt)
         if self.callback is not None:
             self.callback(
                 node=node,
@@ -454,6 +600,8 @@ class Stack(VM):
             self.variable_offset[var] = off
 
         while apply_stack:
+            if self.cancel is not None:
+                raise self.cancel
             # Make sure something happened last time round.  This is
             # just a safety check to make sure the op is written
             # correctly apply_stack should either decrease in length
@@ -488,10 +636,14 @@ class Stack(VM):
                     try:
                         _, dt = self.run_thunk_of_node(current_apply)
                         del _
-                        if config.profile or config.print_global_stats:
+                        if self.time_thunks:
+                            # Only the sampled calls of a profile are
+                            # counted, see update_profile.
                             current_idx = self.node_idx[current_apply]
                             self.call_counts[current_idx] += 1
                             self.call_times[current_idx] += dt
+                        if config.profile or config.print_global_stats:
+                            current_idx = self.node_idx[current_apply]
                             # Computing the memory footprint of the the op
                             # ?? What about inplace .. if the op is inplace
                             # you don't actually ask for more memory!
@@ -585,9 +737,10 @@ class Stack(VM):
 
                 try:
                     requires, dt = self.run_thunk_of_node(current_apply)
-                    current_idx = self.node_idx[current_apply]
-                    self.call_counts[current_idx] += 1
-                    self.call_times[current_idx] += dt
+                    if self.time_thunks:
+                        current_idx = self.node_idx[current_apply]
+                        self.call_counts[current_idx] += 1
+                        self.call_times[current_idx] += dt
 
                 except Exception:
                     link.raise_with_op(
@@ -723,12 +876,16 @@ class VM_Linker(link.LocalLinker):
     allow_partial_eval
         If True, enforces usage of Stack or CVM, to allow for partial
         evaluation of functions (calculating a subset of outputs).
+    parallel
+        Useful only when use_cloop is False. If True, graphs without lazy
+        nodes are run by the ParallelLoop VM with config.vm.n_threads
+        threads.
 
     """
 
     def __init__(self, allow_gc=None, use_cloop=False, callback=None,
                  callback_input=None, lazy=None, schedule=None,
-                 c_thunks=None, allow_partial_eval=None):
+                 c_thunks=None, allow_partial_eval=None, parallel=False):
         # Note: if more parameters are added to __init__, make sure to forward
         # them in the "type(self)(...)" call in the "accept" method below.
         if allow_gc is None:
@@ -743,6 +900,7 @@ class VM_Linker(link.LocalLinker):
             c_thunks = bool(theano.config.cxx)
         self.c_thunks = c_thunks
         self.allow_partial_eval = allow_partial_eval
+        self.parallel = parallel
         self.updated_vars = {}
         if schedule:
             self.schedule = schedule
@@ -805,7 +963,8 @@ class VM_Linker(link.LocalLinker):
                 lazy=self.lazy,
                 schedule=self.schedule,
                 c_thunks=self.c_thunks,
-                allow_partial_eval=self.allow_partial_eval
+                allow_partial_eval=self.allow_partial_eval,
+                parallel=self.parallel
             ).accept(fgraph, no_recycling, profile)
         self.fgraph = fgraph
         self.no_recycling = no_recycling
@@ -870,6 +1029,7 @@ class VM_Linker(link.LocalLinker):
                 computed,
                 compute_map,
                 updated_vars,
+                reallocated_info=None,
                 ):
 
         pre_call_clear = [storage_map[v] for v in self.no_recycling]
@@ -927,6 +1087,12 @@ class VM_Linker(link.LocalLinker):
 
             # Needed for allow_gc=True, profiling and storage_map reuse
             dependency_map = self.compute_gc_dependencies(storage_map)
+            # The storage of a variable handing it over to the next one must
+            # be kept. Making the variable depend on the next one, which is
+            # computed after its last use, prevents clearing it during the
+            # call.
+            for var, next_var in itervalues(reallocated_info or {}):
+                dependency_map[var] = dependency_map[var] + [next_var]
             dependency_map_list = [
                 [vars_idx[d] for d in dependency_map[vars_idx_inv[i]]]
                 for i in xrange(len(vars_idx_inv))]
@@ -1007,6 +1173,8 @@ class VM_Linker(link.LocalLinker):
                 dependencies=dependency_map_list,
             )
             assert c0 == sys.getrefcount(node_n_inputs)
+            # The C code uses this same list.
+            vm.pre_call_clear = pre_call_clear
         else:
             lazy = self.lazy
             if lazy is None:
@@ -1015,7 +1183,17 @@ class VM_Linker(link.LocalLinker):
                 lazy = not all([(not th.lazy) for th in thunks])
             if not lazy:
                 # there is no conditional in the graph
-                if self.allow_gc:
+                if self.parallel:
+                    vm = ParallelLoop(
+                        nodes,
+                        thunks,
+                        pre_call_clear,
+                        storage_map,
+                        self.fgraph,
+                        self.allow_gc,
+                        config.vm.n_threads or multiprocessing.cpu_count(),
+                    )
+                elif self.allow_gc:
                     vm = LoopGC(
                         nodes,
                         thunks,
@@ -1052,46 +1230,74 @@ class VM_Linker(link.LocalLinker):
         for k in storage_map:
             compute_map[k] = [k.owner is None]
 
-        thunks = []
-
-        # Collect Reallocation Info
-        compute_map_re = defaultdict(lambda: [0])
-        for var in fgraph.inputs:
-            compute_map_re[var][0] = 1
+        lazy = self.lazy
+        if lazy is None:
+            lazy = config.vm.lazy
 
-        if getattr(fgraph.profile, 'dependencies', None):
-            dependencies = getattr(fgraph.profile, 'dependencies')
-        else:
-            dependencies = self.compute_gc_dependencies(storage_map)
+        # Reusing the storage of a variable for another one requires the
+        # nodes to run in order. The storage must be shared before the
+        # thunks are made, as they keep a reference to it.
+        memory_plan = None
+        reallocated_info = {}
+        own_storage = {}
+        if (config.vm.memory_planner and not lazy and
+                getattr(fgraph, 'shape_feature', None) is not None and
+                not ((config.profile or config.print_global_stats) and
+                     config.profile_memory) and
+                self.callback is None and self.callback_input is None and
+                not self.allow_partial_eval and not self.parallel):
+            memory_plan = memplan.plan_memory(order, fgraph)
+            reallocated_info = memory_plan.reallocated_info()
+            for buf in memory_plan.buffers:
+                for var in buf[1:]:
+                    own_storage[var] = storage_map[var]
+                    storage_map[var] = storage_map[buf[0]]
 
-        reallocated_info = calculate_reallocate_info(
-            order, fgraph, storage_map, compute_map_re, dependencies)
         t0 = time.time()
         linker_make_thunk_time = {}
         impl = None
         if self.c_thunks is False:
             impl = 'py'
-        for node in order:
+        else:
+            theano.gof.cc.compile_nodes(order, storage_map, compute_map, [])
+
+        def make_thunk(node):
             try:
                 thunk_start = time.time()
                 # no-recycling is done at each VM.__call__ So there is
                 # no need to cause duplicate c code by passing
                 # no_recycling here.
-                thunks.append(node.op.make_thunk(node,
-                                                 storage_map,
-                                                 compute_map,
-                                                 [],
-                                                 impl=impl))
+                thunk = node.op.make_thunk(node,
+                                           storage_map,
+                                           compute_map,
+                                           [],
+                                           impl=impl)
                 linker_make_thunk_time[node] = time.time() - thunk_start
-                if not hasattr(thunks[-1], 'lazy'):
+                if not hasattr(thunk, 'lazy'):
                     # We don't want all ops maker to think about lazy Ops.
                     # So if they didn't specify that its lazy or not, it isn't.
                     # If this member isn't present, it will crash later.
-                    thunks[-1].lazy = False
+                    thunk.lazy = False
+                return thunk
             except Exception as e:
                 e.args = ("The following error happened while"
                           " compiling the node", node, "\n") + e.args
                 raise
+
+        thunks = [make_thunk(node) for node in order]
+
+        if lazy is None:
+            lazy = not all([(not th.lazy) for th in thunks])
+        if lazy and memory_plan is not None:
+            # The nodes will not run in order: give each variable its own
+            # storage back and remake the thunks using it.
+            storage_map.update(own_storage)
+            memory_plan = None
+            reallocated_info = {}
+            for i, node in enumerate(order):
+                if any(var in own_storage
+                       for var in node.inputs + node.outputs):
+                    thunks[i] = make_thunk(node)
         t1 = time.time()
 
         if self.profile:
@@ -1102,16 +1308,6 @@ class VM_Linker(link.LocalLinker):
             thunk.inputs = [storage_map[v] for v in node.inputs]
             thunk.outputs = [storage_map[v] for v in node.outputs]
 
-        lazy = self.lazy
-        if lazy is None:
-            lazy = config.vm.lazy
-        if lazy is None:
-            lazy = not all([(not th.lazy) for th in thunks])
-        if not (lazy or ((config.profile or config.print_global_stats) and config.profile_memory) or
-                self.use_cloop or self.callback or self.callback_input):
-            for pair in itervalues(reallocated_info):
-                storage_map[pair[1]] = storage_map[pair[0]]
-
         computed, last_user = link.gc_helper(order)
         if self.allow_gc:
             post_thunk_clear = []
@@ -1133,10 +1329,12 @@ class VM_Linker(link.LocalLinker):
                           computed,
                           compute_map,
                           self.updated_vars,
+                          reallocated_info,
                           )
 
         vm.storage_map = storage_map
         vm.compute_map = compute_map
+        vm.memory_plan = memory_plan
 
         return (vm,
                 [link.Container(input, storage)
@@ -1154,3 +1352,5 @@ class VM_Linker(link.LocalLinker):
             self.allow_partial_eval = None
         if not hasattr(self, 'callback_input'):
             self.callback_input = None
+        if not hasattr(self, 'parallel'):
+            self.parallel = False
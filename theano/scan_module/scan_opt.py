@@ -220,10 +220,10 @@ class PushOutNonSeqScan(gof.Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(gof.toolbox.ReplaceValidate())
+        fgraph.attach_feature(gof.toolbox.OpTypeIndex())
 
     def apply(self, fgraph):
-        nodelist = [x for x in fgraph.toposort() if isinstance(x.op,
-                                                               scan_op.Scan)]
+        nodelist = fgraph.get_nodes_by_type(scan_op.Scan, ordered=True)
         for node in nodelist:
             self.process_node(fgraph, node)
 
@@ -427,10 +427,10 @@ class PushOutSeqScan(gof.Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(gof.toolbox.ReplaceValidate())
+        fgraph.attach_feature(gof.toolbox.OpTypeIndex())
 
     def apply(self, fgraph):
-        nodelist = [x for x in fgraph.toposort()
-                    if isinstance(x.op, scan_op.Scan)]
+        nodelist = fgraph.get_nodes_by_type(scan_op.Scan, ordered=True)
         for node in nodelist:
             self.process_node(fgraph, node)
 
@@ -670,15 +670,16 @@ class PushOutScanOutput(gof.Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(gof.toolbox.ReplaceValidate())
+        fgraph.attach_feature(gof.toolbox.OpTypeIndex())
 
     def apply(self, fgraph):
         # Don't perform the optimization on as_while scans. Because these scans
         # don't run for a predetermined number of steps, handling them is
         # more complicated and this optimization doesn't support it at the
         # moment.
-        nodelist = [x for x in fgraph.toposort()
-                    if (isinstance(x.op, scan_op.Scan) and
-                        not x.op.as_while)]
+        nodelist = [x for x in fgraph.get_nodes_by_type(scan_op.Scan,
+                                                        ordered=True)
+                    if not x.op.as_while]
         for node in nodelist:
             # Process the node as long as something gets optimized
             while node is not None:
@@ -921,6 +922,7 @@ class ScanInplaceOptimizer(Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(toolbox.ReplaceValidate())
+        fgraph.attach_feature(toolbox.OpTypeIndex())
         fgraph.attach_feature(DestroyHandler())
 
     def attempt_scan_inplace(self, fgraph, node, output_indices, alloc_ops):
@@ -1010,10 +1012,8 @@ class ScanInplaceOptimizer(Optimizer):
             except:
                 pass
 
-        nodes = fgraph.toposort()[::-1]
-        scan_nodes = [x for x in nodes
-                      if (isinstance(x.op, scan_op.Scan) and
-                          x.op.info['gpua'] == self.gpua_flag)]
+        nodes = fgraph.get_nodes_by_type(scan_op.Scan, ordered=True)[::-1]
+        scan_nodes = [x for x in nodes if x.op.info['gpua'] == self.gpua_flag]
         for scan_idx in xrange(len(scan_nodes)):
 
             # First attempt to make the Scan compute inplace every recurrent
@@ -1085,6 +1085,7 @@ class ScanSaveMem(gof.Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(gof.toolbox.ReplaceValidate())
+        fgraph.attach_feature(gof.toolbox.OpTypeIndex())
 
     def process_node(self, fgraph, node):
 
@@ -1615,8 +1616,7 @@ class ScanSaveMem(gof.Optimizer):
 
     def apply(self, fgraph):
 
-        nodelist = [x for x in fgraph.toposort() if isinstance(x.op,
-                                                               scan_op.Scan)]
+        nodelist = fgraph.get_nodes_by_type(scan_op.Scan, ordered=True)
         for node in nodelist:
             self.process_node(fgraph, node)
 
@@ -1629,6 +1629,7 @@ class ScanMerge(gof.Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(gof.toolbox.ReplaceValidate())
+        fgraph.attach_feature(gof.toolbox.OpTypeIndex())
 
     def merge(self, nodes):
 
@@ -1843,8 +1844,7 @@ class ScanMerge(gof.Optimizer):
 
     def apply(self, fgraph):
         # Collect all scan nodes ordered according to toposort
-        scan_nodes = [nd for nd in fgraph.toposort()
-                      if isinstance(nd.op, scan_op.Scan)]
+        scan_nodes = fgraph.get_nodes_by_type(scan_op.Scan, ordered=True)
 
         # All sets of possibly mergeable nodes
         all_sets = []
@@ -2078,11 +2078,11 @@ class PushOutDot1(gof.Optimizer):
 
     def add_requirements(self, fgraph):
         fgraph.attach_feature(toolbox.ReplaceValidate())
+        fgraph.attach_feature(toolbox.OpTypeIndex())
 
     def apply(self, fgraph):
 
-        nodes = fgraph.toposort()
-        scan_nodes = [x for x in nodes if (isinstance(x.op, scan_op.Scan))]
+        scan_nodes = fgraph.get_nodes_by_type(scan_op.Scan, ordered=True)
         for node in scan_nodes:
             self.apply_opt(fgraph, node)
 
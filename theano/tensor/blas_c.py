@@ -253,18 +253,22 @@ def ger_c_code(A, a, x, y, Z, fail, params):
                 if (PyArray_DESCR(%(Z)s)->type_num == NPY_FLOAT)
                 {
                     float alpha = ((dtype_%(a)s*)PyArray_DATA(%(a)s))[0];
+                    THEANO_BLAS_BEGIN_ALLOW_THREADS
                     sger_(&Nz0, &Nz1, &alpha,
                         (float*)x_data, &Sx,
                         (float*)y_data, &Sy,
                         (float*)(PyArray_DATA(%(Z)s)), &Sz1);
+                    THEANO_BLAS_END_ALLOW_THREADS
                 }
                 else if (PyArray_DESCR(%(Z)s)->type_num == NPY_DOUBLE)
                 {
                     double alpha = ((dtype_%(a)s*)PyArray_DATA(%(a)s))[0];
+                    THEANO_BLAS_BEGIN_ALLOW_THREADS
                     dger_(&Nz0, &Nz1, &alpha,
                         (double*)x_data, &Sx,
                         (double*)y_data, &Sy,
                         (double*)(PyArray_DATA(%(Z)s)), &Sz1);
+                    THEANO_BLAS_END_ALLOW_THREADS
 
 
                 }
@@ -279,18 +283,22 @@ def ger_c_code(A, a, x, y, Z, fail, params):
                 if (PyArray_DESCR(%(Z)s)->type_num == NPY_FLOAT)
                 {
                     float alpha = ((dtype_%(a)s*)(PyArray_DATA(%(a)s)))[0];
+                    THEANO_BLAS_BEGIN_ALLOW_THREADS
                     sger_(&Nz1, &Nz0, &alpha,
                         (float*)y_data, &Sy,
                         (float*)x_data, &Sx,
                         (float*)(PyArray_DATA(%(Z)s)), &Sz0);
+                    THEANO_BLAS_END_ALLOW_THREADS
                 }
                 else if (PyArray_DESCR(%(Z)s)->type_num == NPY_DOUBLE)
                 {
                     double alpha = ((dtype_%(a)s*)PyArray_DATA(%(a)s))[0];
+                    THEANO_BLAS_BEGIN_ALLOW_THREADS
                     dger_(&Nz1, &Nz0, &alpha,
                         (double*)y_data, &Sy,
                         (double*)x_data, &Sx,
                         (double*)(PyArray_DATA(%(Z)s)), &Sz0);
+                    THEANO_BLAS_END_ALLOW_THREADS
                 }
                 else
                 {
@@ -324,7 +332,7 @@ class CGer(BaseBLAS, Ger):
         return code
 
     def c_code_cache_version(self):
-        return (11, blas_header_version())
+        return (12, blas_header_version())
 cger_inplace = CGer(True)
 cger_no_inplace = CGer(False)
 
@@ -483,22 +491,26 @@ def gemv_c_code(y, A, x, z, alpha, beta, fail,
                 if (PyArray_DESCR(%(A)s)->type_num == NPY_FLOAT)
                 {
                     float alpha = ((dtype_%(alpha)s*)PyArray_DATA(%(alpha)s))[0];
+                    THEANO_BLAS_BEGIN_ALLOW_THREADS
                     sgemv_(&NOTRANS, &NA0, &NA1,
                         &alpha,
                         (float*)(PyArray_DATA(%(A)s)), &SA1,
                         (float*)x_data, &Sx,
                         &fbeta,
                         (float*)z_data, &Sz);
+                    THEANO_BLAS_END_ALLOW_THREADS
                 }
                 else if (PyArray_DESCR(%(A)s)->type_num == NPY_DOUBLE)
                 {
                     double alpha = ((dtype_%(alpha)s*)PyArray_DATA(%(alpha)s))[0];
+                    THEANO_BLAS_BEGIN_ALLOW_THREADS
                     dgemv_(&NOTRANS, &NA0, &NA1,
                         &alpha,
                         (double*)(PyArray_DATA(%(A)s)), &SA1,
                         (double*)x_data, &Sx,
                         &dbeta,
                         (double*)z_data, &Sz);
+                    THEANO_BLAS_END_ALLOW_THREADS
                 }
                 else
                 {
@@ -523,18 +535,22 @@ def gemv_c_code(y, A, x, z, alpha, beta, fail,
                         } else {
                           z_data[0] = 0.f;
                         }
+                        THEANO_BLAS_BEGIN_ALLOW_THREADS
                         z_data[0] += alpha*sdot_(&NA1,
                               (float*)(PyArray_DATA(%(A)s)), &SA1,
                               (float*)x_data, &Sx);
+                        THEANO_BLAS_END_ALLOW_THREADS
                     }
                     else
                     {
+                        THEANO_BLAS_BEGIN_ALLOW_THREADS
                         sgemv_(&TRANS, &NA1, &NA0,
                             &alpha,
                             (float*)(PyArray_DATA(%(A)s)), &SA0,
                             (float*)x_data, &Sx,
                             &fbeta,
                             (float*)z_data, &Sz);
+                        THEANO_BLAS_END_ALLOW_THREADS
                     }
                 }
                 else if (PyArray_DESCR(%(A)s)->type_num == NPY_DOUBLE)
@@ -551,18 +567,22 @@ def gemv_c_code(y, A, x, z, alpha, beta, fail,
                         } else {
                           z_data[0] = 0.;
                         }
+                        THEANO_BLAS_BEGIN_ALLOW_THREADS
                         z_data[0] += alpha*ddot_(&NA1,
                               (double*)(PyArray_DATA(%(A)s)), &SA1,
                               (double*)x_data, &Sx);
+                        THEANO_BLAS_END_ALLOW_THREADS
                     }
                     else
                     {
+                        THEANO_BLAS_BEGIN_ALLOW_THREADS
                         dgemv_(&TRANS, &NA1, &NA0,
                             &alpha,
                             (double*)(PyArray_DATA(%(A)s)), &SA0,
                             (double*)x_data, &Sx,
                             &dbeta,
                             (double*)z_data, &Sz);
+                        THEANO_BLAS_END_ALLOW_THREADS
                     }
                 }
                 else
@@ -614,7 +634,7 @@ class CGemv(BaseBLAS, Gemv):
         return code
 
     def c_code_cache_version(self):
-        return (14, blas_header_version(), check_force_gemv_init())
+        return (15, blas_header_version(), check_force_gemv_init())
 
 cgemv_inplace = CGemv(inplace=True)
 cgemv_no_inplace = CGemv(inplace=False)
@@ -984,6 +984,20 @@ def blas_header_text():
                     }
                     """)
 
+    if config.blas.ldflags:
+        # The BLAS routines do not touch Python objects, the Ops release
+        # the GIL around them so that other threads can run meanwhile.
+        allow_threads = ("Py_BEGIN_ALLOW_THREADS", "Py_END_ALLOW_THREADS")
+    else:
+        # The NumPy implementation of [sd]gemm_ needs the GIL.
+        allow_threads = ("{", "}")
+    header += textwrap.dedent("""\
+        #ifndef THEANO_BLAS_BEGIN_ALLOW_THREADS
+        #define THEANO_BLAS_BEGIN_ALLOW_THREADS %s
+        #define THEANO_BLAS_END_ALLOW_THREADS %s
+        #endif
+        """) % allow_threads
+
     return (header % {'const': const}) + gemm_code
 
 
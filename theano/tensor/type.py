@@ -80,19 +80,18 @@ class TensorType(Type):
         `Linker` instances to use when running a compiled graph.
 
         """
-        # Explicit error message when one accidentally uses a Variable as
-        # input (typical mistake, especially with shared variables).
-        if isinstance(data, Variable):
-            raise TypeError(
-                'Expected an array-like object, but found a Variable: '
-                'maybe you are trying to call a function on a (possibly '
-                'shared) variable instead of a numeric array?')
-
         if ((type(data) is np.ndarray) and
                 (data.dtype == self.numpy_dtype)):
             if data.dtype.num != self.numpy_dtype.num:
                 data = theano._asarray(data, dtype=self.dtype)
             # -- now fall through to ndim check
+        elif isinstance(data, Variable):
+            # Explicit error message when one accidentally uses a Variable as
+            # input (typical mistake, especially with shared variables).
+            raise TypeError(
+                'Expected an array-like object, but found a Variable: '
+                'maybe you are trying to call a function on a (possibly '
+                'shared) variable instead of a numeric array?')
         elif ((type(data) is np.memmap) and
               (data.dtype == self.numpy_dtype)):
             # numpy.memmap is a "safe" subclass of ndarray,
@@ -172,7 +171,7 @@ class TensorType(Type):
                             % (self, data, converted_data, self.dtype))
                         raise TypeError(err_msg, data)
 
-        if self.ndim != data.ndim:
+        if len(self.broadcastable) != data.ndim:
             raise TypeError("Wrong number of dimensions: expected %s,"
                             " got %s with shape %s." % (self.ndim, data.ndim,
                                                         data.shape))
@@ -42,3 +42,17 @@ class T_config(unittest.TestCase):
         assert 'T_config.test_invalid_default_b' not in THEANO_FLAGS_DICT
 
         # TODO We should remove these dummy options on test exit.
+
+    def test_config_version(self):
+        # Only the options that enter the C key change the config version,
+        # and only when their value changes.
+        import theano
+        from theano.configparser import change_flags, get_config_version
+        version = get_config_version()
+        with change_flags(compute_test_value='warn'):
+            assert get_config_version() == version
+        with change_flags(floatX=theano.config.floatX):
+            assert get_config_version() == version
+        other = 'float32' if theano.config.floatX == 'float64' else 'float64'
+        with change_flags(floatX=other):
+            assert get_config_version() != version